@@ -4,12 +4,13 @@ from cachetools import LRUCache
 from collections import namedtuple
 from functools import partial
 import inspect
-from itertools import chain, product
+from itertools import chain, islice, product
 import logging
 from multiprocessing import cpu_count, current_process
 from multiprocessing.pool import Pool
 import numpy as np
 import numpy.ma as ma
+import rasterio
 from shapely.geometry import shape
 import signal
 import six
@@ -24,7 +25,9 @@ from mapchete.commons import contours as commons_contours
 from mapchete.commons import hillshade as commons_hillshade
 from mapchete.config import MapcheteConfig
 from mapchete.tile import BufferedTile
-from mapchete.io import raster
+from mapchete.io import raster, clear_path_exists_cache, gdal_env
+from mapchete.io.prefetch import InputPrefetcher
+from mapchete.io.super_tile import SuperTileReader, super_tiles
 from mapchete.errors import (
     MapcheteProcessException, MapcheteProcessOutputError, MapcheteNodataTile
 )
@@ -34,7 +37,7 @@ logger = logging.getLogger(__name__)
 
 def open(
     config, mode="continue", zoom=None, bounds=None, single_input_file=None,
-    with_cache=False, debug=False
+    with_cache=False, debug=False, gdal_opts=None
 ):
     """
     Open a Mapchete process.
@@ -57,6 +60,9 @@ def open(
         single input file if supported by process
     with_cache : bool
         process output data cached in memory
+    gdal_opts : dictionary
+        GDAL configuration options active while processing; updates the
+        ``gdal_opts`` configuration
 
     Returns
     -------
@@ -66,7 +72,8 @@ def open(
     return Mapchete(
         MapcheteConfig(
             config, mode=mode, zoom=zoom, bounds=bounds,
-            single_input_file=single_input_file, debug=debug),
+            single_input_file=single_input_file, debug=debug,
+            gdal_opts=gdal_opts),
         with_cache=with_cache)
 
 
@@ -85,6 +92,11 @@ class Mapchete(object):
         Mapchete process configuration
     with_cache : bool
         cache processed output data in memory (default: False)
+    cache_size : integer
+        maximum number of process tiles cached (default: 512)
+    clear_caches : bool
+        clear process-wide caches when initialized and closed; disabled for
+        processes used as input of another process (default: True)
 
     Attributes
     ----------
@@ -94,7 +106,9 @@ class Mapchete(object):
         process output data cached in memory
     """
 
-    def __init__(self, config, with_cache=False):
+    def __init__(
+        self, config, with_cache=False, cache_size=512, clear_caches=True
+    ):
         """
         Initialize Mapchete processing endpoint.
 
@@ -104,6 +118,11 @@ class Mapchete(object):
             Mapchete process configuration
         with_cache : bool
             cache processed output data in memory (default: False)
+        cache_size : integer
+            maximum number of process tiles cached (default: 512)
+        clear_caches : bool
+            clear process-wide caches when initialized and closed; disabled for
+            processes used as input of another process (default: True)
         """
         logger.debug("initialize process")
         if not isinstance(config, MapcheteConfig):
@@ -111,11 +130,18 @@ class Mapchete(object):
         self.config = config
         self.process_name = self.config.process_name
         self.with_cache = True if self.config.mode == "memory" else with_cache
+        self.cache_size = cache_size
+        self.clear_caches = clear_caches
         if self.with_cache:
-            self.process_tile_cache = LRUCache(maxsize=512)
-            self.current_processes = {}
-            self.process_lock = threading.Lock()
+            self._init_cache()
         self._count_tiles_cache = {}
+        # set while tiles are processed with input prefetching
+        self._prefetcher = None
+        # set while tiles of a super-tile are processed
+        self._super_tile_reader = None
+        # remote paths could have changed since last run
+        if self.clear_caches:
+            clear_path_exists_cache()
 
     def get_process_tiles(self, zoom=None):
         """
@@ -378,26 +404,16 @@ class Mapchete(object):
                 "reprojection between processes not yet implemented"
             )
 
-        if self.config.mode == "memory":
-            # Determine affected process Tile and check whether it is already
-            # cached.
-            process_tile = self.config.process_pyramid.intersecting(tile)[0]
-            return self._extract(
-                in_tile=process_tile,
-                in_data=self._execute_using_cache(process_tile),
-                out_tile=tile
-            )
+        if self.config.mode == "memory" or (
+            self.with_cache and self.config.mode == "continue" and
+            not _baselevel_readonly
+        ):
+            return self._read_using_cache(tile)
 
         # TODO: cases where tile intersects with multiple process tiles
         process_tile = self.config.process_pyramid.intersecting(tile)[0]
 
-        # get output_tiles that intersect with current tile
-        if tile.pixelbuffer > self.config.output.pixelbuffer:
-            output_tiles = list(self.config.output_pyramid.tiles_from_bounds(
-                tile.bounds, tile.zoom
-            ))
-        else:
-            output_tiles = self.config.output_pyramid.intersecting(tile)
+        output_tiles = self._output_tiles(tile)
 
         if self.config.mode == "readonly" or _baselevel_readonly:
             if self.config.output.tiles_exist(process_tile):
@@ -414,16 +430,26 @@ class Mapchete(object):
 
     def _process_and_overwrite_output(self, tile, process_tile):
         if self.with_cache:
+            # output is written when it is cached
             output = self._execute_using_cache(process_tile)
         else:
             output = self.execute(process_tile)
-        self.write(process_tile, output)
+            self.write(process_tile, output)
         return self._extract(
             in_tile=process_tile,
             in_data=output,
             out_tile=tile
         )
 
+    def _output_tiles(self, tile):
+        # get output_tiles that intersect with current tile
+        if tile.pixelbuffer > self.config.output.pixelbuffer:
+            return list(self.config.output_pyramid.tiles_from_bounds(
+                tile.bounds, tile.zoom
+            ))
+        else:
+            return self.config.output_pyramid.intersecting(tile)
+
     def _read_existing_output(self, tile, output_tiles):
         if self.config.output.METADATA["data_type"] == "raster":
             mosaic, affine = raster.create_mosaic([
@@ -436,6 +462,46 @@ class Mapchete(object):
                 self.read(output_tile) for output_tile in output_tiles
             ]))
 
+    def _read_using_cache(self, tile):
+        # tiles with a larger pixelbuffer or metatiling than the process tiles
+        # have to be mosaicked from all process tiles they intersect with
+        process_tiles = list(
+            self.config.process_pyramid.tiles_from_bounds(tile.bounds, tile.zoom)
+        )
+        if len(process_tiles) == 1:
+            return self._extract(
+                in_tile=process_tiles[0],
+                in_data=self._execute_using_cache(process_tiles[0]),
+                out_tile=tile
+            )
+        elif self.config.output.METADATA["data_type"] == "raster":
+            mosaic, affine = raster.create_mosaic([
+                (
+                    process_tile,
+                    raster.prepare_array(
+                        self._execute_using_cache(process_tile),
+                        nodata=self.config.output.nodata,
+                        dtype=self.config.output.output_params["dtype"]
+                    )
+                )
+                for process_tile in process_tiles
+            ], nodata=self.config.output.nodata)
+            return raster.extract_from_array(mosaic, affine, tile)
+        elif self.config.output.METADATA["data_type"] == "vector":
+            return list(chain.from_iterable([
+                self._extract(
+                    in_tile=process_tile,
+                    in_data=self._execute_using_cache(process_tile),
+                    out_tile=tile
+                )
+                for process_tile in process_tiles
+            ]))
+
+    def _init_cache(self):
+        self.process_tile_cache = LRUCache(maxsize=self.cache_size)
+        self.current_processes = {}
+        self.process_lock = threading.Lock()
+
     def _execute_using_cache(self, process_tile):
         # Extract Tile subset from process Tile and return.
         try:
@@ -452,6 +518,14 @@ class Mapchete(object):
                 return self.process_tile_cache[process_tile.id]
             else:
                 try:
+                    if self.config.mode == "continue" and (
+                        self.config.output.tiles_exist(process_tile)
+                    ):
+                        output = self._read_existing_output(
+                            process_tile, self._output_tiles(process_tile)
+                        )
+                        self.process_tile_cache[process_tile.id] = output
+                        return output
                     output = self.execute(process_tile)
                     self.process_tile_cache[process_tile.id] = output
                     if self.config.mode in ["continue", "overwrite"]:
@@ -496,9 +570,13 @@ class Mapchete(object):
                 )
         # Otherwise, execute from process file.
         params = self.config.params_at_zoom(process_tile.zoom)
-        tile_process = MapcheteProcess(config=self.config, tile=process_tile)
+        tile_process = MapcheteProcess(
+            config=self.config, tile=process_tile, prefetcher=self._prefetcher,
+            super_tile_reader=self._super_tile_reader
+        )
         try:
-            with Timer() as t:
+            # GDAL options are only applied if not already active in worker
+            with Timer() as t, gdal_env(self.config.gdal_opts):
                 # Actually run process.
                 if len(inspect.getargspec(self.config.process_func).args) == 1:
                     process_data = self.config.process_func(tile_process)
@@ -588,19 +666,40 @@ class Mapchete(object):
         logger.debug((tile.id, "generated from baselevel", str(t)))
         return process_data
 
+    def __getstate__(self):
+        """Drop cached output and locks which cannot be pickled."""
+        state = self.__dict__.copy()
+        for attr in ["process_tile_cache", "current_processes", "process_lock"]:
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        """Start with an empty output cache, e.g. in a worker."""
+        self.__dict__.update(state)
+        if self.with_cache:
+            self._init_cache()
+
     def __enter__(self):
         """Enable context manager."""
         return self
 
     def __exit__(self, t, v, tb):
         """Cleanup on close."""
+        if self.config.mode in ["continue", "overwrite"]:
+            self.config.output.close()
         for ip in self.config.input.values():
             if ip is not None:
                 ip.cleanup()
+        if self.config.remote_cache is not None:
+            self.config.remote_cache.cleanup()
+        if self.config.input_cache is not None:
+            self.config.input_cache.close()
         if self.with_cache:
             self.process_tile_cache = None
             self.current_processes = None
             self.process_lock = None
+        if self.clear_caches:
+            clear_path_exists_cache()
 
 
 class MapcheteProcess(object):
@@ -618,6 +717,10 @@ class MapcheteProcess(object):
         process configuration
     params : dictionary
         process parameters
+    prefetcher : ``InputPrefetcher``
+        serves input reads from prefetched data (optional)
+    super_tile_reader : ``SuperTileReader``
+        serves input reads from data read over the super-tile (optional)
 
     Attributes
     ----------
@@ -639,7 +742,10 @@ class MapcheteProcess(object):
         process configuration
     """
 
-    def __init__(self, tile, config=None, params=None):
+    def __init__(
+        self, tile, config=None, params=None, prefetcher=None,
+        super_tile_reader=None
+    ):
         """Initialize Mapchete process."""
         self.identifier = ""
         self.title = ""
@@ -649,6 +755,8 @@ class MapcheteProcess(object):
         self.tile_pyramid = tile.tile_pyramid
         self.params = params if params else config.params_at_zoom(tile.zoom)
         self.config = config
+        self._prefetcher = prefetcher
+        self._super_tile_reader = super_tile_reader
 
     def write(self, data, **kwargs):
         """Deprecated."""
@@ -702,7 +810,11 @@ class MapcheteProcess(object):
             return input_id.open(self.tile, **kwargs)
         if input_id not in self.params["input"]:
             raise ValueError("%s not found in config as input file" % input_id)
-        return self.params["input"][input_id].open(self.tile, **kwargs)
+        input_tile = self.params["input"][input_id].open(self.tile, **kwargs)
+        for reader in [self._super_tile_reader, self._prefetcher]:
+            if reader is not None:
+                input_tile = reader.open(input_id, input_tile, **kwargs)
+        return input_tile
 
     def hillshade(
         self, elevation, azimuth=315.0, altitude=45.0, z=1.0, scale=1.0
@@ -915,9 +1027,10 @@ def _count_tiles(tiles, geometry, minzoom, maxzoom):
 ########################################
 def _run_on_single_tile(process, tile):
     logger.debug("run process on single tile")
-    process_info = _process_worker(
-        process, process.config.process_pyramid.tile(*tuple(tile))
-    )
+    with gdal_env(process.config.gdal_opts):
+        process_info = _process_worker(
+            process, process.config.process_pyramid.tile(*tuple(tile))
+        )
     return process_info
 
 
@@ -926,17 +1039,41 @@ def _run_with_multiprocessing(process, zoom_levels, multi, max_chunksize):
     num_processed = 0
     total_tiles = process.count_tiles(min(zoom_levels), max(zoom_levels))
     logger.debug("run process on %s tiles using %s workers", total_tiles, multi)
+    prefetch = process.config.prefetch
+    super_tile = process.config.super_tile
     with Timer() as t:
-        f = partial(_process_worker, process)
         for zoom in zoom_levels:
-            pool = Pool(multi, _worker_sigint_handler)
+            # existence checks done by this process do not know about tiles
+            # written by workers of the previous zoom level
+            clear_path_exists_cache()
+            pool = Pool(multi, _worker_init, (process.config.gdal_opts, ))
             try:
-                for process_info in pool.imap_unordered(
-                    f,
-                    process.get_process_tiles(zoom),
-                    # set chunksize to between 1 and max_chunksize
-                    chunksize=max_chunksize
-                ):
+                if super_tile:
+                    # neighbouring tiles are processed by the same worker
+                    results = chain.from_iterable(pool.imap_unordered(
+                        partial(_process_worker_batch, process),
+                        super_tiles(process.get_process_tiles(zoom), super_tile),
+                        chunksize=1
+                    ))
+                elif prefetch:
+                    # workers have to know their upcoming tiles to prefetch
+                    # inputs, so they receive batches of tiles
+                    results = chain.from_iterable(pool.imap_unordered(
+                        partial(_process_worker_batch, process),
+                        _batches(
+                            process.get_process_tiles(zoom),
+                            max(max_chunksize, prefetch["batch_size"])
+                        ),
+                        chunksize=1
+                    ))
+                else:
+                    results = pool.imap_unordered(
+                        partial(_process_worker, process),
+                        process.get_process_tiles(zoom),
+                        # set chunksize to between 1 and max_chunksize
+                        chunksize=max_chunksize
+                    )
+                for process_info in results:
                     num_processed += 1
                     logger.debug("tile %s/%s finished", num_processed, total_tiles)
                     yield process_info
@@ -958,10 +1095,27 @@ def _run_without_multiprocessing(process, zoom_levels):
     num_processed = 0
     total_tiles = process.count_tiles(min(zoom_levels), max(zoom_levels))
     logger.debug("run process on %s tiles using 1 worker", total_tiles)
-    with Timer() as t:
+    # keep GDAL environment active for the whole run
+    with Timer() as t, gdal_env(process.config.gdal_opts):
         for zoom in zoom_levels:
-            for process_tile in process.get_process_tiles(zoom):
-                process_info = _process_worker(process, process_tile)
+            if process.config.super_tile:
+                process_infos = chain.from_iterable(
+                    _process_super_tile(process, process_tiles)
+                    for process_tiles in super_tiles(
+                        process.get_process_tiles(zoom),
+                        process.config.super_tile
+                    )
+                )
+            elif process.config.prefetch:
+                process_infos = _process_with_prefetch(
+                    process, process.get_process_tiles(zoom)
+                )
+            else:
+                process_infos = (
+                    _process_worker(process, process_tile)
+                    for process_tile in process.get_process_tiles(zoom)
+                )
+            for process_info in process_infos:
                 num_processed += 1
                 logger.debug("tile %s/%s finished", num_processed, total_tiles)
                 yield process_info
@@ -985,10 +1139,7 @@ def _process_worker(process, process_tile):
     logger.debug((process_tile.id, "running on %s" % current_process().name))
 
     # skip execution if overwrite is disabled and tile exists
-    if (
-        process.config.mode == "continue" and
-        process.config.output.tiles_exist(process_tile)
-    ):
+    if _skip_tile(process, process_tile):
         logger.debug((process_tile.id, "tile exists, skipping"))
         return ProcessInfo(
             tile=process_tile,
@@ -1000,12 +1151,19 @@ def _process_worker(process, process_tile):
 
     # execute on process tile
     else:
+        input_cache = process.config.input_cache
+        if input_cache is not None:
+            hits, misses = input_cache.hits, input_cache.misses
         with Timer() as t:
             try:
                 output = process.execute(process_tile, raise_nodata=True)
             except MapcheteNodataTile:
                 output = None
         processor_message = "processed in %s" % t
+        if input_cache is not None:
+            hits = input_cache.hits - hits
+            reads = hits + input_cache.misses - misses
+            processor_message += ", input cache hits: %s/%s" % (hits, reads)
         logger.debug((process_tile.id, processor_message))
         writer_info = process.write(process_tile, output)
         return ProcessInfo(
@@ -1017,6 +1175,70 @@ def _process_worker(process, process_tile):
         )
 
 
+def _process_worker_batch(process, process_tiles):
+    """Worker function running the process on a batch of tiles."""
+    if process.config.super_tile:
+        return list(_process_super_tile(process, process_tiles))
+    return list(_process_with_prefetch(process, process_tiles))
+
+
+def _process_super_tile(process, process_tiles):
+    """Process neighbouring tiles while inputs are read once for all."""
+    process_tiles = list(process_tiles)
+    with SuperTileReader(
+        process.config,
+        [t for t in process_tiles if not _skip_tile(process, t)]
+    ) as reader:
+        process._super_tile_reader = reader
+        try:
+            for process_tile in process_tiles:
+                yield _process_worker(process, process_tile)
+        finally:
+            process._super_tile_reader = None
+
+
+def _process_with_prefetch(process, process_tiles):
+    """Process tiles while inputs of upcoming tiles are read."""
+    with InputPrefetcher(process.config, **process.config.prefetch) as prefetcher:
+        process._prefetcher = prefetcher
+        try:
+            for process_tile in prefetcher.tiles(
+                process_tiles, skip=partial(_skip_tile, process)
+            ):
+                yield _process_worker(process, process_tile)
+        finally:
+            process._prefetcher = None
+
+
+def _skip_tile(process, process_tile):
+    return (
+        process.config.mode == "continue" and
+        process.config.output.tiles_exist(process_tile)
+    )
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
 def _worker_sigint_handler():
     # ignore SIGINT and let everything be handled by parent process
     signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+# GDAL environment of current worker process
+_WORKER_GDAL_ENV = None
+
+
+def _worker_init(gdal_opts):
+    global _WORKER_GDAL_ENV
+    _worker_sigint_handler()
+    # keep GDAL environment active for the lifetime of the worker, so GDAL
+    # configuration and driver state are not reset on every read
+    _WORKER_GDAL_ENV = rasterio.Env(**gdal_opts)
+    _WORKER_GDAL_ENV.__enter__()
@@ -3,9 +3,8 @@
 import click
 import os
 from string import Template
-from shutil import copyfile
 from yaml import dump
-import pkg_resources
+import pkgutil
 
 from mapchete.cli import utils
 
@@ -62,16 +61,9 @@ def create(
     out_path = out_path if out_path else os.path.join(os.getcwd(), "output")
 
     # copy file template to target directory
-    process_template = pkg_resources.resource_filename(
-        "mapchete.static", "process_template.py"
-    )
     process_file = os.path.join(os.getcwd(), process_file)
-    copyfile(process_template, process_file)
-
-    # modify and copy mapchete file template to target directory
-    mapchete_template = pkg_resources.resource_filename(
-        "mapchete.static", "mapchete_template.mapchete"
-    )
+    with open(process_file, "wb") as dst:
+        dst.write(pkgutil.get_data("mapchete.static", "process_template.py"))
 
     output_options = dict(
         format=out_format, path=out_path, **FORMAT_MANDATORY[out_format]
@@ -84,8 +76,12 @@ def create(
         'output': dump({'output': output_options}, default_flow_style=False),
         'pyramid': dump({'pyramid': pyramid_options}, default_flow_style=False)
     }
-    with open(mapchete_template, 'r') as config_template:
-        config = Template(config_template.read())
-        customized_config = config.substitute(substitute_elements)
+    # modify and copy mapchete file template to target directory
+    config = Template(
+        pkgutil.get_data(
+            "mapchete.static", "mapchete_template.mapchete"
+        ).decode("utf-8")
+    )
+    customized_config = config.substitute(substitute_elements)
     with open(mapchete_file, 'w') as target_config:
         target_config.write(customized_config)
@@ -36,6 +36,7 @@ logger = logging.getLogger(__name__)
 @utils.opt_no_pbar
 @utils.opt_debug
 @utils.opt_max_chunksize
+@utils.opt_gdal_opts
 def execute(
     mapchete_files,
     zoom=None,
@@ -50,7 +51,8 @@ def execute(
     verbose=False,
     no_pbar=False,
     debug=False,
-    max_chunksize=None
+    max_chunksize=None,
+    gdal_opts=None
 ):
     """Execute a Mapchete process."""
     multi = multi if multi else cpu_count()
@@ -81,7 +83,8 @@ def execute(
             tile = _tp().tile(*tile)
             with mapchete.open(
                 mapchete_file, mode=mode, bounds=tile.bounds,
-                zoom=tile.zoom, single_input_file=input_file
+                zoom=tile.zoom, single_input_file=input_file,
+                gdal_opts=gdal_opts
             ) as mp:
                 tqdm.tqdm.write("processing 1 tile", file=verbose_dst)
                 for result in mp.batch_processor(tile=tile):
@@ -102,7 +105,8 @@ def execute(
                 bounds = bounds
             with mapchete.open(
                 mapchete_file, bounds=bounds, zoom=zoom,
-                mode=mode, single_input_file=input_file
+                mode=mode, single_input_file=input_file,
+                gdal_opts=gdal_opts
             ) as mp:
                 tiles_count = mp.count_tiles(
                     min(mp.config.init_zoom_levels),
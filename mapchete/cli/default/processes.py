@@ -1,9 +1,10 @@
 """CLI to list processes."""
 
 import click
-import pkg_resources
 import pydoc
 
+from mapchete.formats import iter_entry_points
+
 
 class c:
     PURPLE = '\033[95m'
@@ -20,7 +21,7 @@ class c:
 
 @click.command(help="List available processes.")
 def processes():
-    processes = list(pkg_resources.iter_entry_points("mapchete.processes"))
+    processes = iter_entry_points("mapchete.processes")
     print("%s processes found" % len(processes))
     for v in processes:
         process = v.load()
@@ -2,13 +2,13 @@
 """Command line utility to serve a Mapchete process."""
 
 import click
+import inspect
 import logging
 import logging.config
 import os
 import pkgutil
 from rasterio.io import MemoryFile
 import six
-from flask import (Flask, send_file, make_response, render_template_string, abort, jsonify)
 
 import mapchete
 from mapchete.cli import utils
@@ -67,6 +67,9 @@ def create_app(
     mode="continue", debug=None
 ):
     """Configure and create Flask app."""
+    # flask takes a while to import and is only needed when serving
+    from flask import Flask, render_template_string
+
     app = Flask(__name__)
     mapchete_processes = {
         os.path.splitext(os.path.basename(mapchete_file))[0]: mapchete.open(
@@ -125,9 +128,11 @@ def _get_mode(memory, readonly, overwrite):
 
 
 def _tile_response(mp, web_tile, debug):
+    from flask import abort
+
     try:
         logger.debug("getting web tile %s", str(web_tile.id))
-        return _valid_tile_response(mp, mp.get_raw_output(web_tile))
+        return _valid_tile_response(mp, mp.get_raw_output(web_tile), web_tile)
     except Exception:
         logger.exception("getting web tile %s failed", str(web_tile.id))
         if debug:
@@ -136,15 +141,28 @@ def _tile_response(mp, web_tile, debug):
             abort(500)
 
 
-def _valid_tile_response(mp, data):
-    out_data, mime_type = mp.config.output.for_web(data)
+def _valid_tile_response(mp, data, web_tile=None):
+    from flask import send_file, make_response, jsonify
+
+    out_data, mime_type = _for_web(mp.config.output, data, web_tile)
     logger.debug("create tile response %s", mime_type)
     if isinstance(out_data, MemoryFile):
         response = make_response(send_file(out_data, mime_type))
     elif isinstance(out_data, list):
         response = make_response(jsonify(data))
+    elif isinstance(out_data, bytes):
+        response = make_response(out_data)
     else:
         raise TypeError("invalid response type for web")
     response.headers['Content-Type'] = mime_type
     response.cache_control.no_write = True
     return response
+
+
+def _for_web(output, data, web_tile):
+    # output drivers of plugins can still implement for_web(data)
+    try:
+        inspect.signature(output.for_web).bind(data, tile=web_tile)
+    except TypeError:
+        return output.for_web(data)
+    return output.for_web(data, tile=web_tile)
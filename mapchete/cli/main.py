@@ -2,13 +2,12 @@
 Mapchete command line tool with subcommands.
 """
 
-from pkg_resources import iter_entry_points
-
 import click
 from click_plugins import with_plugins
 
 
 from mapchete import __version__ as version
+from mapchete.formats import iter_entry_points
 
 
 @with_plugins(iter_entry_points('mapchete.cli.commands'))
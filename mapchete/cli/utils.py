@@ -17,6 +17,26 @@ def write_verbose_msg(process_info, dst):
     )
 
 
+class _LazyChoice(click.Choice):
+    """Choice whose values are only determined when they are needed."""
+
+    def __init__(self, get_choices, **kwargs):
+        self._get_choices = get_choices
+        self._choices = None
+        super(_LazyChoice, self).__init__([], **kwargs)
+
+    @property
+    def choices(self):
+        if self._choices is None:
+            self._choices = list(self._get_choices())
+        return self._choices
+
+    @choices.setter
+    def choices(self, choices):
+        # click.Choice sets the choices on initialization
+        pass
+
+
 def _validate_zoom(ctx, param, zoom):
     if zoom:
         try:
@@ -47,6 +67,23 @@ def _validate_mapchete_files(ctx, param, mapchete_files):
     return mapchete_files
 
 
+def _validate_gdal_opts(ctx, param, gdal_opts):
+    out = {}
+    for opt in gdal_opts:
+        if "=" not in opt:
+            raise click.BadParameter("GDAL option must be in form KEY=VALUE")
+        k, v = opt.split("=", 1)
+        # some options like GDAL_CACHEMAX have to be passed on as numbers
+        for convert in [int, float]:
+            try:
+                v = convert(v)
+                break
+            except ValueError:
+                pass
+        out[k] = v
+    return out
+
+
 def _set_debug_log_level(ctx, param, debug):
     if debug:
         set_log_level(logging.DEBUG)
@@ -68,7 +105,7 @@ arg_mapchete_files = click.argument(
 )
 arg_process_file = click.argument("process_file", type=click.Path())
 arg_out_format = click.argument(
-    "out_format", type=click.Choice(available_output_formats())
+    "out_format", type=_LazyChoice(available_output_formats)
 )
 arg_input_raster = click.argument("input_raster", type=click.Path(exists=True))
 arg_out_dir = click.argument("output_dir", type=click.Path())
@@ -137,6 +174,10 @@ opt_debug = click.option(
     "--debug", "-d", is_flag=True, callback=_set_debug_log_level,
     help="Deactivate progress bar and print debug log output."
 )
+opt_gdal_opts = click.option(
+    "--gdal_opt", "gdal_opts", multiple=True, callback=_validate_gdal_opts,
+    help="GDAL configuration option in form KEY=VALUE; can be used multiple times."
+)
 opt_max_chunksize = click.option(
     "--max_chunksize", "-c", type=click.INT, default=1,
     help="Maximum number of process tiles to be queued for each  worker. (default: 1)"
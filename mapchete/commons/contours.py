@@ -1,12 +1,7 @@
 """Contour line extraction using matplotlib."""
 
-import matplotlib
 from shapely.geometry import LineString, mapping
 
-# Must be called before pyplot otherwise Travis fails
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-
 
 def extract_contours(array, tile, interval=100, field='elev', base=0):
     """
@@ -34,7 +29,7 @@ def extract_contours(array, tile, interval=100, field='elev', base=0):
         array.min(), array.max(), interval=interval, base=base)
     if not levels:
         return []
-    contours = plt.contour(array, levels)
+    contours = _pyplot().contour(array, levels)
     index = 0
     out_contours = []
     for level in range(len(contours.collections)):
@@ -59,6 +54,15 @@ def extract_contours(array, tile, interval=100, field='elev', base=0):
     return out_contours
 
 
+def _pyplot():
+    # matplotlib takes a while to import and is only needed for contours
+    import matplotlib
+    # Must be called before pyplot otherwise Travis fails
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
 def _get_contour_values(min_val, max_val, base=0, interval=100):
     """Return a list of values between min and max within an interval."""
     i = base
@@ -23,6 +23,7 @@ from shapely.geometry import box
 from shapely.ops import cascaded_union
 import six
 from tilematrix._funcs import Bounds
+import uuid
 import warnings
 import yaml
 
@@ -34,6 +35,9 @@ from mapchete.formats import (
     load_output_writer, available_output_formats, load_input_reader
 )
 from mapchete.io import absolute_path
+from mapchete.io.input_cache import INPUT_CACHE_SIZE, input_cache
+from mapchete.io.prefetch import PREFETCH_DEFAULTS
+from mapchete.io.remote_cache import RemoteFileCache
 from mapchete.tile import BufferedTilePyramid
 
 
@@ -59,6 +63,11 @@ _RESERVED_PARAMETERS = [
     "process_bounds",   # process boundaries (deprecated)
     "metatiling",       # process metatile size (deprecated)
     "pixelbuffer",      # buffer around each tile in pixels (deprecated)
+    "remote_cache",     # local disk cache for remote input files
+    "gdal_opts",        # GDAL configuration options for the whole run
+    "prefetch",         # read inputs of upcoming tiles in background threads
+    "super_tile",       # read inputs once for groups of neighbouring tiles
+    "input_cache",      # per-worker cache of decoded input arrays
 ]
 
 
@@ -87,6 +96,8 @@ class MapcheteConfig(object):
         * ``readonly``: Just read data without processing new data.
         * ``continue``: (default) Don't overwrite existing output.
         * ``overwrite``: Overwrite existing output.
+    gdal_opts : dictionary
+        GDAL configuration options updating the ``gdal_opts`` configuration
 
     Attributes
     ----------
@@ -115,6 +126,8 @@ class MapcheteConfig(object):
     baselevels : dictionary
         base zoomlevels, where data is processed; zoom levels not included are
         generated from baselevels
+    gdal_opts : dictionary
+        GDAL configuration options active while processing
 
     Deprecated Attributes:
     ----------------------
@@ -134,7 +147,7 @@ class MapcheteConfig(object):
 
     def __init__(
         self, input_config, zoom=None, bounds=None, single_input_file=None,
-        mode="continue", debug=False
+        mode="continue", debug=False, gdal_opts=None
     ):
         """Initialize configuration."""
         # get dictionary representation of input_config and
@@ -142,6 +155,7 @@ class MapcheteConfig(object):
         self._raw = _map_to_new_config(_config_to_dict(input_config))
         self._raw["init_zoom_levels"] = zoom
         self._raw["init_bounds"] = bounds
+        self._init_gdal_opts = gdal_opts
         self._cache_area_at_zoom = {}
         self._cache_full_process_area = None
 
@@ -184,7 +198,10 @@ class MapcheteConfig(object):
             logger.exception(e)
             raise MapcheteConfigError(e)
 
-        # (4) set mode
+        # (4) set mode, GDAL options, prefetching and super-tiles
+        self.gdal_opts
+        self.prefetch
+        self.super_tile
         if mode not in ["memory", "continue", "readonly", "overwrite"]:
             raise MapcheteConfigError("unknown mode %s" % mode)
         self.mode = mode
@@ -202,6 +219,8 @@ class MapcheteConfig(object):
         # depending on the inputs this action takes the longest and is done
         # in the end to let all other actions fail earlier if necessary
         logger.debug("initializing input")
+        self.remote_cache
+        self.input_cache
         self.input
 
     @cached_property
@@ -337,7 +356,10 @@ class MapcheteConfig(object):
                             path=absolute_path(path=v, base_dir=self.config_dir),
                             pyramid=self.process_pyramid,
                             pixelbuffer=self.process_pyramid.pixelbuffer,
-                            delimiters=delimiters
+                            delimiters=delimiters,
+                            remote_cache=self.remote_cache,
+                            input_cache=self.input_cache,
+                            gdal_opts=self.gdal_opts
                         ),
                         readonly=self.mode == "readonly")
                 except Exception as e:
@@ -355,7 +377,10 @@ class MapcheteConfig(object):
                             pyramid=self.process_pyramid,
                             pixelbuffer=self.process_pyramid.pixelbuffer,
                             delimiters=delimiters,
-                            conf_dir=self.config_dir
+                            conf_dir=self.config_dir,
+                            remote_cache=self.remote_cache,
+                            input_cache=self.input_cache,
+                            gdal_opts=self.gdal_opts
                         ),
                         readonly=self.mode == "readonly")
                 except Exception as e:
@@ -413,6 +438,120 @@ class MapcheteConfig(object):
             )
         )
 
+    @cached_property
+    def gdal_opts(self):
+        """
+        GDAL configuration options kept active for the whole run.
+
+        gdal_opts:
+            GDAL_CACHEMAX: 512
+            GDAL_NUM_THREADS: ALL_CPUS
+            VSI_CACHE: true
+            VSI_CACHE_SIZE: 50000000
+        """
+        gdal_opts = {}
+        for opts in [self._raw.get("gdal_opts"), self._init_gdal_opts]:
+            if opts is None:
+                continue
+            if not isinstance(opts, dict):
+                raise MapcheteConfigError("gdal_opts must be a dictionary")
+            gdal_opts.update(opts)
+        return gdal_opts
+
+    @cached_property
+    def prefetch(self):
+        """
+        Optional prefetching of inputs of upcoming process tiles.
+
+        prefetch:
+            depth: <number of upcoming tiles read ahead>
+            max_size: <maximum size of prefetched data in MB>
+            threads: <number of threads reading inputs>
+            batch_size: <number of process tiles sent to a worker at once>
+        """
+        if not self._raw.get("prefetch"):
+            return None
+        params = {} if self._raw["prefetch"] is True else self._raw["prefetch"]
+        if not isinstance(params, dict):
+            raise MapcheteConfigError("prefetch must be a dictionary or true")
+        invalid = set(params) - set(PREFETCH_DEFAULTS)
+        if invalid:
+            raise MapcheteConfigError(
+                "invalid prefetch parameters: %s" % ", ".join(sorted(invalid))
+            )
+        params = dict(PREFETCH_DEFAULTS, **params)
+        for k, v in six.iteritems(params):
+            if (
+                isinstance(v, bool) or
+                not isinstance(v, (int, float) if k == "max_size" else int) or
+                v < (0 if k == "max_size" else 1)
+            ):
+                raise MapcheteConfigError("invalid prefetch %s: %s" % (k, v))
+        return params
+
+    @cached_property
+    def super_tile(self):
+        """
+        Optional number of process tile rows and columns read at once.
+
+        super_tile: <integer>
+        """
+        super_tile = self._raw.get("super_tile")
+        if super_tile is None:
+            return None
+        if (
+            isinstance(super_tile, bool) or
+            not isinstance(super_tile, int) or
+            super_tile < 1
+        ):
+            raise MapcheteConfigError("invalid super_tile: %s" % super_tile)
+        if super_tile > 1 and self.prefetch:
+            raise MapcheteConfigError(
+                "super_tile cannot be combined with prefetch as inputs are "
+                "already read for all tiles of a super-tile"
+            )
+        return super_tile if super_tile > 1 else None
+
+    @cached_property
+    def remote_cache(self):
+        """
+        Optional local disk cache for remote input files.
+
+        remote_cache:
+            mode: <cache or stage>
+            path: <cache directory>
+            max_size: <maximum cache size in MB>
+            max_file_size: <maximum size of a cached file in MB>
+        """
+        if not self._raw.get("remote_cache"):
+            return None
+        params = dict(self._raw["remote_cache"])
+        if "path" in params:
+            params.update(
+                path=absolute_path(path=params["path"], base_dir=self.config_dir)
+            )
+        try:
+            return RemoteFileCache(**params)
+        except Exception as e:
+            raise MapcheteConfigError("invalid remote_cache configuration: %s" % e)
+
+    @cached_property
+    def input_cache(self):
+        """
+        Optional per-worker cache of decoded input arrays.
+
+        input_cache: <maximum size of cached arrays in MB or true>
+        """
+        max_size = self._raw.get("input_cache")
+        if not max_size:
+            return None
+        if max_size is True:
+            max_size = INPUT_CACHE_SIZE
+        if not isinstance(max_size, (int, float)) or max_size < 0:
+            raise MapcheteConfigError("invalid input_cache: %s" % max_size)
+        # caches of other processes in the same worker are not shared
+        return input_cache(max_size, cache_id=uuid.uuid4().hex)
+
     @cached_property
     def process_func(self):
         process_module = _load_process_module(self._raw)
@@ -493,11 +632,11 @@ class MapcheteConfig(object):
 
     def _area_at_zoom(self, zoom):
         if zoom not in self._cache_area_at_zoom:
-            # use union of all input items and, if available, intersect with
-            # init_bounds
+            # use union of all input footprints and, if available, intersect
+            # with init_bounds
             if "input" in self._params_at_zoom[zoom]:
                 input_union = cascaded_union([
-                    self.input[get_hash(v)].bbox(self.process_pyramid.crs)
+                    self.input[get_hash(v)].footprint(self.process_pyramid.crs)
                     for k, v in six.iteritems(
                         self._params_at_zoom[zoom]["input"])
                     if v is not None
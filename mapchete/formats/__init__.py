@@ -4,17 +4,109 @@ Functions handling output formats.
 This module deserves a cleaner rewrite some day.
 """
 
+from collections import OrderedDict
 import logging
 import os
-import pkg_resources
+import threading
 import warnings
 
 from mapchete import errors
 
+try:
+    from importlib.metadata import entry_points
+except ImportError:  # pragma: no cover
+    from importlib_metadata import entry_points
+
 
 logger = logging.getLogger(__name__)
 _DRIVERS_ENTRY_POINT = "mapchete.formats.drivers"
+# driver registry, filled once per process
+_ENTRY_POINTS = None
+_DRIVERS = {}
 _FILE_EXT_TO_DRIVER = {}
+_REGISTRY_LOCK = threading.RLock()
+
+
+def iter_entry_points(group):
+    """
+    Return all entry points of a group without importing them.
+
+    Parameters
+    ----------
+    group : string
+        entry point group, e.g. "mapchete.formats.drivers"
+
+    Returns
+    -------
+    entry points : list
+        ``EntryPoint`` objects providing ``name`` and ``load()``
+    """
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        return list(eps.select(group=group))
+    return list(eps.get(group, []))
+
+
+def _driver_entry_points():
+    global _ENTRY_POINTS
+    with _REGISTRY_LOCK:
+        if _ENTRY_POINTS is None:
+            _ENTRY_POINTS = OrderedDict(
+                (ep.name, ep) for ep in iter_entry_points(_DRIVERS_ENTRY_POINT)
+            )
+            if not _ENTRY_POINTS:
+                raise errors.MapcheteDriverError("no drivers could be found")
+        return _ENTRY_POINTS
+
+
+def _load_driver(name):
+    """Import driver module of entry point once and return it or None."""
+    with _REGISTRY_LOCK:
+        if name not in _DRIVERS:
+            logger.debug("load driver %s", name)
+            driver = _driver_entry_points()[name].load()
+            if not hasattr(driver, "METADATA"):
+                warnings.warn(
+                    "driver %s cannot be loaded, METADATA is missing" % name
+                )
+                driver = None
+            _DRIVERS[name] = driver
+        return _DRIVERS[name]
+
+
+def _drivers():
+    """Yield all valid driver modules, importing them if necessary."""
+    for name in _driver_entry_points():
+        driver = _load_driver(name)
+        if driver is not None:
+            yield driver
+
+
+def _find_driver(driver_name, attr):
+    """
+    Return driver module by driver name.
+
+    Entry points named like the driver (e.g. "tile_directory" for
+    "TileDirectory") are tried first, so usually only the requested driver
+    module gets imported.
+    """
+    def _normalize(name):
+        return name.lower().replace("_", "")
+
+    for name in sorted(
+        _driver_entry_points(),
+        key=lambda name: _normalize(name) != _normalize(driver_name)
+    ):
+        driver = _load_driver(name)
+        if (
+            driver is not None and
+            hasattr(driver, attr) and
+            driver.METADATA["driver_name"] == driver_name
+        ):
+            return driver
+    raise errors.MapcheteDriverError(
+        "no loader for driver '%s' could be found." % driver_name
+    )
 
 
 def _file_ext_to_driver():
@@ -22,29 +114,20 @@ def _file_ext_to_driver():
     if _FILE_EXT_TO_DRIVER:
         return _FILE_EXT_TO_DRIVER
     else:
-        _FILE_EXT_TO_DRIVER = {}
-        for v in pkg_resources.iter_entry_points(_DRIVERS_ENTRY_POINT):
-            _driver = v.load()
-            if not hasattr(_driver, "METADATA"):
-                warnings.warn(
-                    "driver %s cannot be loaded, METADATA is missing" % (
-                        str(v).split(" ")[-1]
-                    )
-                )
-                continue
-            else:
-                metadata = v.load().METADATA
+        file_ext_to_driver = {}
+        for driver in _drivers():
             try:
-                driver_name = metadata["driver_name"]
-                for ext in metadata["file_extensions"]:
-                    if ext in _FILE_EXT_TO_DRIVER:
-                        _FILE_EXT_TO_DRIVER[ext].append(driver_name)
+                driver_name = driver.METADATA["driver_name"]
+                for ext in driver.METADATA["file_extensions"]:
+                    if ext in file_ext_to_driver:
+                        file_ext_to_driver[ext].append(driver_name)
                     else:
-                        _FILE_EXT_TO_DRIVER[ext] = [driver_name]
+                        file_ext_to_driver[ext] = [driver_name]
             except Exception:
                 pass
-        if not _FILE_EXT_TO_DRIVER:
+        if not file_ext_to_driver:
             raise errors.MapcheteDriverError("no drivers could be found")
+        _FILE_EXT_TO_DRIVER = file_ext_to_driver
         return _FILE_EXT_TO_DRIVER
 
 
@@ -57,14 +140,11 @@ def available_output_formats():
     formats : list
         all available output formats
     """
-    output_formats = []
-    for v in pkg_resources.iter_entry_points(_DRIVERS_ENTRY_POINT):
-        driver_ = v.load()
-        if hasattr(driver_, "METADATA") and (
-            driver_.METADATA["mode"] in ["w", "rw"]
-        ):
-            output_formats.append(driver_.METADATA["driver_name"])
-    return output_formats
+    return [
+        driver.METADATA["driver_name"]
+        for driver in _drivers()
+        if driver.METADATA["mode"] in ["w", "rw"]
+    ]
 
 
 def available_input_formats():
@@ -76,12 +156,11 @@ def available_input_formats():
     formats : list
         all available input formats
     """
-    input_formats = []
-    for v in pkg_resources.iter_entry_points(_DRIVERS_ENTRY_POINT):
-        driver_ = v.load()
-        if hasattr(driver_, "METADATA") and (driver_.METADATA["mode"] in ["r", "rw"]):
-            input_formats.append(driver_.METADATA["driver_name"])
-    return input_formats
+    return [
+        driver.METADATA["driver_name"]
+        for driver in _drivers()
+        if driver.METADATA["mode"] in ["r", "rw"]
+    ]
 
 
 def load_output_writer(output_params, readonly=False):
@@ -95,17 +174,8 @@ def load_output_writer(output_params, readonly=False):
     """
     if not isinstance(output_params, dict):
         raise TypeError("output_params must be a dictionary")
-    driver_name = output_params["format"]
-    for v in pkg_resources.iter_entry_points(_DRIVERS_ENTRY_POINT):
-        _driver = v.load()
-        if all(
-            [hasattr(_driver, attr) for attr in ["OutputData", "METADATA"]]
-            ) and (
-            _driver.METADATA["driver_name"] == driver_name
-        ):
-            return _driver.OutputData(output_params, readonly=readonly)
-    raise errors.MapcheteDriverError(
-        "no loader for driver '%s' could be found." % driver_name
+    return _find_driver(output_params["format"], "OutputData").OutputData(
+        output_params, readonly=readonly
     )
 
 
@@ -132,14 +202,9 @@ def load_input_reader(input_params, readonly=False):
             driver_name = "TileDirectory"
     else:
         raise errors.MapcheteDriverError("invalid input parameters %s" % input_params)
-    for v in pkg_resources.iter_entry_points(_DRIVERS_ENTRY_POINT):
-        driver_ = v.load()
-        if hasattr(driver_, "METADATA") and (
-            driver_.METADATA["driver_name"] == driver_name
-        ):
-            return v.load().InputData(input_params, readonly=readonly)
-    raise errors.MapcheteDriverError(
-        "no loader for driver '%s' could be found." % driver_name)
+    return _find_driver(driver_name, "InputData").InputData(
+        input_params, readonly=readonly
+    )
 
 
 def driver_from_file(input_file):
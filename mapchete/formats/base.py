@@ -6,6 +6,7 @@ respective interfaces.
 """
 
 from mapchete.io import path_exists, write_output_metadata
+from mapchete.tile import BufferedTile
 from tilematrix import TilePyramid
 
 
@@ -36,6 +37,10 @@ class InputData(object):
         "mode": "r"
     }
 
+    # InputTile.read() only depends on bounds, shape and CRS of the tile, so
+    # inputs can be read once for a group of tiles (``SuperTile``)
+    SUPER_TILE_READS = False
+
     def __init__(self, input_params, **kwargs):
         """Initialize relevant input information."""
         self.pyramid = input_params["pyramid"]
@@ -74,6 +79,26 @@ class InputData(object):
         """
         raise NotImplementedError
 
+    def footprint(self, out_crs=None):
+        """
+        Return area covered by valid data.
+
+        Drivers which can determine their valid data area more precisely than
+        a bounding box override this method. It is used to determine the
+        process area.
+
+        Parameters
+        ----------
+        out_crs : ``rasterio.crs.CRS``
+            rasterio CRS object (default: CRS of process pyramid)
+
+        Returns
+        -------
+        footprint : geometry
+            Shapely geometry object
+        """
+        return self.bbox(out_crs=out_crs)
+
     def exists(self):
         """
         Check if data or file even exists.
@@ -223,6 +248,25 @@ class OutputData(object):
         if output_tile:
             return path_exists(self.get_path(output_tile))
 
+    def _output_windows(self, process_tile):
+        """
+        Yield output tiles with profiles and prepared paths for a process tile.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+
+        Yields
+        ------
+        (out_tile, out_profile, out_path) : tuple
+        """
+        for tile in self.pyramid.intersecting(process_tile):
+            out_path = self.get_path(tile)
+            self.prepare_path(tile)
+            out_tile = BufferedTile(tile, self.pixelbuffer)
+            yield out_tile, self.profile(out_tile), out_path
+
     def is_valid_with_config(self, config):
         """
         Check if output format is valid with other process parameters.
@@ -238,13 +282,15 @@ class OutputData(object):
         """
         raise NotImplementedError
 
-    def for_web(self, data):
+    def for_web(self, data, tile=None):
         """
         Convert data to web output (raster only).
 
         Parameters
         ----------
         data : array
+        tile : ``BufferedTile``
+            tile the data belongs to (optional)
 
         Returns
         -------
@@ -279,3 +325,7 @@ class OutputData(object):
         process : ``MapcheteProcess``
         """
         raise NotImplementedError
+
+    def close(self):
+        """Optional function called when Mapchete exits after writing output."""
+        pass
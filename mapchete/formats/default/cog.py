@@ -0,0 +1,600 @@
+"""
+Handles writing process output into one Cloud Optimized GeoTIFF.
+
+Workers write their process tiles into per-worker partial GeoPackage tile
+stores next to the output file (``<path>.partials/``), so parallel workers
+never write into the same file. When the process is closed, all partial tiles
+of the maximum zoom level written are stitched into one tiled GeoTIFF where
+every output tile covers whole internal blocks. Internal overviews are built
+by block reduction and the file is finally copied into a cloud optimized
+layout (overviews and blocks ordered, ``COPY_SRC_OVERVIEWS``).
+
+If the output file already exists, its content is kept where no new tiles
+were written, so subsequent runs can extend the file. Blocks without data are
+not written, so existing tiles are looked up in the block index of the file
+instead of being read.
+
+Partial stores of all workers and their tile indexes are loaded once per
+process and reloaded after the process wrote a tile, so partial tiles written by
+other workers in the meantime are found after the next write.
+
+output configuration parameters
+-------------------------------
+
+output pixelbuffer has to be 0
+
+mandatory
+~~~~~~~~~
+
+bands: integer
+    number of output bands to be written
+path: string
+    path to local output .tif file
+dtype: string
+    numpy datatype
+
+optional
+~~~~~~~~
+
+nodata: integer or float
+    nodata value used for writing (default: 0)
+compress: string
+    compression method (default: deflate)
+blocksize: integer
+    internal block width and height; has to be a divisor of the output tile
+    size (default: 256)
+overview_resampling: string
+    resampling method used to build overviews (default: nearest)
+"""
+
+from glob import glob
+import logging
+import numpy as np
+import numpy.ma as ma
+import os
+import rasterio
+from rasterio.enums import Resampling
+import rasterio.shutil
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+import shutil
+import six
+
+from mapchete.config import validate_values
+from mapchete.errors import MapcheteConfigError
+from mapchete.formats import base
+from mapchete.formats.default import gpkg, gtiff
+from mapchete.io import makedirs
+from mapchete.io import sqlite
+from mapchete.io.raster import memory_file, prepare_array, read_raster_window
+from mapchete.tile import BufferedTile
+
+
+logger = logging.getLogger(__name__)
+METADATA = {
+    "driver_name": "COG",
+    "data_type": "raster",
+    "mode": "w"
+}
+
+COG_DEFAULT_PARAMS = {
+    "nodata": 0,
+    "compress": "deflate",
+    "blocksize": 256,
+    "overview_resampling": "nearest"
+}
+
+# partial tile stores by process ID and output path
+_PARTIALS = {}
+
+# partial tile stores of all workers by tile index, per process ID and output
+# path
+_PARTIAL_READERS = {}
+
+# block indexes of existing output files by process ID and output path
+_EXISTING = {}
+
+# tag marking output files where blocks without data are not written
+_SPARSE_TAG = "MAPCHETE_SPARSE_BLOCKS"
+
+
+class OutputData(base.OutputData):
+    """
+    Output class for a single Cloud Optimized GeoTIFF.
+
+    Parameters
+    ----------
+    output_params : dictionary
+        output parameters from Mapchete file
+
+    Attributes
+    ----------
+    path : string
+        path to output GeoTIFF
+    partials_dir : string
+        directory containing partial outputs of workers
+    file_extension : string
+        file extension of output file (.tif)
+    output_params : dictionary
+        output parameters from Mapchete file
+    nodata : integer or float
+        nodata value used when writing GeoTIFFs
+    pixelbuffer : integer
+        buffer around output tiles
+    pyramid : ``tilematrix.TilePyramid``
+        output ``TilePyramid``
+    crs : ``rasterio.crs.CRS``
+        object describing the process coordinate reference system
+    srid : string
+        spatial reference ID of CRS (e.g. "{'init': 'epsg:4326'}")
+    """
+
+    METADATA = METADATA
+
+    def __init__(self, output_params, **kwargs):
+        """Initialize."""
+        # output is a single file, so no metadata.json is written
+        super(OutputData, self).__init__(output_params, readonly=True)
+        self.path = output_params["path"]
+        self.partials_dir = self.path + ".partials"
+        self.file_extension = ".tif"
+        self.output_params = dict(COG_DEFAULT_PARAMS, **output_params)
+        self.nodata = self.output_params["nodata"]
+
+    def read(self, output_tile):
+        """
+        Read existing process output.
+
+        Parameters
+        ----------
+        output_tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        process output : array
+        """
+        partial = self._partial_readers().get(output_tile.id)
+        if partial is not None:
+            data = partial.read(output_tile)
+            if not data.mask.all():
+                return data
+        existing = self._existing()
+        if existing is not None and existing.has_data(output_tile, self.nodata):
+            return read_raster_window(
+                self.path, output_tile, src_nodata=self.nodata,
+                dst_nodata=self.nodata
+            )
+        return self.empty(output_tile)
+
+    def write(self, process_tile, data):
+        """
+        Write data from process tile into partial output of current worker.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+        """
+        self._partial().write(process_tile, data)
+        # reload partial tile stores on next read
+        _PARTIAL_READERS.pop((os.getpid(), self.path), None)
+
+    def tiles_exist(self, process_tile=None, output_tile=None):
+        """
+        Check whether output tiles of a tile (either process or output) exists.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+        output_tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        exists : bool
+        """
+        if process_tile and output_tile:
+            raise ValueError("just one of 'process_tile' and 'output_tile' allowed")
+        tiles = [
+            BufferedTile(tile) for tile in (
+                self.pyramid.intersecting(process_tile)
+                if process_tile else [output_tile]
+            )
+        ]
+        partial_readers = self._partial_readers()
+        if any(tile.id in partial_readers for tile in tiles):
+            return True
+        existing = self._existing()
+        if existing is not None:
+            return any(existing.has_data(tile, self.nodata) for tile in tiles)
+        return False
+
+    def is_valid_with_config(self, config):
+        """
+        Check if output format is valid with other process parameters.
+
+        Parameters
+        ----------
+        config : dictionary
+            output configuration parameters
+
+        Returns
+        -------
+        is_valid : bool
+        """
+        validate_values(
+            config, [
+                ("bands", int),
+                ("path", six.string_types),
+                ("dtype", six.string_types)]
+        )
+        if os.path.splitext(config["path"])[1] not in [".tif", ".tiff"]:
+            raise MapcheteConfigError("COG output path must end with .tif")
+        if config["path"].startswith(("s3://", "http://", "https://")):
+            raise MapcheteConfigError("COG output path must be a local file")
+        if config.get("pixelbuffer", 0):
+            raise MapcheteConfigError("COG output pixelbuffer must be 0")
+        blocksize = config.get("blocksize", COG_DEFAULT_PARAMS["blocksize"])
+        if (
+            not isinstance(blocksize, int) or
+            blocksize % 16 or
+            (self.pyramid.tile_size * self.pyramid.metatiling) % blocksize
+        ):
+            raise MapcheteConfigError(
+                "COG blocksize must be a multiple of 16 and a divisor of the "
+                "output tile size"
+            )
+        if config.get(
+            "overview_resampling", COG_DEFAULT_PARAMS["overview_resampling"]
+        ) not in Resampling.__members__:
+            raise MapcheteConfigError("invalid COG overview_resampling")
+        return True
+
+    def get_path(self, tile=None):
+        """
+        Determine target file path.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        path : string
+            path to output GeoTIFF, the same for all tiles
+        """
+        return self.path
+
+    def prepare_path(self, tile=None):
+        """
+        Create directory of output GeoTIFF if necessary.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+        """
+        makedirs(os.path.dirname(self.path))
+
+    def profile(self, tile=None):
+        """
+        Create a metadata dictionary for rasterio.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+
+        Returns
+        -------
+        metadata : dictionary
+            output profile dictionary used for rasterio.
+        """
+        profile = dict(
+            driver="GTiff",
+            count=self.output_params["bands"],
+            dtype=self.output_params["dtype"],
+            nodata=self.nodata,
+            compress=self.output_params["compress"],
+            tiled=True,
+            blockxsize=self.output_params["blocksize"],
+            blockysize=self.output_params["blocksize"]
+        )
+        if tile is not None:
+            profile.update(
+                crs=tile.crs, width=tile.width, height=tile.height,
+                affine=tile.affine
+            )
+        return profile
+
+    def empty(self, process_tile):
+        """
+        Return empty data.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+
+        Returns
+        -------
+        empty data : array
+            empty array with data type provided in output profile
+        """
+        return ma.masked_array(
+            data=np.full(
+                (self.output_params["bands"], ) + process_tile.shape,
+                self.nodata,
+                dtype=self.output_params["dtype"]
+            ),
+            mask=True
+        )
+
+    def for_web(self, data, tile=None):
+        """
+        Convert data to web output (raster only).
+
+        Parameters
+        ----------
+        data : array
+        tile : ``BufferedTile``
+            tile the data belongs to (optional)
+
+        Returns
+        -------
+        web data : array
+        """
+        profile = self.profile()
+        for k in ["tiled", "blockxsize", "blockysize"]:
+            profile.pop(k)
+        return memory_file(
+            prepare_array(
+                data, masked=True, nodata=self.nodata,
+                dtype=self.output_params["dtype"]
+            ),
+            profile
+        ), "image/tiff"
+
+    def open(self, tile, process, **kwargs):
+        """
+        Open process output as input for other process.
+
+        Parameters
+        ----------
+        tile : ``Tile``
+        process : ``MapcheteProcess``
+        kwargs : keyword arguments
+        """
+        return gtiff.InputTile(tile, process, kwargs.get("resampling", None))
+
+    def close(self):
+        """Stitch partial outputs of all workers into the output GeoTIFF."""
+        partials = self._partials()
+        if not partials:
+            return
+        tiles = {}
+        for partial in partials:
+            for zoom, col, row in sqlite.query(
+                partial.path, "SELECT zoom_level, tile_column, tile_row FROM tiles"
+            ):
+                tiles[self.pyramid.tile(zoom, row, col)] = partial
+        if tiles:
+            self._stitch(tiles)
+        else:
+            logger.debug("no tiles written")
+        for partial in partials:
+            sqlite.close_connection(partial.path)
+        shutil.rmtree(self.partials_dir, ignore_errors=True)
+        for cache in [_PARTIALS, _PARTIAL_READERS, _EXISTING]:
+            for key in [k for k in cache if k[1] == self.path]:
+                del cache[key]
+
+    def _partial(self):
+        """Return partial tile store of current worker process."""
+        key = (os.getpid(), self.path)
+        if key not in _PARTIALS:
+            _PARTIALS[key] = gpkg.OutputData(
+                dict(
+                    self.output_params,
+                    format="GPKG",
+                    path=os.path.join(self.partials_dir, "%s.gpkg" % key[0]),
+                    tile_format="GTiff"
+                )
+            )
+        return _PARTIALS[key]
+
+    def _partials(self):
+        """Return partial tile stores of all workers."""
+        return [
+            gpkg.OutputData(
+                dict(
+                    self.output_params,
+                    format="GPKG",
+                    path=path,
+                    tile_format="GTiff"
+                ),
+                readonly=True
+            )
+            for path in sorted(glob(os.path.join(self.partials_dir, "*.gpkg")))
+        ]
+
+    def _partial_readers(self):
+        """Return partial tile stores of all workers by tile index."""
+        key = (os.getpid(), self.path)
+        if key not in _PARTIAL_READERS:
+            readers = {}
+            for partial in self._partials():
+                for zoom, col, row in sqlite.query(
+                    partial.path,
+                    "SELECT zoom_level, tile_column, tile_row FROM tiles"
+                ):
+                    readers.setdefault((zoom, row, col), partial)
+            _PARTIAL_READERS[key] = readers
+        return _PARTIAL_READERS[key]
+
+    def _existing(self):
+        """Return block index of existing output file or None."""
+        if not os.path.isfile(self.path):
+            return None
+        key = (os.getpid(), self.path)
+        mtime = os.path.getmtime(self.path)
+        if key not in _EXISTING or _EXISTING[key].mtime != mtime:
+            _EXISTING[key] = _ExistingOutput(self.path, mtime)
+        return _EXISTING[key]
+
+    def _stitch(self, tiles):
+        """Write tiles of maximum zoom level into output GeoTIFF."""
+        zoom = max(tile.zoom for tile in tiles)
+        skipped = len([tile for tile in tiles if tile.zoom != zoom])
+        if skipped:
+            logger.warning(
+                "%s tiles of lower zoom levels are replaced by overviews", skipped
+            )
+        tiles = {tile: partial for tile, partial in tiles.items() if tile.zoom == zoom}
+        pixel_size = self.pyramid.pixel_x_size(zoom)
+        left = min(tile.left for tile in tiles)
+        bottom = min(tile.bottom for tile in tiles)
+        right = max(tile.right for tile in tiles)
+        top = max(tile.top for tile in tiles)
+        existing = None
+        if os.path.isfile(self.path):
+            with rasterio.open(self.path) as src:
+                if np.isclose(src.res[0], pixel_size):
+                    existing = src.bounds
+                    left = min(left, existing.left)
+                    bottom = min(bottom, existing.bottom)
+                    right = max(right, existing.right)
+                    top = max(top, existing.top)
+                else:
+                    logger.warning(
+                        "resolution of %s differs, existing data is replaced",
+                        self.path
+                    )
+        profile = dict(
+            self.profile(),
+            crs=self.crs,
+            transform=from_origin(left, top, pixel_size, pixel_size),
+            width=int(round((right - left) / pixel_size)),
+            height=int(round((top - bottom) / pixel_size)),
+            BIGTIFF="IF_SAFER",
+            SPARSE_OK=True
+        )
+        stitched_path = self.path + ".stitched.tif"
+        cog_path = self.path + ".cog.tif"
+        logger.debug("stitch %s tiles into %s", len(tiles), stitched_path)
+        self.prepare_path()
+        with rasterio.open(stitched_path, "w", **profile) as dst:
+            if existing is not None:
+                with rasterio.open(self.path) as src:
+                    offset = _bounds_window(src.bounds, left, top, pixel_size)
+                    for _, window in src.block_windows(1):
+                        dst.write(
+                            src.read(window=window),
+                            window=Window(
+                                col_off=window.col_off + offset.col_off,
+                                row_off=window.row_off + offset.row_off,
+                                width=window.width,
+                                height=window.height
+                            )
+                        )
+            for tile, partial in tiles.items():
+                dst.write(
+                    partial.read(tile).filled(self.nodata),
+                    window=_bounds_window(tile.bounds(), left, top, pixel_size)
+                )
+            factors = _overview_factors(
+                max(dst.width, dst.height), self.output_params["blocksize"]
+            )
+            if factors:
+                resampling = self.output_params["overview_resampling"]
+                dst.build_overviews(factors, Resampling[resampling])
+                dst.update_tags(ns="rio_overview", resampling=resampling)
+            dst.update_tags(**{_SPARSE_TAG: "YES"})
+        # copy into cloud optimized layout with overviews before data blocks
+        logger.debug("write cloud optimized GeoTIFF %s", self.path)
+        rasterio.shutil.copy(
+            stitched_path,
+            cog_path,
+            driver="GTiff",
+            copy_src_overviews=True,
+            tiled=True,
+            blockxsize=self.output_params["blocksize"],
+            blockysize=self.output_params["blocksize"],
+            compress=self.output_params["compress"],
+            BIGTIFF="IF_SAFER",
+            SPARSE_OK=True
+        )
+        os.replace(cog_path, self.path)
+        os.remove(stitched_path)
+
+
+class _ExistingOutput(object):
+    """Block index of an existing output GeoTIFF."""
+
+    def __init__(self, path, mtime):
+        """Read offsets of all blocks of the first band."""
+        self.path = path
+        self.mtime = mtime
+        with rasterio.open(path) as src:
+            self.bounds = src.bounds
+            self.res = src.res[0]
+            self.block_height, self.block_width = src.block_shapes[0]
+            # files written without sparse blocks have to be read
+            self.blocks = None
+            if src.tags().get(_SPARSE_TAG) == "YES":
+                self.blocks = np.array([
+                    [
+                        src.get_tag_item(
+                            "BLOCK_OFFSET_%s_%s" % (col, row), "TIFF", bidx=1
+                        ) is not None
+                        for col in range(-(-src.width // self.block_width))
+                    ]
+                    for row in range(-(-src.height // self.block_height))
+                ], dtype=bool)
+
+    def has_data(self, tile, nodata):
+        """Check whether any block of the file within tile was written."""
+        if self.blocks is None or not np.isclose(tile.pixel_x_size, self.res):
+            return not read_raster_window(
+                self.path, tile, src_nodata=nodata
+            ).mask.all()
+        window = _bounds_window(
+            tile.bounds, self.bounds.left, self.bounds.top, self.res
+        )
+        row_from = max(window.row_off // self.block_height, 0)
+        row_to = -(-(window.row_off + window.height) // self.block_height)
+        col_from = max(window.col_off // self.block_width, 0)
+        col_to = -(-(window.col_off + window.width) // self.block_width)
+        if not self.blocks[row_from:max(row_to, 0), col_from:max(col_to, 0)].any():
+            return False
+        # blocks reaching beyond the tile can have data outside of it only
+        if (
+            window.row_off % self.block_height or
+            window.col_off % self.block_width or
+            window.height % self.block_height or
+            window.width % self.block_width
+        ):
+            return not read_raster_window(
+                self.path, tile, src_nodata=nodata
+            ).mask.all()
+        return True
+
+
+def _bounds_window(bounds, left, top, pixel_size):
+    return Window(
+        col_off=int(round((bounds[0] - left) / pixel_size)),
+        row_off=int(round((top - bounds[3]) / pixel_size)),
+        width=int(round((bounds[2] - bounds[0]) / pixel_size)),
+        height=int(round((bounds[3] - bounds[1]) / pixel_size))
+    )
+
+
+def _overview_factors(size, blocksize):
+    factors = []
+    factor = 2
+    while size / factor >= blocksize:
+        factors.append(factor)
+        factor *= 2
+    return factors
@@ -23,7 +23,6 @@ schema: key-value pairs
         Polygon, MultiPolygon)
 """
 
-import boto3
 import fiona
 from fiona.errors import DriverError
 import logging
@@ -34,7 +33,7 @@ import types
 from mapchete.config import validate_values
 from mapchete.formats import base
 from mapchete.io import makedirs
-from mapchete.io.vector import write_vector_window
+from mapchete.io.vector import write_vector_windows
 from mapchete.tile import BufferedTile
 
 
@@ -81,7 +80,6 @@ class OutputData(base.OutputData):
         self.path = output_params["path"]
         self.file_extension = ".geojson"
         self.output_params = output_params
-        self._bucket = self.path.split("/")[2] if self.path.startswith("s3://") else None
 
     def read(self, output_tile):
         """
@@ -128,25 +126,18 @@ class OutputData(base.OutputData):
         if not len(data):
             logger.debug("no features to write")
             return
-        # in case of S3 output, create an boto3 resource
-        bucket_resource = (
-            boto3.resource('s3').Bucket(self._bucket)
-            if self._bucket
-            else None
-        )
-
         # Convert from process_tile to output_tiles
+        out_windows = []
         for tile in self.pyramid.intersecting(process_tile):
-            out_path = self.get_path(tile)
             self.prepare_path(tile)
-            out_tile = BufferedTile(tile, self.pixelbuffer)
-            write_vector_window(
-                in_data=data,
-                out_schema=self.output_params["schema"],
-                out_tile=out_tile,
-                out_path=out_path,
-                bucket_resource=bucket_resource
+            out_windows.append(
+                (BufferedTile(tile, self.pixelbuffer), self.get_path(tile))
             )
+        write_vector_windows(
+            in_data=data,
+            out_schema=self.output_params["schema"],
+            out_windows=out_windows
+        )
 
     def is_valid_with_config(self, config):
         """
@@ -219,13 +210,15 @@ class OutputData(base.OutputData):
         """
         return []
 
-    def for_web(self, data):
+    def for_web(self, data, tile=None):
         """
         Convert data to web output (raster only).
 
         Parameters
         ----------
         data : array
+        tile : ``BufferedTile``
+            tile the data belongs to (optional)
 
         Returns
         -------
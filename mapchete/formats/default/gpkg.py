@@ -0,0 +1,754 @@
+"""
+Handles writing process output into a single GeoPackage tile store.
+
+Instead of writing one file per output tile, all tiles are stored as encoded
+blobs in the tiles table of one GeoPackage file, indexed by zoom level, column
+and row. Tiles of a process tile are written within one transaction. SQLite
+allows only one writer at a time, so parallel workers wait for each other (see
+``mapchete.io.sqlite``).
+
+The output can be used as input of other processes either by pointing to the
+.gpkg file or using it as output of a .mapchete input.
+
+output configuration parameters
+-------------------------------
+
+output pixelbuffer has to be 0
+
+mandatory
+~~~~~~~~~
+
+bands: integer
+    number of output bands to be written
+path: string
+    path to local .gpkg file
+
+optional
+~~~~~~~~
+
+dtype: string
+    numpy datatype (default: uint8)
+nodata: integer or float
+    nodata value used for writing (default: 0)
+tile_format: string
+    tile encoding, one of "PNG", "JPEG", "WEBP" or "GTiff" (default: PNG);
+    JPEG and WEBP are lossy and only support uint8, PNG supports uint8 and
+    uint16 and GTiff supports all data types
+compress: string
+    compression method for GTiff tiles (default: deflate)
+"""
+
+import json
+import logging
+import numpy as np
+import numpy.ma as ma
+import os
+from rasterio.crs import CRS
+import six
+from shapely.geometry import box
+import sqlite3
+
+from mapchete.config import validate_values
+from mapchete.errors import MapcheteConfigError
+from mapchete.formats import base, load_output_writer
+from mapchete.formats.default import gtiff
+from mapchete.io import absolute_path, makedirs, params_to_dump
+from mapchete.io import sqlite
+from mapchete.io.raster import (
+    create_mosaic, extract_from_array, prepare_array, raster_from_bytes,
+    raster_to_bytes, resample_from_array
+)
+from mapchete.io.vector import reproject_geometry
+from mapchete.tile import BufferedTile, BufferedTilePyramid
+
+
+logger = logging.getLogger(__name__)
+METADATA = {
+    "driver_name": "GPKG",
+    "data_type": "raster",
+    "mode": "rw",
+    "file_extensions": ["gpkg"]
+}
+
+GPKG_DEFAULT_PARAMS = {
+    "dtype": "uint8",
+    "nodata": 0,
+    "tile_format": "PNG",
+    "compress": "deflate"
+}
+
+# allowed data types and band counts per tile format
+TILE_FORMATS = {
+    "PNG": (["uint8", "uint16"], [1, 2, 3, 4]),
+    "JPEG": (["uint8"], [1, 3]),
+    "WEBP": (["uint8"], [3, 4]),
+    "GTiff": (None, None)
+}
+
+MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "GTiff": "image/tiff"
+}
+
+# "GPKG" as 32 bit integer, GeoPackage version 1.2
+_APPLICATION_ID = 1196444487
+_USER_VERSION = 10200
+_TABLE_NAME = "tiles"
+_CUSTOM_SRS_ID = 100000
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+        srs_name TEXT NOT NULL,
+        srs_id INTEGER NOT NULL PRIMARY KEY,
+        organization TEXT NOT NULL,
+        organization_coordsys_id INTEGER NOT NULL,
+        definition TEXT NOT NULL,
+        description TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS gpkg_contents (
+        table_name TEXT NOT NULL PRIMARY KEY,
+        data_type TEXT NOT NULL,
+        identifier TEXT UNIQUE,
+        description TEXT DEFAULT '',
+        last_change DATETIME NOT NULL DEFAULT (
+            strftime('%Y-%m-%dT%H:%M:%fZ', 'now')
+        ),
+        min_x DOUBLE,
+        min_y DOUBLE,
+        max_x DOUBLE,
+        max_y DOUBLE,
+        srs_id INTEGER,
+        CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id)
+            REFERENCES gpkg_spatial_ref_sys(srs_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS gpkg_tile_matrix_set (
+        table_name TEXT NOT NULL PRIMARY KEY,
+        srs_id INTEGER NOT NULL,
+        min_x DOUBLE NOT NULL,
+        min_y DOUBLE NOT NULL,
+        max_x DOUBLE NOT NULL,
+        max_y DOUBLE NOT NULL,
+        CONSTRAINT fk_gtms_table_name FOREIGN KEY (table_name)
+            REFERENCES gpkg_contents(table_name),
+        CONSTRAINT fk_gtms_srs FOREIGN KEY (srs_id)
+            REFERENCES gpkg_spatial_ref_sys (srs_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS gpkg_tile_matrix (
+        table_name TEXT NOT NULL,
+        zoom_level INTEGER NOT NULL,
+        matrix_width INTEGER NOT NULL,
+        matrix_height INTEGER NOT NULL,
+        tile_width INTEGER NOT NULL,
+        tile_height INTEGER NOT NULL,
+        pixel_x_size DOUBLE NOT NULL,
+        pixel_y_size DOUBLE NOT NULL,
+        CONSTRAINT pk_ttm PRIMARY KEY (table_name, zoom_level),
+        CONSTRAINT fk_tmm_table_name FOREIGN KEY (table_name)
+            REFERENCES gpkg_contents(table_name)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS %s (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        zoom_level INTEGER NOT NULL,
+        tile_column INTEGER NOT NULL,
+        tile_row INTEGER NOT NULL,
+        tile_data BLOB NOT NULL,
+        UNIQUE (zoom_level, tile_column, tile_row)
+    )
+    """ % _TABLE_NAME,
+    """
+    CREATE TABLE IF NOT EXISTS mapchete_metadata (
+        key TEXT NOT NULL PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    """
+]
+
+
+class OutputData(base.OutputData):
+    """
+    Output class for GeoPackage tile stores.
+
+    Parameters
+    ----------
+    output_params : dictionary
+        output parameters from Mapchete file
+    readonly : bool
+        if True, the GeoPackage will not be created (default: False)
+
+    Attributes
+    ----------
+    path : string
+        path to GeoPackage file
+    file_extension : string
+        file extension of output file (.gpkg)
+    output_params : dictionary
+        output parameters from Mapchete file
+    nodata : integer or float
+        nodata value used when writing tiles
+    pixelbuffer : integer
+        buffer around output tiles
+    pyramid : ``tilematrix.TilePyramid``
+        output ``TilePyramid``
+    crs : ``rasterio.crs.CRS``
+        object describing the process coordinate reference system
+    srid : string
+        spatial reference ID of CRS (e.g. "{'init': 'epsg:4326'}")
+    """
+
+    METADATA = METADATA
+
+    def __init__(self, output_params, readonly=False, **kwargs):
+        """Initialize."""
+        # metadata are stored within the GeoPackage instead of a metadata.json
+        super(OutputData, self).__init__(output_params, readonly=True)
+        self.path = output_params["path"]
+        self.file_extension = ".gpkg"
+        self.output_params = dict(GPKG_DEFAULT_PARAMS, **output_params)
+        self.nodata = self.output_params["nodata"]
+        if not readonly:
+            self._init_gpkg()
+
+    def read(self, output_tile):
+        """
+        Read existing process output.
+
+        Parameters
+        ----------
+        output_tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        process output : array
+        """
+        if not os.path.isfile(self.path):
+            return self.empty(output_tile)
+        rows = sqlite.query(
+            self.path,
+            "SELECT tile_data FROM %s WHERE zoom_level = ? AND tile_column = ? "
+            "AND tile_row = ?" % _TABLE_NAME,
+            (output_tile.zoom, output_tile.col, output_tile.row)
+        )
+        if not rows:
+            return self.empty(output_tile)
+        return raster_from_bytes(rows[0][0], nodata=self.nodata)
+
+    def write(self, process_tile, data):
+        """
+        Write data from process tile into GeoPackage.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+        """
+        data = prepare_array(
+            data,
+            masked=True,
+            nodata=self.nodata,
+            dtype=self.output_params["dtype"]
+        )
+        profile = self.profile()
+        tiles, empty_tiles = [], []
+        for tile in self.pyramid.intersecting(process_tile):
+            out_tile = BufferedTile(tile, self.pixelbuffer)
+            window = extract_from_array(
+                in_raster=data, in_affine=process_tile.affine, out_tile=out_tile
+            )
+            if window.mask.all():
+                logger.debug((out_tile.id, "empty tile"))
+                empty_tiles.append((tile.zoom, tile.col, tile.row))
+            else:
+                logger.debug((out_tile.id, "encode tile"))
+                tiles.append((
+                    tile.zoom, tile.col, tile.row,
+                    raster_to_bytes(window.filled(self.nodata), profile)
+                ))
+        # write all tiles of process tile within one transaction
+        sqlite.write_rows(self.path, [
+            (
+                "INSERT OR IGNORE INTO gpkg_tile_matrix VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._tile_matrix(process_tile.zoom)] if tiles else []
+            ),
+            (
+                "INSERT OR REPLACE INTO %s "
+                "(zoom_level, tile_column, tile_row, tile_data) "
+                "VALUES (?, ?, ?, ?)" % _TABLE_NAME,
+                tiles
+            ),
+            (
+                "DELETE FROM %s WHERE zoom_level = ? AND tile_column = ? "
+                "AND tile_row = ?" % _TABLE_NAME,
+                empty_tiles
+            )
+        ])
+
+    def tiles_exist(self, process_tile=None, output_tile=None):
+        """
+        Check whether output tiles of a tile (either process or output) exists.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+        output_tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        exists : bool
+        """
+        if process_tile and output_tile:
+            raise ValueError("just one of 'process_tile' and 'output_tile' allowed")
+        if not os.path.isfile(self.path):
+            return False
+        tiles = list(
+            self.pyramid.intersecting(process_tile) if process_tile else [output_tile]
+        )
+        # range query uses the (zoom_level, tile_column, tile_row) index
+        return bool(sqlite.query(
+            self.path,
+            "SELECT EXISTS (SELECT 1 FROM %s WHERE zoom_level = ? "
+            "AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?)" % (
+                _TABLE_NAME
+            ),
+            (
+                tiles[0].zoom,
+                min(t.col for t in tiles), max(t.col for t in tiles),
+                min(t.row for t in tiles), max(t.row for t in tiles)
+            )
+        )[0][0])
+
+    def is_valid_with_config(self, config):
+        """
+        Check if output format is valid with other process parameters.
+
+        Parameters
+        ----------
+        config : dictionary
+            output configuration parameters
+
+        Returns
+        -------
+        is_valid : bool
+        """
+        validate_values(config, [("bands", int), ("path", six.string_types)])
+        if not config["path"].endswith(self.file_extension):
+            raise MapcheteConfigError("GPKG output path must end with .gpkg")
+        if config["path"].startswith(("s3://", "http://", "https://")):
+            raise MapcheteConfigError("GPKG output path must be a local file")
+        if config.get("pixelbuffer", 0):
+            raise MapcheteConfigError("GPKG output pixelbuffer must be 0")
+        tile_format = config.get("tile_format", GPKG_DEFAULT_PARAMS["tile_format"])
+        if tile_format not in TILE_FORMATS:
+            raise MapcheteConfigError(
+                "GPKG tile_format must be one of %s" % list(TILE_FORMATS)
+            )
+        dtypes, counts = TILE_FORMATS[tile_format]
+        dtype = config.get("dtype", GPKG_DEFAULT_PARAMS["dtype"])
+        if dtypes and dtype not in dtypes:
+            raise MapcheteConfigError(
+                "%s tiles only support data types %s" % (tile_format, dtypes)
+            )
+        if counts and config["bands"] not in counts:
+            raise MapcheteConfigError(
+                "%s tiles only support band counts %s" % (tile_format, counts)
+            )
+        return True
+
+    def get_path(self, tile=None):
+        """
+        Determine target file path.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        path : string
+            path to GeoPackage, the same for all tiles
+        """
+        return self.path
+
+    def prepare_path(self, tile=None):
+        """
+        Create directory of GeoPackage if necessary.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+        """
+        makedirs(os.path.dirname(self.path))
+
+    def profile(self, tile=None):
+        """
+        Create a metadata dictionary for rasterio.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+
+        Returns
+        -------
+        metadata : dictionary
+            profile dictionary used to encode tiles
+        """
+        profile = dict(
+            driver=self.output_params["tile_format"],
+            count=self.output_params["bands"],
+            dtype=self.output_params["dtype"],
+            nodata=self.nodata
+        )
+        if profile["driver"] == "GTiff":
+            profile.update(compress=self.output_params["compress"])
+        if tile is not None:
+            profile.update(width=tile.width, height=tile.height)
+        return profile
+
+    def empty(self, process_tile):
+        """
+        Return empty data.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+
+        Returns
+        -------
+        empty data : array
+            empty array with data type provided in output profile
+        """
+        return ma.masked_array(
+            data=np.full(
+                (self.output_params["bands"], ) + process_tile.shape,
+                self.nodata,
+                dtype=self.output_params["dtype"]
+            ),
+            mask=True
+        )
+
+    def for_web(self, data, tile=None):
+        """
+        Convert data to web output.
+
+        Parameters
+        ----------
+        data : array
+        tile : ``BufferedTile``
+            tile the data belongs to (optional)
+
+        Returns
+        -------
+        web data : bytes
+            data encoded in tile format
+        """
+        return raster_to_bytes(
+            prepare_array(
+                data, masked=True, nodata=self.nodata,
+                dtype=self.output_params["dtype"]
+            ).filled(self.nodata),
+            self.profile()
+        ), MIME_TYPES[self.output_params["tile_format"]]
+
+    def open(self, tile, process, **kwargs):
+        """
+        Open process output as input for other process.
+
+        Parameters
+        ----------
+        tile : ``Tile``
+        process : ``MapcheteProcess``
+        kwargs : keyword arguments
+        """
+        return gtiff.InputTile(tile, process, kwargs.get("resampling", None))
+
+    def _init_gpkg(self):
+        """Create GeoPackage or verify parameters of an existing one."""
+        current_params = params_to_dump(dict(self.output_params))
+        if os.path.isfile(self.path):
+            rows = sqlite.query(
+                self.path,
+                "SELECT value FROM mapchete_metadata WHERE key = 'params'"
+            )
+            if not rows:
+                raise MapcheteConfigError(
+                    "%s is not a GeoPackage written by mapchete" % self.path
+                )
+            existing_params = json.loads(rows[0][0])
+            if (
+                existing_params["pyramid"] != current_params["pyramid"] or
+                existing_params["driver"]["tile_format"] !=
+                current_params["driver"]["tile_format"]
+            ):
+                raise MapcheteConfigError(
+                    "process output definition differs from existing output: "
+                    "%s != %s" % (existing_params, current_params)
+                )
+            return
+        logger.debug("create GeoPackage %s", self.path)
+        self.prepare_path()
+        connection = sqlite.get_connection(self.path)
+        with connection:
+            connection.execute("PRAGMA application_id = %s" % _APPLICATION_ID)
+            connection.execute("PRAGMA user_version = %s" % _USER_VERSION)
+            for statement in _SCHEMA:
+                connection.execute(statement)
+        srs_id = self.crs.to_epsg() or _CUSTOM_SRS_ID
+        left, bottom, right, top = self.pyramid.bounds
+        sqlite.write_rows(self.path, [
+            (
+                "INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES "
+                "(?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        "Undefined cartesian SRS", -1, "NONE", -1, "undefined",
+                        None
+                    ),
+                    (
+                        "Undefined geographic SRS", 0, "NONE", 0, "undefined",
+                        None
+                    ),
+                    (
+                        "WGS 84 geodetic", 4326, "EPSG", 4326,
+                        CRS.from_epsg(4326).wkt, None
+                    ),
+                    (
+                        self.crs.to_string(), srs_id,
+                        "EPSG" if srs_id != _CUSTOM_SRS_ID else "NONE", srs_id,
+                        self.crs.wkt, None
+                    )
+                ]
+            ),
+            (
+                "INSERT INTO gpkg_contents "
+                "(table_name, data_type, identifier, min_x, min_y, max_x, max_y, "
+                "srs_id) VALUES (?, 'tiles', ?, ?, ?, ?, ?, ?)",
+                [(_TABLE_NAME, _TABLE_NAME, left, bottom, right, top, srs_id)]
+            ),
+            (
+                "INSERT INTO gpkg_tile_matrix_set VALUES (?, ?, ?, ?, ?, ?)",
+                [(_TABLE_NAME, srs_id, left, bottom, right, top)]
+            ),
+            (
+                "INSERT INTO mapchete_metadata VALUES ('params', ?)",
+                [(json.dumps(current_params, sort_keys=True), )]
+            )
+        ])
+
+    def _tile_matrix(self, zoom):
+        """Return gpkg_tile_matrix row of zoom level."""
+        tile_size = self.pyramid.tile_size * self.pyramid.metatiling
+        return (
+            _TABLE_NAME,
+            zoom,
+            self.pyramid.matrix_width(zoom),
+            self.pyramid.matrix_height(zoom),
+            tile_size,
+            tile_size,
+            self.pyramid.pixel_x_size(zoom),
+            self.pyramid.pixel_y_size(zoom)
+        )
+
+
+class InputData(base.InputData):
+    """
+    Main input class.
+
+    Parameters
+    ----------
+    input_params : dictionary
+        driver specific parameters
+
+    Attributes
+    ----------
+    path : string
+        path to GeoPackage file
+    pixelbuffer : integer
+        buffer around output tiles
+    pyramid : ``tilematrix.TilePyramid``
+        output ``TilePyramid``
+    crs : ``rasterio.crs.CRS``
+        object describing the process coordinate reference system
+    srid : string
+        spatial reference ID of CRS (e.g. "{'init': 'epsg:4326'}")
+    """
+
+    METADATA = METADATA
+
+    def __init__(self, input_params, **kwargs):
+        """Initialize."""
+        super(InputData, self).__init__(input_params, **kwargs)
+        self.path = absolute_path(
+            path=input_params["path"], base_dir=input_params.get("conf_dir")
+        )
+        if not os.path.isfile(self.path):
+            raise MapcheteConfigError("%s does not exist" % input_params["path"])
+        try:
+            rows = sqlite.query(
+                self.path,
+                "SELECT value FROM mapchete_metadata WHERE key = 'params'"
+            )
+        except sqlite3.DatabaseError:
+            rows = []
+        if not rows:
+            raise MapcheteConfigError(
+                "%s is not a GeoPackage written by mapchete" % input_params["path"]
+            )
+        params = json.loads(rows[0][0])
+        self.gpkg_pyramid = BufferedTilePyramid(
+            params["pyramid"]["grid"]["type"],
+            metatiling=params["pyramid"].get("metatiling", 1),
+            pixelbuffer=params["pyramid"].get("pixelbuffer", 0)
+        )
+        self._output = load_output_writer(
+            dict(
+                params["driver"],
+                metatiling=self.gpkg_pyramid.metatiling,
+                pixelbuffer=self.gpkg_pyramid.pixelbuffer,
+                type=self.gpkg_pyramid.type,
+                path=self.path
+            ),
+            readonly=True
+        )
+
+    def open(self, tile, **kwargs):
+        """
+        Return InputTile object.
+
+        Parameters
+        ----------
+        tile : ``Tile``
+
+        Returns
+        -------
+        input tile : ``InputTile``
+            tile view of input data
+        """
+        return InputTile(
+            tile,
+            output=self._output,
+            tiles=list(self.gpkg_pyramid.tiles_from_bounds(tile.bounds, tile.zoom)),
+            **kwargs
+        )
+
+    def bbox(self, out_crs=None):
+        """
+        Return data bounding box.
+
+        Parameters
+        ----------
+        out_crs : ``rasterio.crs.CRS``
+            rasterio CRS object (default: CRS of process pyramid)
+
+        Returns
+        -------
+        bounding box : geometry
+            Shapely geometry object
+        """
+        return reproject_geometry(
+            box(*self.gpkg_pyramid.bounds),
+            src_crs=self.gpkg_pyramid.crs,
+            dst_crs=self.pyramid.crs if out_crs is None else out_crs
+        )
+
+    def exists(self):
+        """
+        Check if data or file even exists.
+
+        Returns
+        -------
+        file exists : bool
+        """
+        return os.path.isfile(self.path)
+
+    def cleanup(self):
+        """Close connection to GeoPackage."""
+        sqlite.close_connection(self.path)
+
+
+class InputTile(base.InputTile):
+    """
+    Target Tile representation of input data.
+
+    Parameters
+    ----------
+    tile : ``Tile``
+    kwargs : keyword arguments
+        driver specific parameters
+
+    Attributes
+    ----------
+    tile : tile : ``Tile``
+    """
+
+    def __init__(self, tile, **kwargs):
+        """Initialize."""
+        self.tile = tile
+        self._output = kwargs["output"]
+        self._tiles = kwargs["tiles"]
+
+    def read(self, indexes=None, resampling="nearest", **kwargs):
+        """
+        Read resampled input data.
+
+        Parameters
+        ----------
+        indexes : list or int
+            a list of band numbers; None will read all.
+        resampling : string
+            one of "nearest", "average", "bilinear" or "lanczos"
+
+        Returns
+        -------
+        data : array
+        """
+        if self.is_empty():
+            arr = self._output.empty(self.tile)
+        else:
+            nodata = self._output.nodata
+            arr = resample_from_array(
+                in_raster=create_mosaic(
+                    tiles=[
+                        (t, self._output.read(t))
+                        for t in self._tiles
+                    ],
+                    nodata=nodata
+                ),
+                out_tile=self.tile,
+                resampling=resampling,
+                nodataval=nodata
+            )
+        if indexes is None:
+            return arr
+        elif isinstance(indexes, int):
+            return arr[indexes - 1]
+        else:
+            return ma.concatenate([ma.expand_dims(arr[i - 1], 0) for i in indexes])
+
+    def is_empty(self):
+        """
+        Check if there is data within this tile.
+
+        Returns
+        -------
+        is empty : bool
+        """
+        return not any(
+            self._output.tiles_exist(output_tile=t) for t in self._tiles
+        )
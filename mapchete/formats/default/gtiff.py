@@ -30,7 +30,6 @@ compress: string
     CCITTFAX3, CCITTFAX4, lzma
 """
 
-import boto3
 import logging
 import os
 import six
@@ -42,9 +41,8 @@ import warnings
 
 from mapchete.config import validate_values
 from mapchete.formats import base
-from mapchete.io import makedirs, GDAL_HTTP_OPTS
-from mapchete.io.raster import write_raster_window, prepare_array, memory_file
-from mapchete.tile import BufferedTile
+from mapchete.io import makedirs, path_is_remote, gdal_env, GDAL_HTTP_OPTS
+from mapchete.io.raster import write_raster_windows, prepare_array, memory_file
 
 
 logger = logging.getLogger(__name__)
@@ -102,7 +100,6 @@ class OutputData(base.OutputData):
         self.file_extension = ".tif"
         self.output_params = output_params
         self.nodata = output_params.get("nodata", GTIFF_DEFAULT_PROFILE["nodata"])
-        self._bucket = self.path.split("/")[2] if self.path.startswith("s3://") else None
 
     def read(self, output_tile):
         """
@@ -119,7 +116,7 @@ class OutputData(base.OutputData):
         """
         path = self.get_path(output_tile)
         try:
-            with rasterio.Env(**GDAL_HTTP_OPTS):
+            with gdal_env(defaults=GDAL_HTTP_OPTS if path_is_remote(path) else None):
                 with rasterio.open(path, "r") as src:
                     return src.read(masked=True)
         except RasterioIOError as e:
@@ -156,27 +153,13 @@ class OutputData(base.OutputData):
         if data.mask.all():
             logger.debug("data empty, nothing to write")
         else:
-            # in case of S3 output, create an boto3 resource
-            bucket_resource = (
-                boto3.resource('s3').Bucket(self._bucket)
-                if self._bucket
-                else None
-            )
-
             # Convert from process_tile to output_tiles and write
-            for tile in self.pyramid.intersecting(process_tile):
-                out_path = self.get_path(tile)
-                self.prepare_path(tile)
-                out_tile = BufferedTile(tile, self.pixelbuffer)
-                write_raster_window(
-                    in_tile=process_tile,
-                    in_data=data,
-                    out_profile=self.profile(out_tile),
-                    out_tile=out_tile,
-                    out_path=out_path,
-                    tags=tags,
-                    bucket_resource=bucket_resource
-                )
+            write_raster_windows(
+                in_tile=process_tile,
+                in_data=data,
+                out_windows=self._output_windows(process_tile),
+                tags=tags
+            )
 
     def is_valid_with_config(self, config):
         """
@@ -242,7 +225,7 @@ class OutputData(base.OutputData):
         metadata : dictionary
             output profile dictionary used for rasterio.
         """
-        dst_metadata = GTIFF_DEFAULT_PROFILE
+        dst_metadata = dict(GTIFF_DEFAULT_PROFILE)
         dst_metadata.pop("transform", None)
         dst_metadata.update(
             count=self.output_params["bands"],
@@ -293,13 +276,15 @@ class OutputData(base.OutputData):
             mask=True
         )
 
-    def for_web(self, data):
+    def for_web(self, data, tile=None):
         """
         Convert data to web output (raster only).
 
         Parameters
         ----------
         data : array
+        tile : ``BufferedTile``
+            tile the data belongs to (optional)
 
         Returns
         -------
@@ -1,11 +1,34 @@
-"""Use another Mapchete process as input."""
+"""
+Use another Mapchete process as input.
+
+By default, the output of the other process has to be written beforehand and is
+read from disk. Configured as abstract input with ``fused: true``, the other
+process is run on demand within the same worker instead: process tiles are
+computed when they are read, kept in a cache of ``cache_size`` process tiles
+(default: 512) and passed on as arrays without being encoded and decoded. With
+``fused: continue``, existing output is read and missing process tiles are
+written after processing, so the output can be reused by later runs. This way a
+chain of processes can be run with one ``mapchete execute`` call on its last
+process.
+"""
+
+import logging
+import six
 
 from mapchete import Mapchete
 from mapchete.config import MapcheteConfig
+from mapchete.errors import MapcheteConfigError
 from mapchete.formats import base
+from mapchete.io import absolute_path
 from mapchete.io.vector import reproject_geometry
 
 
+logger = logging.getLogger(__name__)
+
+# process modes of fused inputs
+FUSED_MODES = {True: "memory", "memory": "memory", "continue": "continue"}
+
+
 METADATA = {
     "driver_name": "Mapchete",
     "data_type": None,
@@ -27,6 +50,8 @@ class InputData(base.InputData):
     ----------
     path : string
         path to Mapchete file
+    process : ``Mapchete``
+        input process
     pixelbuffer : integer
         buffer around output tiles
     pyramid : ``tilematrix.TilePyramid``
@@ -47,12 +72,43 @@ class InputData(base.InputData):
     def __init__(self, input_params, **kwargs):
         """Initialize."""
         super(InputData, self).__init__(input_params, **kwargs)
-        self.path = input_params["path"]
-        self.process = Mapchete(MapcheteConfig(
-            self.path, mode="readonly",
-            bounds=input_params["delimiters"]["bounds"],
-            zoom=input_params["delimiters"]["zoom"]
-        ))
+        if "abstract" in input_params:
+            params = input_params["abstract"]
+            self.path = absolute_path(
+                path=params["path"], base_dir=input_params["conf_dir"]
+            )
+            fused = params.get("fused", False)
+            cache_size = params.get("cache_size", 512)
+        else:
+            self.path = input_params["path"]
+            fused = False
+            cache_size = 512
+        if fused is not False and (
+            not isinstance(fused, (bool, six.string_types)) or
+            fused not in FUSED_MODES
+        ):
+            raise MapcheteConfigError(
+                "fused must be true, false, 'memory' or 'continue': %s" % fused
+            )
+        if (
+            isinstance(cache_size, bool) or
+            not isinstance(cache_size, int) or
+            cache_size < 1
+        ):
+            raise MapcheteConfigError("cache_size must be a positive integer")
+        mode = FUSED_MODES[fused] if fused is not False else "readonly"
+        logger.debug("open %s in %s mode", self.path, mode)
+        self.process = Mapchete(
+            MapcheteConfig(
+                self.path, mode=mode,
+                bounds=input_params["delimiters"]["bounds"],
+                zoom=input_params["delimiters"]["zoom"]
+            ),
+            with_cache=fused is not False,
+            cache_size=cache_size,
+            # caches are shared with the process using this input
+            clear_caches=False
+        )
 
     def open(self, tile, **kwargs):
         """
@@ -87,3 +143,7 @@ class InputData(base.InputData):
             self.process.config.area_at_zoom(),
             src_crs=self.process.config.process_pyramid.crs,
             dst_crs=self.pyramid.crs if out_crs is None else out_crs)
+
+    def cleanup(self):
+        """Close input process."""
+        self.process.__exit__(None, None, None)
@@ -0,0 +1,575 @@
+"""
+Handles writing process output into an MBTiles file.
+
+Output tiles are converted into RGBA like the PNG driver and stored as PNG or
+JPEG blobs following the MBTiles 1.3 specification. Tiles are kept in the
+``map`` and ``images`` tables, so identical tiles (e.g. constant color tiles)
+are stored only once. Tiles of a process tile are written within one
+transaction, fully transparent tiles are not stored.
+
+This output format is restricted to the mercator projection and an output
+metatiling of 1. The MBTiles file can be used as input of other processes by
+providing its path and is read by ``mapchete serve`` using indexed lookups.
+
+output configuration parameters
+-------------------------------
+
+output type has to be ``mercator``
+
+mandatory
+~~~~~~~~~
+
+path: string
+    path to local .mbtiles file
+
+optional
+~~~~~~~~
+
+nodata: integer
+    value set to transparent for grayscale and RGB data (default: 0)
+tile_format: string
+    either "PNG" or "JPEG" (default: PNG); JPEG tiles have no transparency
+name: string
+    tileset name (default: file name)
+description: string
+    tileset description
+"""
+
+import hashlib
+import json
+import logging
+import numpy as np
+import numpy.ma as ma
+import os
+import six
+from shapely.geometry import box
+
+from mapchete.config import validate_values
+from mapchete.errors import MapcheteConfigError
+from mapchete.formats import base
+from mapchete.formats.default import gtiff
+from mapchete.formats.default.gpkg import InputTile
+from mapchete.formats.default.png import prepare_rgba
+from mapchete.io import absolute_path, makedirs, params_to_dump
+from mapchete.io import sqlite
+from mapchete.io.raster import extract_from_array, raster_from_bytes, raster_to_bytes
+from mapchete.io.vector import reproject_geometry
+from mapchete.tile import BufferedTile, BufferedTilePyramid
+
+
+logger = logging.getLogger(__name__)
+METADATA = {
+    "driver_name": "MBTiles",
+    "data_type": "raster",
+    "mode": "rw",
+    "file_extensions": ["mbtiles"]
+}
+
+MBTILES_DEFAULT_PARAMS = {
+    "nodata": 0,
+    "tile_format": "PNG"
+}
+
+TILE_FORMATS = {
+    "PNG": ("png", "image/png"),
+    "JPEG": ("jpg", "image/jpeg")
+}
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS metadata_name ON metadata (name)",
+    """
+    CREATE TABLE IF NOT EXISTS map (
+        zoom_level INTEGER,
+        tile_column INTEGER,
+        tile_row INTEGER,
+        tile_id TEXT
+    )
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS map_index
+        ON map (zoom_level, tile_column, tile_row)
+    """,
+    "CREATE TABLE IF NOT EXISTS images (tile_data BLOB, tile_id TEXT)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS images_id ON images (tile_id)",
+    """
+    CREATE VIEW IF NOT EXISTS tiles AS
+        SELECT
+            map.zoom_level AS zoom_level,
+            map.tile_column AS tile_column,
+            map.tile_row AS tile_row,
+            images.tile_data AS tile_data
+        FROM map JOIN images ON images.tile_id = map.tile_id
+    """
+]
+
+
+class OutputData(base.OutputData):
+    """
+    Output class for MBTiles.
+
+    Parameters
+    ----------
+    output_params : dictionary
+        output parameters from Mapchete file
+    readonly : bool
+        if True, the MBTiles file will not be created (default: False)
+
+    Attributes
+    ----------
+    path : string
+        path to MBTiles file
+    file_extension : string
+        file extension of output file (.mbtiles)
+    output_params : dictionary
+        output parameters from Mapchete file
+    nodata : integer or float
+        nodata value used for transparency
+    pixelbuffer : integer
+        buffer around output tiles
+    pyramid : ``tilematrix.TilePyramid``
+        output ``TilePyramid``
+    crs : ``rasterio.crs.CRS``
+        object describing the process coordinate reference system
+    srid : string
+        spatial reference ID of CRS (e.g. "{'init': 'epsg:3857'}")
+    """
+
+    METADATA = METADATA
+
+    def __init__(self, output_params, readonly=False, **kwargs):
+        """Initialize."""
+        # metadata are stored within the MBTiles file instead of a metadata.json
+        super(OutputData, self).__init__(output_params, readonly=True)
+        self.path = output_params["path"]
+        self.file_extension = ".mbtiles"
+        self.output_params = dict(MBTILES_DEFAULT_PARAMS, **output_params)
+        self.output_params.update(dtype="uint8")
+        self.nodata = self.output_params["nodata"]
+        if not readonly:
+            self._init_mbtiles()
+
+    def read(self, output_tile):
+        """
+        Read existing process output.
+
+        Parameters
+        ----------
+        output_tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        process output : array
+            RGBA array, transparent pixels are masked
+        """
+        if not os.path.isfile(self.path):
+            return self.empty(output_tile)
+        rows = sqlite.query(
+            self.path,
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? "
+            "AND tile_row = ?",
+            (output_tile.zoom, output_tile.col, self._tms_row(output_tile))
+        )
+        if not rows:
+            return self.empty(output_tile)
+        rgba = prepare_rgba(raster_from_bytes(rows[0][0]).data, nodata=self.nodata)
+        return ma.masked_array(
+            data=rgba, mask=np.stack([rgba[3] == 0] * 4)
+        )
+
+    def write(self, process_tile, data):
+        """
+        Write data from process tile into MBTiles file.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+        """
+        rgba = prepare_rgba(data, nodata=self.nodata)
+        images, tiles, empty_tiles = {}, [], []
+        for tile in self.pyramid.intersecting(process_tile):
+            window = extract_from_array(
+                in_raster=rgba, in_affine=process_tile.affine,
+                out_tile=BufferedTile(tile)
+            )
+            tile_index = (tile.zoom, tile.col, self._tms_row(tile))
+            if not window[3].any():
+                logger.debug((tile.id, "transparent tile"))
+                empty_tiles.append(tile_index)
+                continue
+            # identical tiles share one image
+            tile_id = hashlib.md5(window.tobytes()).hexdigest()
+            if tile_id not in images:
+                images[tile_id] = self._encode(window)
+            tiles.append(tile_index + (tile_id, ))
+        # write all tiles of process tile within one transaction
+        sqlite.write_rows(self.path, [
+            (
+                "INSERT OR IGNORE INTO images (tile_data, tile_id) VALUES (?, ?)",
+                [(blob, tile_id) for tile_id, blob in images.items()]
+            ),
+            (
+                "INSERT OR REPLACE INTO map "
+                "(zoom_level, tile_column, tile_row, tile_id) VALUES (?, ?, ?, ?)",
+                tiles
+            ),
+            (
+                "DELETE FROM map WHERE zoom_level = ? AND tile_column = ? "
+                "AND tile_row = ?",
+                empty_tiles
+            )
+        ])
+
+    def tiles_exist(self, process_tile=None, output_tile=None):
+        """
+        Check whether output tiles of a tile (either process or output) exists.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+        output_tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        exists : bool
+        """
+        if process_tile and output_tile:
+            raise ValueError("just one of 'process_tile' and 'output_tile' allowed")
+        if not os.path.isfile(self.path):
+            return False
+        tiles = list(
+            self.pyramid.intersecting(process_tile) if process_tile else [output_tile]
+        )
+        rows = [self._tms_row(t) for t in tiles]
+        # range query uses the map_index index
+        return bool(sqlite.query(
+            self.path,
+            "SELECT EXISTS (SELECT 1 FROM map WHERE zoom_level = ? "
+            "AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?)",
+            (
+                tiles[0].zoom,
+                min(t.col for t in tiles), max(t.col for t in tiles),
+                min(rows), max(rows)
+            )
+        )[0][0])
+
+    def is_valid_with_config(self, config):
+        """
+        Check if output format is valid with other process parameters.
+
+        Parameters
+        ----------
+        config : dictionary
+            output configuration parameters
+
+        Returns
+        -------
+        is_valid : bool
+        """
+        validate_values(config, [("path", six.string_types)])
+        if config["type"].type != "mercator":
+            raise ValueError("output pyramid has to be mercator")
+        if not config["path"].endswith(self.file_extension):
+            raise MapcheteConfigError("MBTiles output path must end with .mbtiles")
+        if config["path"].startswith(("s3://", "http://", "https://")):
+            raise MapcheteConfigError("MBTiles output path must be a local file")
+        if config.get("pixelbuffer", 0) or config.get("metatiling", 1) != 1:
+            raise MapcheteConfigError(
+                "MBTiles output pixelbuffer must be 0 and metatiling 1"
+            )
+        if config.get("tile_format", "PNG") not in TILE_FORMATS:
+            raise MapcheteConfigError(
+                "MBTiles tile_format must be one of %s" % list(TILE_FORMATS)
+            )
+        return True
+
+    def get_path(self, tile=None):
+        """
+        Determine target file path.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        path : string
+            path to MBTiles file, the same for all tiles
+        """
+        return self.path
+
+    def prepare_path(self, tile=None):
+        """
+        Create directory of MBTiles file if necessary.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+        """
+        makedirs(os.path.dirname(self.path))
+
+    def profile(self, tile=None):
+        """
+        Create a metadata dictionary for rasterio.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+
+        Returns
+        -------
+        metadata : dictionary
+            profile dictionary used to encode tiles
+        """
+        profile = dict(
+            driver=self.output_params["tile_format"],
+            count=4,
+            dtype="uint8"
+        )
+        if tile is not None:
+            profile.update(width=tile.width, height=tile.height)
+        return profile
+
+    def empty(self, process_tile):
+        """
+        Return empty data.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+
+        Returns
+        -------
+        empty data : array
+            empty RGBA array
+        """
+        return ma.masked_array(
+            data=np.zeros((4, ) + process_tile.shape, dtype="uint8"), mask=True
+        )
+
+    def for_web(self, data, tile=None):
+        """
+        Convert data to web output.
+
+        Parameters
+        ----------
+        data : array
+        tile : ``BufferedTile``
+            tile the data belongs to (optional)
+
+        Returns
+        -------
+        web data : bytes
+            data encoded in tile format
+        """
+        return (
+            self._encode(prepare_rgba(data, nodata=self.nodata)),
+            TILE_FORMATS[self.output_params["tile_format"]][1]
+        )
+
+    def open(self, tile, process, **kwargs):
+        """
+        Open process output as input for other process.
+
+        Parameters
+        ----------
+        tile : ``Tile``
+        process : ``MapcheteProcess``
+        kwargs : keyword arguments
+        """
+        return gtiff.InputTile(tile, process, kwargs.get("resampling", None))
+
+    def close(self):
+        """Remove unused images and update zoom levels in metadata."""
+        if not os.path.isfile(self.path):
+            return
+        zooms = sqlite.query(
+            self.path, "SELECT MIN(zoom_level), MAX(zoom_level) FROM map"
+        )
+        sqlite.write_rows(self.path, [
+            (
+                "DELETE FROM images WHERE tile_id NOT IN (SELECT tile_id FROM map)",
+                [()]
+            ),
+            (
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+                [
+                    (k, str(v))
+                    for k, v in zip(["minzoom", "maxzoom"], zooms[0])
+                    if v is not None
+                ]
+            )
+        ])
+        sqlite.close_connection(self.path)
+
+    def _encode(self, rgba):
+        if self.output_params["tile_format"] == "JPEG":
+            rgba = rgba[:3]
+        return raster_to_bytes(np.asarray(rgba), self.profile())
+
+    def _tms_row(self, tile):
+        """MBTiles rows are counted from the bottom."""
+        return self.pyramid.matrix_height(tile.zoom) - 1 - tile.row
+
+    def _init_mbtiles(self):
+        """Create MBTiles file or verify parameters of an existing one."""
+        current_params = params_to_dump(dict(self.output_params))
+        if os.path.isfile(self.path):
+            rows = sqlite.query(
+                self.path, "SELECT value FROM metadata WHERE name = 'mapchete'"
+            )
+            if not rows:
+                raise MapcheteConfigError(
+                    "%s is not an MBTiles file written by mapchete" % self.path
+                )
+            existing_params = json.loads(rows[0][0])
+            if (
+                existing_params["pyramid"] != current_params["pyramid"] or
+                existing_params["driver"]["tile_format"] !=
+                current_params["driver"]["tile_format"]
+            ):
+                raise MapcheteConfigError(
+                    "process output definition differs from existing output: "
+                    "%s != %s" % (existing_params, current_params)
+                )
+            return
+        logger.debug("create MBTiles %s", self.path)
+        self.prepare_path()
+        connection = sqlite.get_connection(self.path)
+        with connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+        bounds = reproject_geometry(
+            box(*self.pyramid.bounds),
+            src_crs=self.crs,
+            dst_crs=4326
+        ).bounds
+        sqlite.write_rows(self.path, [(
+            "INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+            [
+                (
+                    "name",
+                    self.output_params.get(
+                        "name", os.path.splitext(os.path.basename(self.path))[0]
+                    )
+                ),
+                ("description", self.output_params.get("description", "")),
+                ("format", TILE_FORMATS[self.output_params["tile_format"]][0]),
+                ("type", "overlay"),
+                ("version", "1.3"),
+                ("bounds", ",".join(map(str, bounds))),
+                ("mapchete", json.dumps(current_params, sort_keys=True))
+            ]
+        )])
+
+
+class InputData(base.InputData):
+    """
+    Main input class.
+
+    Parameters
+    ----------
+    input_params : dictionary
+        driver specific parameters
+
+    Attributes
+    ----------
+    path : string
+        path to MBTiles file
+    pixelbuffer : integer
+        buffer around output tiles
+    pyramid : ``tilematrix.TilePyramid``
+        output ``TilePyramid``
+    crs : ``rasterio.crs.CRS``
+        object describing the process coordinate reference system
+    srid : string
+        spatial reference ID of CRS (e.g. "{'init': 'epsg:4326'}")
+    """
+
+    METADATA = METADATA
+
+    def __init__(self, input_params, **kwargs):
+        """Initialize."""
+        super(InputData, self).__init__(input_params, **kwargs)
+        self.path = absolute_path(
+            path=input_params["path"], base_dir=input_params.get("conf_dir")
+        )
+        if not os.path.isfile(self.path):
+            raise MapcheteConfigError("%s does not exist" % input_params["path"])
+        metadata = dict(sqlite.query(self.path, "SELECT name, value FROM metadata"))
+        self.mbtiles_pyramid = BufferedTilePyramid("mercator")
+        self._bounds = tuple(map(
+            float, metadata.get("bounds", "-180,-85.0511,180,85.0511").split(",")
+        ))
+        self._output = OutputData(
+            dict(
+                format="MBTiles",
+                path=self.path,
+                type=self.mbtiles_pyramid.type,
+                metatiling=1,
+                pixelbuffer=0,
+                tile_format="JPEG" if metadata.get("format") == "jpg" else "PNG"
+            ),
+            readonly=True
+        )
+
+    def open(self, tile, **kwargs):
+        """
+        Return InputTile object.
+
+        Parameters
+        ----------
+        tile : ``Tile``
+
+        Returns
+        -------
+        input tile : ``InputTile``
+            tile view of input data
+        """
+        return InputTile(
+            tile,
+            output=self._output,
+            tiles=list(self.mbtiles_pyramid.tiles_from_bounds(tile.bounds, tile.zoom)),
+            **kwargs
+        )
+
+    def bbox(self, out_crs=None):
+        """
+        Return data bounding box.
+
+        Parameters
+        ----------
+        out_crs : ``rasterio.crs.CRS``
+            rasterio CRS object (default: CRS of process pyramid)
+
+        Returns
+        -------
+        bounding box : geometry
+            Shapely geometry object
+        """
+        return reproject_geometry(
+            box(*self._bounds),
+            src_crs=4326,
+            dst_crs=self.pyramid.crs if out_crs is None else out_crs
+        )
+
+    def exists(self):
+        """
+        Check if data or file even exists.
+
+        Returns
+        -------
+        file exists : bool
+        """
+        return os.path.isfile(self.path)
+
+    def cleanup(self):
+        """Close connection to MBTiles file."""
+        sqlite.close_connection(self.path)
@@ -0,0 +1,335 @@
+"""
+Handles writing process output into a pyramid of Mapbox Vector Tiles.
+
+Geometries are clipped to the output tiles including the output pixelbuffer,
+optionally simplified and quantized to the tile extent. Tiles are stored as
+protobuf files (.pbf), optionally gzip compressed.
+
+This output format is restricted to the mercator projection. It requires the
+``mapbox-vector-tile`` package which can be installed using
+``pip install mapchete[mvt]``.
+
+output configuration parameters
+-------------------------------
+
+output type has to be ``mercator``
+
+mandatory
+~~~~~~~~~
+
+path: string
+    output directory
+
+optional
+~~~~~~~~
+
+layer: string
+    name of vector tile layer (default: "default")
+extent: integer
+    tile extent in vector tile coordinates (default: 4096)
+simplify: float
+    simplification tolerance in output pixels, resulting in stronger
+    simplification on lower zoom levels (default: 0, no simplification)
+compress: string
+    either "gzip" or "none" (default: "none")
+"""
+
+import gzip
+import logging
+import os
+import six
+from shapely.affinity import affine_transform
+from shapely.geometry import mapping, shape
+import types
+
+from mapchete.config import validate_values
+from mapchete.errors import MapcheteConfigError
+from mapchete.formats import base
+from mapchete.formats.default.geojson import InputTile
+from mapchete.io import makedirs, path_exists, set_path_exists
+from mapchete.io.s3 import get_s3_client, split_s3_path
+from mapchete.io.vector import IndexedFeatures, to_shape
+from mapchete.tile import BufferedTile
+
+
+logger = logging.getLogger(__name__)
+METADATA = {
+    "driver_name": "MVT",
+    "data_type": "vector",
+    "mode": "rw"
+}
+
+MVT_MIME_TYPE = "application/vnd.mapbox-vector-tile"
+
+MVT_DEFAULT_PARAMS = {
+    "layer": "default",
+    "extent": 4096,
+    "simplify": 0,
+    "compress": "none"
+}
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+class OutputData(base.OutputData):
+    """
+    Output class for Mapbox Vector Tiles.
+
+    Parameters
+    ----------
+    output_params : dictionary
+        output parameters from Mapchete file
+
+    Attributes
+    ----------
+    path : string
+        path to output directory
+    file_extension : string
+        file extension for output files (.pbf)
+    output_params : dictionary
+        output parameters from Mapchete file
+    pixelbuffer : integer
+        buffer around output tiles
+    pyramid : ``tilematrix.TilePyramid``
+        output ``TilePyramid``
+    crs : ``rasterio.crs.CRS``
+        object describing the process coordinate reference system
+    srid : string
+        spatial reference ID of CRS (e.g. "{'init': 'epsg:3857'}")
+    """
+
+    METADATA = METADATA
+
+    def __init__(self, output_params, **kwargs):
+        """Initialize."""
+        super(OutputData, self).__init__(output_params)
+        self.path = output_params["path"]
+        self.file_extension = ".pbf"
+        self.output_params = dict(MVT_DEFAULT_PARAMS, **output_params)
+
+    def read(self, output_tile):
+        """
+        Read existing process output.
+
+        Parameters
+        ----------
+        output_tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        process output : list
+        """
+        path = self.get_path(output_tile)
+        if not path_exists(path):
+            return self.empty(output_tile)
+        if path.startswith("s3://"):
+            bucket, key = split_s3_path(path)
+            data = get_s3_client().get_object(Bucket=bucket, Key=key)["Body"].read()
+        else:
+            with open(path, "rb") as src:
+                data = src.read()
+        return self._decode(data, output_tile)
+
+    def write(self, process_tile, data):
+        """
+        Write data from process tiles into vector tiles.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+        """
+        if data is None:
+            return
+        if not isinstance(data, (list, types.GeneratorType)):
+            raise TypeError(
+                "MVT driver data has to be a list or generator of GeoJSON objects"
+            )
+        # parse and index features only once per process tile
+        index = _indexed_features(data)
+        if not len(index):
+            logger.debug("no features to write")
+            return
+        for tile in self.pyramid.intersecting(process_tile):
+            out_path = self.get_path(tile)
+            out_tile = BufferedTile(tile, self.pixelbuffer)
+            mvt = self._encode(index, out_tile)
+            if mvt is None:
+                logger.debug((out_tile.id, "nothing to write", out_path))
+                # delete existing file
+                if not out_path.startswith("s3://"):
+                    try:
+                        os.remove(out_path)
+                    except OSError:
+                        pass
+                continue
+            if self.output_params["compress"] == "gzip":
+                mvt = gzip.compress(mvt)
+            if out_path.startswith("s3://"):
+                logger.debug((out_tile.id, "upload tile", out_path))
+                bucket, key = split_s3_path(out_path)
+                get_s3_client().put_object(Bucket=bucket, Key=key, Body=mvt)
+                set_path_exists(out_path)
+            else:
+                logger.debug((out_tile.id, "write tile", out_path))
+                self.prepare_path(tile)
+                with open(out_path, "wb") as dst:
+                    dst.write(mvt)
+
+    def is_valid_with_config(self, config):
+        """
+        Check if output format is valid with other process parameters.
+
+        Parameters
+        ----------
+        config : dictionary
+            output configuration parameters
+
+        Returns
+        -------
+        is_valid : bool
+        """
+        validate_values(config, [("path", six.string_types)])
+        if config["type"].type != "mercator":
+            raise ValueError("output pyramid has to be mercator")
+        if config.get("compress", "none") not in ["gzip", "none"]:
+            raise MapcheteConfigError("MVT compress must be 'gzip' or 'none'")
+        return True
+
+    def get_path(self, tile):
+        """
+        Determine target file path.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        path : string
+        """
+        return os.path.join(*[
+            self.path, str(tile.zoom), str(tile.row),
+            str(tile.col) + self.file_extension]
+        )
+
+    def prepare_path(self, tile):
+        """
+        Create directory and subdirectory if necessary.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+        """
+        makedirs(os.path.dirname(self.get_path(tile)))
+
+    def empty(self, process_tile=None):
+        """
+        Return empty data.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+
+        Returns
+        -------
+        empty data : list
+        """
+        return []
+
+    def for_web(self, data, tile=None):
+        """
+        Convert data to web output.
+
+        Parameters
+        ----------
+        data : list
+            GeoJSON-like features
+        tile : ``BufferedTile``
+            web tile to encode
+
+        Returns
+        -------
+        web data : bytes
+            uncompressed protobuf encoded vector tile
+        """
+        if tile is None:
+            raise ValueError("MVT web output requires a tile")
+        return self._encode(_indexed_features(data), tile) or b"", MVT_MIME_TYPE
+
+    def open(self, tile, process):
+        """
+        Open process output as input for other process.
+
+        Parameters
+        ----------
+        tile : ``Tile``
+        process : ``MapcheteProcess``
+        """
+        return InputTile(tile, process)
+
+    def _encode(self, index, tile):
+        """Return tile encoded as protobuf or None if tile is empty."""
+        # mapbox_vector_tile is an optional dependency
+        import mapbox_vector_tile
+
+        tolerance = self.output_params["simplify"] * tile.pixel_x_size
+        features = []
+        for geom, properties in index.clipped(tile.bbox):
+            if tolerance:
+                geom = geom.simplify(tolerance, preserve_topology=True)
+                if geom.is_empty:
+                    continue
+            features.append(dict(geometry=geom, properties=properties))
+        if not features:
+            return None
+        return mapbox_vector_tile.encode(
+            [dict(name=self.output_params["layer"], features=features)],
+            # quantize to tile without buffer, so buffered coordinates are
+            # outside of the extent
+            quantize_bounds=_unbuffered_bounds(tile),
+            extents=self.output_params["extent"],
+            on_invalid_geometry=mapbox_vector_tile.encoder.on_invalid_geometry_ignore
+        )
+
+    def _decode(self, data, tile):
+        """Return features of all layers in output CRS."""
+        # mapbox_vector_tile is an optional dependency
+        import mapbox_vector_tile
+
+        if data.startswith(_GZIP_MAGIC):
+            data = gzip.decompress(data)
+        left, bottom, right, top = _unbuffered_bounds(tile)
+        features = []
+        for layer in mapbox_vector_tile.decode(data).values():
+            x_scale = (right - left) / layer["extent"]
+            y_scale = (top - bottom) / layer["extent"]
+            for feature in layer["features"]:
+                features.append(dict(
+                    geometry=mapping(affine_transform(
+                        shape(feature["geometry"]),
+                        [x_scale, 0, 0, y_scale, left, bottom]
+                    )),
+                    properties=feature["properties"]
+                ))
+        return features
+
+
+def _unbuffered_bounds(tile):
+    return tuple(tile.tile_pyramid.tile(*tile.id).bounds())
+
+
+def _indexed_features(data):
+    features = []
+    for feature in data:
+        try:
+            features.append(
+                (to_shape(feature["geometry"]), feature.get("properties", {}))
+            )
+        except Exception:
+            logger.exception("failed to prepare geometry for writing")
+    return IndexedFeatures(features)
@@ -0,0 +1,453 @@
+"""
+Handles writing process output into a pyramid of NumPy array files.
+
+This format is meant as a fast intermediate storage between chained processes
+rather than for distribution. Each output tile is stored as one uncompressed
+``.npy`` file holding a structured array with the fields ``data`` and ``mask``,
+so data and mask of a tile are always replaced together. Reading tiles maps the
+files into memory instead of decoding them, which also applies when the output
+is used as input of other processes via its ``.mapchete`` file or its
+directory. Written tiles are registered in one SQLite index per zoom level
+which is used to check whether tiles exist.
+
+Arrays are returned as copy-on-write memory maps, i.e. changing them in place
+does not alter the stored tiles.
+
+output configuration parameters
+-------------------------------
+
+mandatory
+~~~~~~~~~
+
+bands: integer
+    number of output bands to be written
+path: string
+    local output directory
+dtype: string
+    numpy datatype
+
+optional
+~~~~~~~~
+
+nodata: integer or float
+    nodata value used for empty tiles (default: 0)
+"""
+
+import logging
+import numpy as np
+import numpy.ma as ma
+import os
+import six
+
+from mapchete.config import validate_values
+from mapchete.errors import MapcheteConfigError
+from mapchete.formats import base
+from mapchete.io import makedirs, path_is_remote
+from mapchete.io import sqlite
+from mapchete.io.raster import (
+    create_mosaic, extract_from_array, memory_file, prepare_array,
+    resample_from_array
+)
+from mapchete.tile import BufferedTile
+
+
+logger = logging.getLogger(__name__)
+METADATA = {
+    "driver_name": "NPY",
+    "data_type": "raster",
+    "mode": "rw"
+}
+NPY_DEFAULT_PROFILE = {
+    "dtype": "uint8",
+    "nodata": 0
+}
+
+_INDEX_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tiles (
+        tile_row INTEGER,
+        tile_column INTEGER,
+        UNIQUE (tile_row, tile_column)
+    )
+"""
+
+
+class OutputData(base.OutputData):
+    """
+    Output class for NumPy array tiles.
+
+    Parameters
+    ----------
+    output_params : dictionary
+        output parameters from Mapchete file
+
+    Attributes
+    ----------
+    path : string
+        path to output directory
+    file_extension : string
+        file extension for output files (.npy)
+    output_params : dictionary
+        output parameters from Mapchete file
+    nodata : integer or float
+        nodata value used for empty tiles
+    pixelbuffer : integer
+        buffer around output tiles
+    pyramid : ``tilematrix.TilePyramid``
+        output ``TilePyramid``
+    crs : ``rasterio.crs.CRS``
+        object describing the process coordinate reference system
+    srid : string
+        spatial reference ID of CRS (e.g. "{'init': 'epsg:4326'}")
+    """
+
+    METADATA = METADATA
+
+    def __init__(self, output_params, readonly=False, **kwargs):
+        """Initialize."""
+        super(OutputData, self).__init__(output_params, readonly=readonly)
+        self.path = output_params["path"]
+        self.file_extension = ".npy"
+        self.output_params = output_params
+        self.nodata = output_params.get("nodata", NPY_DEFAULT_PROFILE["nodata"])
+        self._indexes = set()
+
+    def read(self, output_tile):
+        """
+        Read existing process output.
+
+        Parameters
+        ----------
+        output_tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        process output : array
+            masked array backed by memory maps of the tile files
+        """
+        try:
+            tile = np.load(self.get_path(output_tile), mmap_mode="c")
+        except FileNotFoundError:
+            return self.empty(output_tile)
+        return ma.masked_array(
+            data=tile["data"], mask=tile["mask"], fill_value=self.nodata,
+            copy=False
+        )
+
+    def write(self, process_tile, data):
+        """
+        Write data from process tile into NumPy array files.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+        """
+        data = prepare_array(
+            data,
+            masked=True,
+            nodata=self.nodata,
+            dtype=self.profile(process_tile)["dtype"]
+        )
+        written, removed = [], []
+        for tile in self.pyramid.intersecting(process_tile):
+            out_tile = BufferedTile(tile, self.pixelbuffer)
+            window = extract_from_array(
+                in_raster=data, in_affine=process_tile.affine, out_tile=out_tile
+            )
+            path = self.get_path(out_tile)
+            if window.mask.all():
+                logger.debug((tile.id, "empty tile"))
+                if os.path.isfile(path):
+                    os.remove(path)
+                removed.append((tile.row, tile.col))
+                continue
+            self.prepare_path(out_tile)
+            _save(path, window)
+            written.append((tile.row, tile.col))
+        sqlite.write_rows(self._index_path(process_tile.zoom), [
+            (
+                "INSERT OR IGNORE INTO tiles (tile_row, tile_column) VALUES (?, ?)",
+                written
+            ),
+            (
+                "DELETE FROM tiles WHERE tile_row = ? AND tile_column = ?",
+                removed
+            )
+        ])
+
+    def tiles_exist(self, process_tile=None, output_tile=None):
+        """
+        Check whether output tiles of a tile (either process or output) exists.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+        output_tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        exists : bool
+        """
+        if process_tile and output_tile:
+            raise ValueError("just one of 'process_tile' and 'output_tile' allowed")
+        tiles = list(
+            self.pyramid.intersecting(process_tile) if process_tile else [output_tile]
+        )
+        index_path = self._index_path(tiles[0].zoom, create=False)
+        if not os.path.isfile(index_path):
+            return False
+        return bool(sqlite.query(
+            index_path,
+            "SELECT EXISTS (SELECT 1 FROM tiles WHERE tile_row BETWEEN ? AND ? "
+            "AND tile_column BETWEEN ? AND ?)",
+            (
+                min(t.row for t in tiles), max(t.row for t in tiles),
+                min(t.col for t in tiles), max(t.col for t in tiles)
+            )
+        )[0][0])
+
+    def is_valid_with_config(self, config):
+        """
+        Check if output format is valid with other process parameters.
+
+        Parameters
+        ----------
+        config : dictionary
+            output configuration parameters
+
+        Returns
+        -------
+        is_valid : bool
+        """
+        validate_values(
+            config, [
+                ("bands", int),
+                ("path", six.string_types),
+                ("dtype", six.string_types)]
+        )
+        if path_is_remote(config["path"]):
+            raise MapcheteConfigError("NPY output path must be a local directory")
+        return True
+
+    def get_path(self, tile):
+        """
+        Determine target file path.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+
+        Returns
+        -------
+        path : string
+        """
+        return os.path.join(*[
+            self.path, str(tile.zoom), str(tile.row),
+            str(tile.col) + self.file_extension
+        ])
+
+    def prepare_path(self, tile):
+        """
+        Create directory and subdirectory if necessary.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+            must be member of output ``TilePyramid``
+        """
+        makedirs(os.path.dirname(self.get_path(tile)))
+
+    def profile(self, tile=None):
+        """
+        Create a metadata dictionary for rasterio.
+
+        Parameters
+        ----------
+        tile : ``BufferedTile``
+
+        Returns
+        -------
+        metadata : dictionary
+            output profile dictionary used for rasterio.
+        """
+        dst_metadata = dict(
+            driver="GTiff",
+            count=self.output_params["bands"],
+            dtype=self.output_params.get("dtype", NPY_DEFAULT_PROFILE["dtype"]),
+            nodata=self.nodata
+        )
+        if tile is not None:
+            dst_metadata.update(
+                width=tile.width, height=tile.height, affine=tile.affine,
+                crs=tile.crs
+            )
+        return dst_metadata
+
+    def empty(self, process_tile):
+        """
+        Return empty data.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            must be member of process ``TilePyramid``
+
+        Returns
+        -------
+        empty data : array
+            empty array with data type provided in output profile
+        """
+        profile = self.profile(process_tile)
+        return ma.masked_array(
+            data=np.full(
+                (profile["count"], ) + process_tile.shape, self.nodata,
+                dtype=profile["dtype"]
+            ),
+            mask=True,
+            fill_value=self.nodata
+        )
+
+    def for_web(self, data, tile=None):
+        """
+        Convert data to web output (raster only).
+
+        Parameters
+        ----------
+        data : array
+        tile : ``BufferedTile``
+            tile the data belongs to (optional)
+
+        Returns
+        -------
+        web data : array
+        """
+        return memory_file(
+            prepare_array(
+                data, masked=True, nodata=self.nodata, dtype=self.profile()["dtype"]
+            ),
+            self.profile()
+        ), "image/tiff"
+
+    def open(self, tile, process, **kwargs):
+        """
+        Open process output as input for other process.
+
+        Parameters
+        ----------
+        tile : ``Tile``
+        process : ``MapcheteProcess``
+        kwargs : keyword arguments
+        """
+        return InputTile(
+            tile,
+            output=self,
+            tiles=[
+                BufferedTile(t, self.pixelbuffer)
+                for t in self.pyramid.tiles_from_bounds(tile.bounds, tile.zoom)
+            ],
+            **kwargs
+        )
+
+    def _index_path(self, zoom, create=True):
+        """Return path to index of zoom level and create index if necessary."""
+        path = os.path.join(self.path, str(zoom), "index.sqlite")
+        if create and path not in self._indexes:
+            makedirs(os.path.dirname(path))
+            connection = sqlite.get_connection(path)
+            with connection:
+                connection.execute(_INDEX_SCHEMA)
+            self._indexes.add(path)
+        return path
+
+
+class InputTile(base.InputTile):
+    """
+    Target Tile representation of input data.
+
+    Parameters
+    ----------
+    tile : ``Tile``
+    kwargs : keyword arguments
+        driver specific parameters
+
+    Attributes
+    ----------
+    tile : tile : ``Tile``
+    """
+
+    def __init__(self, tile, **kwargs):
+        """Initialize."""
+        self.tile = tile
+        self._output = kwargs["output"]
+        self._tiles = kwargs["tiles"]
+
+    def read(self, indexes=None, resampling="nearest", **kwargs):
+        """
+        Read resampled input data.
+
+        If the tile matches exactly one stored tile, the memory mapped array is
+        returned without copying it.
+
+        Parameters
+        ----------
+        indexes : list or int
+            a list of band numbers; None will read all.
+        resampling : string
+            one of "nearest", "average", "bilinear" or "lanczos"
+
+        Returns
+        -------
+        data : array
+        """
+        if self.is_empty():
+            arr = self._output.empty(self.tile)
+        elif (
+            len(self._tiles) == 1 and
+            self._tiles[0].bounds == self.tile.bounds and
+            self._tiles[0].shape == self.tile.shape
+        ):
+            arr = self._output.read(self._tiles[0])
+        else:
+            nodata = self._output.nodata
+            arr = resample_from_array(
+                in_raster=create_mosaic(
+                    tiles=[(t, self._output.read(t)) for t in self._tiles],
+                    nodata=nodata
+                ),
+                out_tile=self.tile,
+                resampling=resampling,
+                nodataval=nodata
+            )
+        if indexes is None:
+            return arr
+        elif isinstance(indexes, int):
+            return arr[indexes - 1]
+        else:
+            return arr[[i - 1 for i in indexes]]
+
+    def is_empty(self):
+        """
+        Check if there is data within this tile.
+
+        Returns
+        -------
+        is empty : bool
+        """
+        return not any(
+            self._output.tiles_exist(output_tile=t) for t in self._tiles
+        )
+
+
+def _save(path, arr):
+    tile = np.empty(arr.shape, dtype=[("data", arr.dtype), ("mask", bool)])
+    tile["data"] = arr.data
+    tile["mask"] = ma.getmaskarray(arr)
+    # write to temporary file first so readers never map incomplete files
+    tmp_path = "%s.%s.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as dst:
+        np.save(dst, tile)
+    os.replace(tmp_path, path)
@@ -19,7 +19,6 @@ nodata: integer or float
     nodata value used for writing
 """
 
-import boto3
 import logging
 import numpy as np
 import numpy.ma as ma
@@ -30,9 +29,8 @@ import six
 
 from mapchete.config import validate_values
 from mapchete.formats import base
-from mapchete.io import GDAL_HTTP_OPTS, makedirs
-from mapchete.io.raster import write_raster_window, prepare_array, memory_file
-from mapchete.tile import BufferedTile
+from mapchete.io import GDAL_HTTP_OPTS, makedirs, path_is_remote, gdal_env
+from mapchete.io.raster import write_raster_windows, prepare_array, memory_file
 
 
 logger = logging.getLogger(__name__)
@@ -88,7 +86,6 @@ class OutputData(base.OutputData):
         self.output_params = output_params
         self.output_params["dtype"] = PNG_DEFAULT_PROFILE["dtype"]
         self.nodata = output_params.get("nodata", PNG_DEFAULT_PROFILE["nodata"])
-        self._bucket = self.path.split("/")[2] if self.path.startswith("s3://") else None
 
     def write(self, process_tile, data):
         """
@@ -105,26 +102,12 @@ class OutputData(base.OutputData):
         if data.mask.all():
             logger.debug("data empty, nothing to write")
         else:
-            # in case of S3 output, create an boto3 resource
-            bucket_resource = (
-                boto3.resource('s3').Bucket(self._bucket)
-                if self._bucket
-                else None
-            )
-
             # Convert from process_tile to output_tiles and write
-            for tile in self.pyramid.intersecting(process_tile):
-                out_path = self.get_path(tile)
-                self.prepare_path(tile)
-                out_tile = BufferedTile(tile, self.pixelbuffer)
-                write_raster_window(
-                    in_tile=process_tile,
-                    in_data=data,
-                    out_profile=self.profile(out_tile),
-                    out_tile=out_tile,
-                    out_path=out_path,
-                    bucket_resource=bucket_resource
-                )
+            write_raster_windows(
+                in_tile=process_tile,
+                in_data=data,
+                out_windows=self._output_windows(process_tile)
+            )
 
     def read(self, output_tile):
         """
@@ -141,7 +124,7 @@ class OutputData(base.OutputData):
         """
         path = self.get_path(output_tile)
         try:
-            with rasterio.Env(**GDAL_HTTP_OPTS):
+            with gdal_env(defaults=GDAL_HTTP_OPTS if path_is_remote(path) else None):
                 with rasterio.open(path, "r") as src:
                     return src.read(masked=True)
         except RasterioIOError as e:
@@ -207,7 +190,7 @@ class OutputData(base.OutputData):
         metadata : dictionary
             output profile dictionary used for rasterio.
         """
-        dst_metadata = PNG_DEFAULT_PROFILE
+        dst_metadata = dict(PNG_DEFAULT_PROFILE)
         dst_metadata.pop("transform", None)
         if tile is not None:
             dst_metadata.update(
@@ -219,13 +202,15 @@ class OutputData(base.OutputData):
             pass
         return dst_metadata
 
-    def for_web(self, data):
+    def for_web(self, data, tile=None):
         """
         Convert data to web output.
 
         Parameters
         ----------
         data : array
+        tile : ``BufferedTile``
+            tile the data belongs to (optional)
 
         Returns
         -------
@@ -261,25 +246,43 @@ class OutputData(base.OutputData):
         )
 
     def _prepare_array_for_png(self, data):
-        data = prepare_array(data, dtype=np.uint8)
-        # Create 3D NumPy array with alpha channel.
-        if len(data) == 1:
-            rgba = np.stack((
-                data[0], data[0], data[0],
-                np.where(
-                    data[0].data == self.nodata, 0, 255)
-                .astype("uint8")
-            ))
-        elif len(data) == 2:
-            rgba = np.stack((data[0], data[0], data[0], data[1]))
-        elif len(data) == 3:
-            rgba = np.stack((
-                data[0], data[1], data[2], np.where(
-                    data[0].data == self.nodata, 0, 255
-                ).astype("uint8")
-            ))
-        elif len(data) == 4:
-            rgba = np.array(data).astype("uint8")
-        else:
-            raise TypeError("invalid number of bands: %s" % len(data))
-        return rgba
+        return prepare_rgba(data, nodata=self.nodata)
+
+
+def prepare_rgba(data, nodata=0):
+    """
+    Convert 1 to 4 band data into an 8 bit RGBA array.
+
+    Parameters
+    ----------
+    data : array
+        grayscale, grayscale with alpha, RGB or RGBA data
+    nodata : integer
+        value set to transparent for grayscale and RGB data
+
+    Returns
+    -------
+    RGBA data : array
+    """
+    data = prepare_array(data, dtype=np.uint8)
+    # Create 3D NumPy array with alpha channel.
+    if len(data) == 1:
+        rgba = np.stack((
+            data[0], data[0], data[0],
+            np.where(
+                data[0].data == nodata, 0, 255)
+            .astype("uint8")
+        ))
+    elif len(data) == 2:
+        rgba = np.stack((data[0], data[0], data[0], data[1]))
+    elif len(data) == 3:
+        rgba = np.stack((
+            data[0], data[1], data[2], np.where(
+                data[0].data == nodata, 0, 255
+            ).astype("uint8")
+        ))
+    elif len(data) == 4:
+        rgba = np.array(data).astype("uint8")
+    else:
+        raise TypeError("invalid number of bands: %s" % len(data))
+    return rgba
@@ -20,7 +20,6 @@ nodata: integer or float
     nodata value used for writing
 """
 
-import boto3
 import logging
 import numpy as np
 import numpy.ma as ma
@@ -31,9 +30,8 @@ import six
 
 from mapchete.config import validate_values
 from mapchete.formats import base
-from mapchete.io import GDAL_HTTP_OPTS, makedirs
-from mapchete.io.raster import write_raster_window, prepare_array, memory_file
-from mapchete.tile import BufferedTile
+from mapchete.io import GDAL_HTTP_OPTS, makedirs, path_is_remote, gdal_env
+from mapchete.io.raster import write_raster_windows, prepare_array, memory_file
 
 
 logger = logging.getLogger(__name__)
@@ -96,7 +94,6 @@ class OutputData(base.OutputData):
         except KeyError:
             self.old_band_num = False
         self.output_params.update(dtype=self._profile["dtype"])
-        self._bucket = self.path.split("/")[2] if self.path.startswith("s3://") else None
 
     def write(self, process_tile, data):
         """
@@ -112,26 +109,12 @@ class OutputData(base.OutputData):
         if data.mask.all():
             logger.debug("data empty, nothing to write")
         else:
-            # in case of S3 output, create an boto3 resource
-            bucket_resource = (
-                boto3.resource('s3').Bucket(self._bucket)
-                if self._bucket
-                else None
-            )
-
             # Convert from process_tile to output_tiles and write
-            for tile in self.pyramid.intersecting(process_tile):
-                out_path = self.get_path(tile)
-                self.prepare_path(tile)
-                out_tile = BufferedTile(tile, self.pixelbuffer)
-                write_raster_window(
-                    in_tile=process_tile,
-                    in_data=data,
-                    out_profile=self.profile(out_tile),
-                    out_tile=out_tile,
-                    out_path=out_path,
-                    bucket_resource=bucket_resource
-                )
+            write_raster_windows(
+                in_tile=process_tile,
+                in_data=data,
+                out_windows=self._output_windows(process_tile)
+            )
 
     def read(self, output_tile):
         """
@@ -148,7 +131,7 @@ class OutputData(base.OutputData):
         """
         path = self.get_path(output_tile)
         try:
-            with rasterio.Env(**GDAL_HTTP_OPTS):
+            with gdal_env(defaults=GDAL_HTTP_OPTS if path_is_remote(path) else None):
                 with rasterio.open(path, "r") as src:
                     return ma.masked_values(src.read(4 if self.old_band_num else 2), 0)
         except RasterioIOError as e:
@@ -225,13 +208,15 @@ class OutputData(base.OutputData):
             )
         return dst_metadata
 
-    def for_web(self, data):
+    def for_web(self, data, tile=None):
         """
         Convert data to web output.
 
         Parameters
         ----------
         data : array
+        tile : ``BufferedTile``
+            tile the data belongs to (optional)
 
         Returns
         -------
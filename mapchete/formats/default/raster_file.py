@@ -3,17 +3,28 @@ Raster file input which can be read by rasterio.
 
 Currently limited by extensions .tif, .vrt., .png and .jp2 but could be
 extended easily.
+
+Configured as abstract input with ``footprint: true``, the process area is
+limited to a valid-data footprint derived from the dataset mask instead of the
+file bounding box. Footprints are cached on disk (see
+``mapchete.io.footprint``).
 """
 
 from cached_property import cached_property
 from copy import deepcopy
+from functools import partial
 import logging
 import os
 import rasterio
+from rasterio.transform import array_bounds
 from shapely.geometry import box
+from shapely.prepared import prep
 import warnings
 
 from mapchete.formats import base
+from mapchete.io import absolute_path
+from mapchete.io.footprint import cached_footprint, raster_footprint
+from mapchete.io.input_cache import tile_key
 from mapchete.io.vector import reproject_geometry, segmentize_geometry
 from mapchete.io.raster import read_raster_window
 from mapchete import io
@@ -42,6 +53,10 @@ class InputData(base.InputData):
     ----------
     path : string
         path to input file
+    remote_cache : ``RemoteFileCache``
+        local cache for remote files (optional)
+    input_cache : ``InputCache``
+        per-worker cache of decoded arrays (optional)
     profile : dictionary
         rasterio metadata dictionary
     pixelbuffer : integer
@@ -52,6 +67,10 @@ class InputData(base.InputData):
         object describing the process coordinate reference system
     srid : string
         spatial reference ID of CRS (e.g. "{'init': 'epsg:4326'}")
+    use_footprint : bool
+        limit data area to valid-data footprint instead of bounding box
+    footprint_dir : string
+        directory where footprints of remote files are cached
     """
 
     METADATA = {
@@ -60,16 +79,53 @@ class InputData(base.InputData):
         "mode": "r",
         "file_extensions": ["tif", "vrt", "png", "jp2"]
     }
+    SUPER_TILE_READS = True
 
     def __init__(self, input_params, **kwargs):
         """Initialize."""
         super(InputData, self).__init__(input_params, **kwargs)
-        self.path = input_params["path"]
+        if "abstract" in input_params:
+            self.path = absolute_path(
+                path=input_params["abstract"]["path"],
+                base_dir=input_params["conf_dir"]
+            )
+            self.use_footprint = input_params["abstract"].get("footprint", False)
+            self.footprint_dir = input_params["abstract"].get("footprint_dir")
+            if self.footprint_dir:
+                self.footprint_dir = absolute_path(
+                    path=self.footprint_dir, base_dir=input_params["conf_dir"]
+                )
+        else:
+            self.path = input_params["path"]
+            self.use_footprint = False
+            self.footprint_dir = None
+        self.remote_cache = input_params.get("remote_cache")
+        self.input_cache = input_params.get("input_cache")
+        # bounding boxes, footprints and their prepared geometries per output
+        # CRS
+        self._bboxes = {}
+        self._prepared_bboxes = {}
+        self._footprints = {}
+        self._prepared_footprints = {}
+
+    def __getstate__(self):
+        """Drop prepared geometries as they cannot be pickled."""
+        state = self.__dict__.copy()
+        state["_prepared_bboxes"] = {}
+        state["_prepared_footprints"] = {}
+        return state
+
+    @property
+    def local_path(self):
+        """Return path to local copy if remote cache is active, else path."""
+        if self.remote_cache is None:
+            return self.path
+        return self.remote_cache.local_path(self.path)
 
     @cached_property
     def profile(self):
         """Return raster metadata."""
-        with rasterio.open(self.path, "r") as src:
+        with rasterio.open(self.local_path, "r") as src:
             return deepcopy(src.meta)
 
     def open(self, tile, **kwargs):
@@ -102,21 +158,107 @@ class InputData(base.InputData):
             Shapely geometry object
         """
         out_crs = self.pyramid.crs if out_crs is None else out_crs
-        with rasterio.open(self.path) as inp:
-            inp_crs = inp.crs
-            out_bbox = bbox = box(*inp.bounds)
+        key = str(out_crs)
+        if key not in self._bboxes:
+            self._bboxes[key] = self._bbox(out_crs)
+        return self._bboxes[key]
+
+    def prepared_bbox(self, out_crs=None):
+        """
+        Return prepared data bounding box for fast intersection tests.
+
+        Parameters
+        ----------
+        out_crs : ``rasterio.crs.CRS``
+            rasterio CRS object (default: CRS of process pyramid)
+
+        Returns
+        -------
+        bounding box : prepared geometry
+            Shapely prepared geometry object
+        """
+        out_crs = self.pyramid.crs if out_crs is None else out_crs
+        key = str(out_crs)
+        if key not in self._prepared_bboxes:
+            self._prepared_bboxes[key] = prep(self.bbox(out_crs=out_crs))
+        return self._prepared_bboxes[key]
+
+    def footprint(self, out_crs=None):
+        """
+        Return valid-data footprint or bounding box if footprint is not used.
+
+        Parameters
+        ----------
+        out_crs : ``rasterio.crs.CRS``
+            rasterio CRS object (default: CRS of process pyramid)
+
+        Returns
+        -------
+        footprint : geometry
+            Shapely geometry object
+        """
+        out_crs = self.pyramid.crs if out_crs is None else out_crs
+        if not self.use_footprint:
+            return self.bbox(out_crs=out_crs)
+        key = str(out_crs)
+        if key not in self._footprints:
+            footprint, inp_crs = cached_footprint(
+                self.path, raster_footprint, cache_dir=self.footprint_dir
+            )
+            if inp_crs != out_crs and not footprint.is_empty:
+                footprint = reproject_geometry(
+                    segmentize_geometry(
+                        footprint,
+                        self.profile["transform"][0] * self.pyramid.tile_size
+                    ),
+                    src_crs=inp_crs, dst_crs=out_crs
+                )
+            self._footprints[key] = footprint
+        return self._footprints[key]
+
+    def prepared_footprint(self, out_crs=None):
+        """
+        Return prepared footprint for fast intersection tests.
+
+        Parameters
+        ----------
+        out_crs : ``rasterio.crs.CRS``
+            rasterio CRS object (default: CRS of process pyramid)
+
+        Returns
+        -------
+        footprint : prepared geometry
+            Shapely prepared geometry object
+        """
+        out_crs = self.pyramid.crs if out_crs is None else out_crs
+        if not self.use_footprint:
+            return self.prepared_bbox(out_crs=out_crs)
+        key = str(out_crs)
+        if key not in self._prepared_footprints:
+            self._prepared_footprints[key] = prep(
+                self.footprint(out_crs=out_crs)
+            )
+        return self._prepared_footprints[key]
+
+    def _bbox(self, out_crs):
+        # use cached profile instead of opening the file again
+        inp_crs = self.profile["crs"]
+        inp_transform = self.profile["transform"]
+        bbox = box(*array_bounds(
+            self.profile["height"], self.profile["width"], inp_transform
+        ))
         # If soucre and target CRSes differ, segmentize and reproject
         if inp_crs != out_crs:
             # estimate segmentize value (raster pixel size * tile size)
             # and get reprojected bounding box
             return reproject_geometry(
                 segmentize_geometry(
-                    bbox, inp.transform[0] * self.pyramid.tile_size
+                    bbox, inp_transform[0] * self.pyramid.tile_size
                 ),
                 src_crs=inp_crs, dst_crs=out_crs
             )
         else:
-            return out_bbox
+            return bbox
 
     def exists(self):
         """
@@ -169,13 +311,28 @@ class InputTile(base.InputTile):
         -------
         data : array
         """
-        return read_raster_window(
+        band_indexes = self._get_band_indexes(indexes)
+        read = partial(
+            read_raster_window,
             self.raster_file.path,
             self.tile,
-            indexes=self._get_band_indexes(indexes),
             resampling=self.resampling,
-            gdal_opts=self.gdal_opts
+            gdal_opts=self.gdal_opts,
+            remote_cache=self.raster_file.remote_cache
         )
+        if self.raster_file.input_cache is None:
+            return read(indexes=band_indexes)
+        # read all bands once and return copies of the requested bands
+        data = self.raster_file.input_cache.get(
+            (
+                "raster_file", self.raster_file.path, tile_key(self.tile),
+                self.resampling
+            ),
+            partial(read, indexes=None)
+        )
+        if len(band_indexes) == 1:
+            return data[band_indexes[0] - 1].copy()
+        return data[[i - 1 for i in band_indexes]]
 
     def is_empty(self, indexes=None):
         """
@@ -185,10 +342,10 @@ class InputTile(base.InputTile):
         -------
         is empty : bool
         """
-        # empty if tile does not intersect with file bounding box
-        return not self.tile.bbox.intersects(
-            self.raster_file.bbox(out_crs=self.tile.crs)
-        )
+        # empty if tile does not intersect with file footprint or bounding box
+        return not self.raster_file.prepared_footprint(
+            out_crs=self.tile.crs
+        ).intersects(self.tile.bbox)
 
     def _get_band_indexes(self, indexes=None):
         """Return valid band indexes."""
@@ -0,0 +1,507 @@
+"""
+Mosaic of many raster files used as one input.
+
+Instead of listing scenes as separate inputs or building a VRT beforehand, all
+files are combined into one input. File footprints are held in a spatial index,
+so a tile only reads the files intersecting with it. These files are read
+concurrently using ``read_raster_window()`` and merged pixel by pixel.
+
+input configuration parameters
+------------------------------
+
+mandatory (one of)
+~~~~~~~~~~~~~~~~~~
+
+paths: string or list
+    glob pattern or list of raster file paths
+index: string
+    GeoJSON file with one feature per raster file, the geometry is used as
+    file footprint; relative paths are resolved from the index location
+
+optional
+~~~~~~~~
+
+index_path_field: string
+    property of index features holding the file path (default: "path")
+method: string
+    how overlapping pixels are merged, one of "first", "last", "min", "max"
+    or "mean" (default: "first")
+footprint: bool
+    use valid-data footprints instead of bounding boxes of files provided by
+    ``paths`` (see ``mapchete.io.footprint``, default: false)
+footprint_dir: string
+    directory where footprints of remote files are cached
+threads: integer
+    maximum number of files read concurrently (default: 8)
+dtype: string
+    output data type (default: data type of first file)
+nodata: integer or float
+    output nodata value (default: nodata value of first file or 0)
+count: integer
+    number of bands (default: band count of first file)
+
+With "first" and "last", reading stops as soon as all pixels are filled, so
+files should be ordered by priority.
+"""
+
+from cached_property import cached_property
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import glob
+import logging
+import numpy as np
+import numpy.ma as ma
+import os
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import array_bounds
+import six
+from shapely.geometry import box, shape
+from shapely.ops import cascaded_union
+from tilematrix import clip_geometry_to_srs_bounds
+
+from mapchete.errors import MapcheteConfigError
+from mapchete.formats import base
+from mapchete.io import (
+    absolute_path, gdal_env, path_is_remote, read_json, GDAL_HTTP_OPTS
+)
+from mapchete.io.footprint import cached_footprint, raster_footprint
+from mapchete.io.input_cache import tile_key
+from mapchete.io.raster import (
+    merge_arrays, prepare_array, read_raster_window, MERGE_METHODS
+)
+from mapchete.io.vector import (
+    reproject_geometry, segmentize_geometry, IndexedFeatures
+)
+
+
+logger = logging.getLogger(__name__)
+
+METADATA = {
+    "driver_name": "raster_mosaic",
+    "data_type": "raster",
+    "mode": "r",
+    "file_extensions": None
+}
+
+MOSAIC_THREADS = 8
+
+
+class InputData(base.InputData):
+    """
+    Main input class.
+
+    Parameters
+    ----------
+    input_params : dictionary
+        driver specific parameters
+
+    Attributes
+    ----------
+    path : string
+        path to index file or glob pattern
+    remote_cache : ``RemoteFileCache``
+        local cache for remote files (optional)
+    input_cache : ``InputCache``
+        per-worker cache of decoded arrays (optional)
+    gdal_opts : dict
+        GDAL options of the process, also set in threads reading files
+    method : string
+        merge method for overlapping files
+    threads : integer
+        maximum number of files read concurrently
+    sources : list
+        (footprint, path) tuples with footprints in process CRS
+    pixelbuffer : integer
+        buffer around output tiles
+    pyramid : ``tilematrix.TilePyramid``
+        output ``TilePyramid``
+    crs : ``rasterio.crs.CRS``
+        object describing the process coordinate reference system
+    srid : string
+        spatial reference ID of CRS (e.g. "{'init': 'epsg:4326'}")
+    """
+
+    METADATA = METADATA
+    SUPER_TILE_READS = True
+
+    def __init__(self, input_params, **kwargs):
+        """Initialize."""
+        super(InputData, self).__init__(input_params, **kwargs)
+        params = input_params["abstract"]
+        conf_dir = input_params["conf_dir"]
+        self.remote_cache = input_params.get("remote_cache")
+        self.input_cache = input_params.get("input_cache")
+        self.gdal_opts = input_params.get("gdal_opts") or {}
+        self.method = params.get("method", "first")
+        if self.method not in MERGE_METHODS:
+            raise MapcheteConfigError(
+                "raster_mosaic method must be one of %s" % (MERGE_METHODS, )
+            )
+        self.threads = params.get("threads", MOSAIC_THREADS)
+        footprint_dir = params.get("footprint_dir")
+        if footprint_dir:
+            footprint_dir = absolute_path(path=footprint_dir, base_dir=conf_dir)
+        if ("paths" in params) == ("index" in params):
+            raise MapcheteConfigError(
+                "raster_mosaic requires either 'paths' or 'index'"
+            )
+        if "index" in params:
+            self.path = absolute_path(path=params["index"], base_dir=conf_dir)
+            self.sources = _sources_from_index(
+                self.path, params.get("index_path_field", "path"),
+                self.pyramid.crs
+            )
+        else:
+            if isinstance(params["paths"], six.string_types):
+                self.path = absolute_path(path=params["paths"], base_dir=conf_dir)
+                paths = sorted(glob.glob(self.path))
+            else:
+                self.path = None
+                paths = [
+                    absolute_path(path=p, base_dir=conf_dir)
+                    for p in params["paths"]
+                ]
+            self.sources = self._sources_from_files(
+                paths, params.get("footprint", False), footprint_dir
+            )
+        logger.debug("%s files in raster mosaic", len(self.sources))
+        self._params_profile = {
+            k: params[k] for k in ["dtype", "nodata", "count"] if k in params
+        }
+        self._footprints = {}
+        self._index = None
+
+    def __getstate__(self):
+        """Drop spatial index as it cannot be pickled."""
+        state = self.__dict__.copy()
+        state["_index"] = None
+        return state
+
+    @cached_property
+    def profile(self):
+        """Return output dtype, nodata and count, by default from first file."""
+        if not self.sources:
+            profile = dict(dtype="uint8", nodata=0, count=1)
+        else:
+            with gdal_env(
+                defaults=GDAL_HTTP_OPTS if path_is_remote(self.sources[0][1])
+                else None
+            ), rasterio.open(self.sources[0][1]) as src:
+                profile = dict(
+                    dtype=src.dtypes[0],
+                    nodata=src.nodata if src.nodata is not None else 0,
+                    count=src.count
+                )
+        profile.update(self._params_profile)
+        return profile
+
+    def index(self):
+        """
+        Return spatial index of file footprints.
+
+        Returns
+        -------
+        index : ``mapchete.io.vector.IndexedFeatures``
+        """
+        if self._index is None:
+            self._index = IndexedFeatures(self.sources)
+        return self._index
+
+    def intersecting(self, tile):
+        """
+        Return paths of files intersecting with tile in mosaic order.
+
+        Parameters
+        ----------
+        tile : ``Tile``
+
+        Returns
+        -------
+        paths : list
+        """
+        if tile.pixelbuffer and tile.is_on_edge():
+            tile_boxes = clip_geometry_to_srs_bounds(
+                tile.bbox, tile.tile_pyramid, multipart=True
+            )
+        else:
+            tile_boxes = [tile.bbox]
+        if len(tile_boxes) == 1:
+            return [
+                path for _, path in self.index().intersecting(tile_boxes[0])
+            ]
+        # keep mosaic order for tiles split at the antimeridian
+        paths = set(
+            path
+            for bbox in tile_boxes
+            for _, path in self.index().intersecting(bbox)
+        )
+        return [path for _, path in self.sources if path in paths]
+
+    def open(self, tile, **kwargs):
+        """
+        Return InputTile object.
+
+        Parameters
+        ----------
+        tile : ``Tile``
+
+        Returns
+        -------
+        input tile : ``InputTile``
+            tile view of input data
+        """
+        return InputTile(tile, self, **kwargs)
+
+    def bbox(self, out_crs=None):
+        """
+        Return data bounding box.
+
+        Parameters
+        ----------
+        out_crs : ``rasterio.crs.CRS``
+            rasterio CRS object (default: CRS of process pyramid)
+
+        Returns
+        -------
+        bounding box : geometry
+            Shapely geometry object
+        """
+        footprint = self.footprint(out_crs=out_crs)
+        return footprint if footprint.is_empty else box(*footprint.bounds)
+
+    def footprint(self, out_crs=None):
+        """
+        Return union of all file footprints.
+
+        Parameters
+        ----------
+        out_crs : ``rasterio.crs.CRS``
+            rasterio CRS object (default: CRS of process pyramid)
+
+        Returns
+        -------
+        footprint : geometry
+            Shapely geometry object
+        """
+        out_crs = self.pyramid.crs if out_crs is None else out_crs
+        key = str(out_crs)
+        if key not in self._footprints:
+            footprint = cascaded_union([f for f, _ in self.sources])
+            if out_crs != self.pyramid.crs and not footprint.is_empty:
+                footprint = reproject_geometry(
+                    footprint, src_crs=self.pyramid.crs, dst_crs=out_crs
+                )
+            self._footprints[key] = footprint
+        return self._footprints[key]
+
+    def exists(self):
+        """
+        Check if data or file even exists.
+
+        Returns
+        -------
+        file exists : bool
+        """
+        return len(self.sources) > 0
+
+    def _sources_from_files(self, paths, use_footprint, footprint_dir):
+        def _footprint(path):
+            if use_footprint:
+                footprint, crs = cached_footprint(
+                    path, raster_footprint, cache_dir=footprint_dir
+                )
+                segmentize_value = None
+            else:
+                with gdal_env(
+                    defaults=GDAL_HTTP_OPTS if path_is_remote(path) else None
+                ), rasterio.open(path) as src:
+                    footprint = box(*array_bounds(
+                        src.height, src.width, src.transform
+                    ))
+                    crs = src.crs
+                    segmentize_value = src.transform[0] * self.pyramid.tile_size
+            if crs == self.pyramid.crs or footprint.is_empty:
+                return footprint
+            return reproject_geometry(
+                segmentize_geometry(footprint, segmentize_value)
+                if segmentize_value else footprint,
+                src_crs=crs, dst_crs=self.pyramid.crs
+            )
+
+        # files are only opened to read their bounds, so this is I/O bound
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(len(paths), self.threads))
+        ) as executor:
+            footprints = list(executor.map(_footprint, paths))
+        return [
+            (footprint, path)
+            for footprint, path in zip(footprints, paths)
+            if not footprint.is_empty
+        ]
+
+
+class InputTile(base.InputTile):
+    """
+    Target Tile representation of input data.
+
+    Parameters
+    ----------
+    tile : ``Tile``
+    kwargs : keyword arguments
+        driver specific parameters
+
+    Attributes
+    ----------
+    tile : tile : ``Tile``
+    raster_mosaic : ``InputData``
+        parent InputData object
+    resampling : string
+        resampling method passed on to rasterio
+    """
+
+    def __init__(self, tile, raster_mosaic, resampling="nearest"):
+        """Initialize."""
+        self.tile = tile
+        self.raster_mosaic = raster_mosaic
+        self.resampling = resampling
+        self._paths = raster_mosaic.intersecting(tile)
+
+    def read(self, indexes=None):
+        """
+        Read reprojected & resampled input data merged from all files.
+
+        Parameters
+        ----------
+        indexes : list or int
+            a list of band numbers; None will read all.
+
+        Returns
+        -------
+        data : array
+        """
+        band_indexes = self._get_band_indexes(indexes)
+        if self.raster_mosaic.input_cache is None:
+            merged = self._read_bands(band_indexes)
+        else:
+            # merge all bands once and return copies of the requested bands
+            merged = self.raster_mosaic.input_cache.get(
+                (
+                    "raster_mosaic", tuple(self._paths),
+                    self.raster_mosaic.method, tile_key(self.tile),
+                    self.resampling
+                ) + tuple(sorted(self.raster_mosaic.profile.items())),
+                partial(self._read_bands, self._get_band_indexes())
+            )[[i - 1 for i in band_indexes]]
+        return merged[0] if isinstance(indexes, int) else merged
+
+    def is_empty(self):
+        """
+        Check if there is data within this tile.
+
+        Returns
+        -------
+        is empty : bool
+        """
+        return len(self._paths) == 0
+
+    def _read_bands(self, band_indexes):
+        profile = self.raster_mosaic.profile
+        method = self.raster_mosaic.method
+        threads = max(1, self.raster_mosaic.threads)
+        if self.is_empty():
+            merged = ma.masked_array(
+                data=np.full(
+                    (len(band_indexes), ) + self.tile.shape, profile["nodata"],
+                    dtype=profile["dtype"]
+                ),
+                mask=True,
+                fill_value=profile["nodata"]
+            )
+        elif method in ("first", "last"):
+            # read batches in priority order until all pixels are filled
+            paths = self._paths if method == "first" else self._paths[::-1]
+            merged = None
+            for i in range(0, len(paths), threads):
+                arrays = self._read_files(paths[i:i + threads], band_indexes)
+                merged = merge_arrays(
+                    arrays if merged is None else [merged] + arrays,
+                    method="first"
+                )
+                if not ma.getmaskarray(merged).any():
+                    break
+        else:
+            merged = merge_arrays(
+                self._read_files(self._paths, band_indexes), method=method
+            )
+        return merged
+
+    def _read_files(self, paths, indexes):
+        profile = self.raster_mosaic.profile
+
+        def _read(path):
+            # GDAL environment of worker is not active in other threads
+            with gdal_env(self.raster_mosaic.gdal_opts):
+                return _read_file(path)
+
+        def _read_file(path):
+            if path_is_remote(path):
+                gdal_opts = {
+                    "GDAL_DISABLE_READDIR_ON_OPEN": True,
+                    "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": "%s,.ovr" % (
+                        os.path.splitext(path)[1]
+                    )
+                }
+            else:
+                gdal_opts = {}
+            return prepare_array(
+                read_raster_window(
+                    path, self.tile, indexes=indexes,
+                    resampling=self.resampling,
+                    dst_nodata=profile["nodata"], gdal_opts=gdal_opts,
+                    remote_cache=self.raster_mosaic.remote_cache
+                ),
+                masked=True, nodata=profile["nodata"], dtype=profile["dtype"]
+            )
+
+        if len(paths) == 1:
+            return [_read_file(paths[0])]
+        with ThreadPoolExecutor(
+            max_workers=min(len(paths), self.raster_mosaic.threads)
+        ) as executor:
+            return list(executor.map(_read, paths))
+
+    def _get_band_indexes(self, indexes=None):
+        """Return valid band indexes."""
+        if indexes:
+            if isinstance(indexes, list):
+                return indexes
+            else:
+                return [indexes]
+        else:
+            return list(range(1, self.raster_mosaic.profile["count"] + 1))
+
+
+def _sources_from_index(path, path_field, crs):
+    """Read file footprints and paths from GeoJSON index."""
+    index = read_json(path)
+    index_crs = CRS.from_user_input(
+        index.get("crs", {}).get("properties", {}).get("name", "EPSG:4326")
+    )
+    index_dir = os.path.dirname(path)
+    sources = []
+    for feature in index["features"]:
+        footprint = shape(feature["geometry"])
+        if footprint.is_empty:
+            continue
+        if index_crs != crs:
+            footprint = reproject_geometry(
+                footprint, src_crs=index_crs, dst_crs=crs
+            )
+        sources.append((
+            footprint,
+            absolute_path(
+                path=feature["properties"][path_field], base_dir=index_dir
+            )
+        ))
+    return sources
@@ -1,17 +1,45 @@
-"""Use a directory of zoom/row/column tiles as input."""
+"""
+Use a directory of zoom/row/column tiles as input.
+
+Existing tiles are determined from one directory listing per tile row when a
+tile is opened, so not every candidate tile path has to be checked.
+
+Raster tiles are read in one pass: if the tile directory and the process tile
+share the same grid, pixels of the source tiles are copied directly into the
+output array. Otherwise one VRT over all contributing tiles is warped to the
+process tile. Process tiles whose pixelbuffer exceeds the pyramid edges are
+read tile by tile and mosaicked.
+
+With ``nearest_zoom: true``, tiles of process zoom levels not contained in the
+tile directory are read from the nearest available zoom level at most
+``max_zoom_distance`` (default: 3) zoom levels away, preferring the next higher
+one. With ``resampling="average"``, tiles of higher zoom levels on the same grid
+are reduced by averaging pixel blocks, otherwise they are warped. Available zoom
+levels are taken from ``zoom_levels`` in the input configuration or in
+``metadata.json`` or from a directory scan.
+"""
 
 from itertools import chain
 import logging
+import math
 import numpy as np
 import numpy.ma as ma
 import os
+import rasterio
+from rasterio.dtypes import _gdal_typename
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
 import six
 from shapely.geometry import box
+import xml.etree.ElementTree as ET
 
-from mapchete.config import validate_values
+from mapchete.config import get_zoom_levels, validate_values
 from mapchete.errors import MapcheteConfigError
 from mapchete.formats import base, load_output_writer
-from mapchete.io import path_exists, absolute_path, read_json, path_is_remote
+from mapchete.io import (
+    absolute_path, gdal_env, list_directory, path_exists, path_is_remote,
+    read_json, GDAL_HTTP_OPTS
+)
 from mapchete.io.vector import reproject_geometry, read_vector_window
 from mapchete.io.raster import read_raster_window, create_mosaic, resample_from_array
 from mapchete.tile import BufferedTilePyramid
@@ -108,6 +136,8 @@ class InputData(base.InputData):
                 extension=output.file_extension.split(".")[-1],
                 **params["driver"]
             )
+            if "zoom_levels" in params:
+                self._params.update(zoom_levels=params["zoom_levels"])
 
         # validate parameters
         validate_values(
@@ -119,7 +149,7 @@ class InputData(base.InputData):
             ]
         )
         if not self._params["extension"] in [
-            "tif", "vrt", "png", "jpg", "mixed", "jp2", "geojson"
+            "tif", "vrt", "png", "jpg", "mixed", "jp2", "geojson", "npy"
         ]:
             raise MapcheteConfigError(
                 "invalid file extension given: %s" % self._params["extension"]
@@ -143,6 +173,38 @@ class InputData(base.InputData):
             }
         else:
             self._profile = None
+        # NumPy array tiles are read using the NPY driver and its tile index
+        self._npy_output = load_output_writer(
+            dict(
+                format="NPY",
+                path=self.path,
+                type=self.td_pyramid.type,
+                metatiling=self.td_pyramid.metatiling,
+                pixelbuffer=self.td_pyramid.pixelbuffer,
+                bands=self._profile["count"],
+                dtype=self._profile["dtype"],
+                nodata=self._profile["nodata"]
+            ),
+            readonly=True
+        ) if self._ext == "npy" else None
+        self._nearest_zoom = self._params.get("nearest_zoom", False)
+        self._max_zoom_distance = self._params.get("max_zoom_distance", 3)
+        if not isinstance(self._nearest_zoom, bool):
+            raise MapcheteConfigError(
+                "nearest_zoom must be a boolean: %s" % self._nearest_zoom
+            )
+        if (
+            isinstance(self._max_zoom_distance, bool) or
+            not isinstance(self._max_zoom_distance, int) or
+            self._max_zoom_distance < 0
+        ):
+            raise MapcheteConfigError(
+                "invalid max_zoom_distance: %s" % self._max_zoom_distance
+            )
+        self._zoom_levels = (
+            get_zoom_levels(process_zoom_levels=self._params["zoom_levels"])
+            if self._params.get("zoom_levels") is not None else None
+        )
 
     def open(self, tile, **kwargs):
         """
@@ -157,21 +219,29 @@ class InputData(base.InputData):
         input tile : ``InputTile``
             tile view of input data
         """
+        zoom = self.source_zoom(tile.zoom)
+        # listings of tile rows are only kept while opening one tile, so
+        # tiles written in the meantime are found
+        listings = {}
+        if self._npy_output is not None:
+            # NPY driver is only imported for NumPy array tiles
+            from mapchete.formats.default import npy
+            return npy.InputTile(
+                tile,
+                output=self._npy_output,
+                tiles=list(self.td_pyramid.tiles_from_bounds(tile.bounds, zoom)),
+                **kwargs
+            )
         return InputTile(
             tile,
             tiles_paths=[
-                (_tile, _path)
-                for _tile, _path in [
-                    (t, os.path.join(*([
-                        self.path, str(t.zoom), str(t.row), str(t.col)
-                        ])) + "." + self._ext)
-                    for t in self.td_pyramid.tiles_from_bounds(
-                        tile.bounds, tile.zoom)
-                ]
-                if path_exists(_path)
+                (_tile, self._tile_path(_tile))
+                for _tile in self.td_pyramid.tiles_from_bounds(tile.bounds, zoom)
+                if self._tile_exists(_tile, listings)
             ],
             file_type=self._file_type,
             profile=self._profile,
+            td_pyramid=self.td_pyramid,
             **kwargs
         )
 
@@ -195,6 +265,73 @@ class InputData(base.InputData):
             dst_crs=self.pyramid.crs if out_crs is None else out_crs
         )
 
+    def available_zooms(self):
+        """
+        Return zoom levels available in tile directory.
+
+        Zoom levels are taken from the configuration, ``metadata.json`` or a
+        one-time scan of the directory.
+
+        Returns
+        -------
+        zoom levels : list or None
+            None if zoom levels cannot be determined
+        """
+        if self._zoom_levels is None:
+            names = list_directory(self.path)
+            if names is None:
+                return None
+            self._zoom_levels = sorted(int(n) for n in names if n.isdigit())
+            logger.debug(
+                "zoom levels in %s: %s", self.path, self._zoom_levels
+            )
+        return self._zoom_levels
+
+    def source_zoom(self, zoom):
+        """
+        Return zoom level tiles are read from for a process zoom level.
+
+        This is the zoom level itself if it is available or ``nearest_zoom`` is
+        not set, otherwise the nearest available zoom level within
+        ``max_zoom_distance``, preferring the next higher one.
+
+        Parameters
+        ----------
+        zoom : integer
+            process zoom level
+
+        Returns
+        -------
+        zoom : integer
+        """
+        if not self._nearest_zoom:
+            return zoom
+        zooms = [
+            z for z in self.available_zooms() or []
+            if abs(z - zoom) <= self._max_zoom_distance
+        ]
+        if not zooms or zoom in zooms:
+            return zoom
+        higher = [z for z in zooms if z > zoom]
+        return min(higher) if higher else max(zooms)
+
+    def _tile_path(self, tile):
+        return os.path.join(
+            self.path, str(tile.zoom), str(tile.row), str(tile.col)
+        ) + "." + self._ext
+
+    def _tile_exists(self, tile, listings):
+        """Check tile existence using a listing of its row."""
+        key = (tile.zoom, tile.row)
+        if key not in listings:
+            listings[key] = list_directory(
+                os.path.join(self.path, str(tile.zoom), str(tile.row))
+            )
+        if listings[key] is None:
+            # directories of HTTP paths cannot be listed
+            return path_exists(self._tile_path(tile))
+        return "%s.%s" % (tile.col, self._ext) in listings[key]
+
 
 class InputTile(base.InputTile):
     """
@@ -217,6 +354,7 @@ class InputTile(base.InputTile):
         self._tiles_paths = kwargs["tiles_paths"]
         self._file_type = kwargs["file_type"]
         self._profile = kwargs["profile"]
+        self._td_pyramid = kwargs.get("td_pyramid")
 
     def read(
         self, validity_check=False, indexes=None, resampling="nearest",
@@ -255,30 +393,23 @@ class InputTile(base.InputTile):
             ]))
         else:
             if self.is_empty():
-                count = (len(indexes) if indexes else self._profile["count"], )
+                count = (len(self._get_band_indexes(indexes)), )
                 return ma.masked_array(
                     data=np.full(
                         count + self.tile.shape, self._profile["nodata"],
                         dtype=self._profile["dtype"]),
                     mask=True
                 )
-            tiles = [
-                (
-                    _tile,
-                    read_raster_window(
-                        _path, _tile, indexes=indexes, resampling=resampling,
-                        src_nodata=self._profile["nodata"], dst_nodata=dst_nodata,
-                        gdal_opts=gdal_opts
-                    )
-                )
-                for _tile, _path in self._tiles_paths
-            ]
-            return resample_from_array(
-                in_raster=create_mosaic(tiles=tiles, nodata=self._profile["nodata"]),
-                out_tile=self.tile,
-                resampling=resampling,
-                nodataval=self._profile["nodata"]
+            if self.tile.pixelbuffer and self.tile.is_on_edge():
+                return self._read_mosaic(indexes, resampling, dst_nodata, gdal_opts)
+            factor = _pixel_factor(
+                self._td_pyramid, self.tile, self._tiles_paths[0][0].zoom
             )
+            if factor == 1:
+                return self._read_direct(indexes, dst_nodata, gdal_opts)
+            elif factor and resampling == "average":
+                return self._read_reduced(indexes, factor, dst_nodata, gdal_opts)
+            return self._read_vrt(indexes, resampling, dst_nodata, gdal_opts)
 
     def is_empty(self):
         """
@@ -289,3 +420,216 @@ class InputTile(base.InputTile):
         is empty : bool
         """
         return len(self._tiles_paths) == 0
+
+    def _read_direct(self, indexes=None, dst_nodata=None, gdal_opts=None):
+        """Copy pixels of source tiles on the same grid into output array."""
+        data = self._copy_pixels(indexes, gdal_opts=gdal_opts)
+        return _masked(
+            data, _nodata_mask(data, self._profile["nodata"]),
+            self._profile["nodata"] if dst_nodata is None else dst_nodata
+        )
+
+    def _read_reduced(
+        self, indexes=None, factor=2, dst_nodata=None, gdal_opts=None
+    ):
+        """Average pixel blocks of source tiles from a higher zoom level."""
+        data = self._copy_pixels(indexes, factor=factor, gdal_opts=gdal_opts)
+        bands, height, width = data.shape
+        reduced = ma.masked_array(
+            data, mask=_nodata_mask(data, self._profile["nodata"])
+        ).reshape(
+            bands, height // factor, factor, width // factor, factor
+        ).mean(axis=(2, 4))
+        if np.issubdtype(data.dtype, np.integer):
+            reduced = ma.round(reduced)
+        return _masked(
+            reduced.data.astype(data.dtype), ma.getmaskarray(reduced),
+            self._profile["nodata"] if dst_nodata is None else dst_nodata
+        )
+
+    def _copy_pixels(self, indexes=None, factor=1, gdal_opts=None):
+        """Copy pixels of source tiles into array covering the output tile."""
+        nodata = self._profile["nodata"]
+        band_indexes = self._get_band_indexes(indexes)
+        height, width = self.tile.shape
+        data = np.full(
+            (len(band_indexes), height * factor, width * factor), nodata,
+            dtype=self._profile["dtype"]
+        )
+        left, _, _, top = self.tile.bounds
+        x_size = self.tile.pixel_x_size / factor
+        y_size = self.tile.pixel_y_size / factor
+        with gdal_env(gdal_opts, defaults=self._gdal_defaults()):
+            for _, path in self._tiles_paths:
+                with rasterio.open(path) as src:
+                    # pixel offsets of output array within source tile
+                    col_off = int(round((left - src.transform.c) / x_size))
+                    row_off = int(round((src.transform.f - top) / y_size))
+                    src_col, src_row = max(col_off, 0), max(row_off, 0)
+                    dst_col, dst_row = max(-col_off, 0), max(-row_off, 0)
+                    width = min(src.width - src_col, data.shape[2] - dst_col)
+                    height = min(src.height - src_row, data.shape[1] - dst_row)
+                    if width <= 0 or height <= 0:
+                        continue
+                    src_data = src.read(
+                        band_indexes, window=Window(src_col, src_row, width, height)
+                    )
+                # buffers of neighbouring tiles overlap, only copy valid pixels
+                np.copyto(
+                    data[:, dst_row:dst_row + height, dst_col:dst_col + width],
+                    src_data, where=~_nodata_mask(src_data, nodata),
+                    casting="unsafe"
+                )
+        return data
+
+    def _read_vrt(
+        self, indexes=None, resampling="nearest", dst_nodata=None, gdal_opts=None
+    ):
+        """Warp a VRT over all source tiles to output tile."""
+        band_indexes = self._get_band_indexes(indexes)
+        with MemoryFile(
+            _tiles_vrt(
+                self._tiles_paths, band_indexes, self._td_pyramid.crs,
+                self._profile["dtype"], self._profile["nodata"]
+            ),
+            ext=".vrt"
+        ) as memfile:
+            data = read_raster_window(
+                memfile.name, self.tile, indexes=list(range(
+                    1, len(band_indexes) + 1
+                )),
+                resampling=resampling, src_nodata=self._profile["nodata"],
+                dst_nodata=dst_nodata,
+                gdal_opts=dict(self._gdal_defaults() or {}, **(gdal_opts or {}))
+            )
+        return data if data.ndim == 3 else ma.expand_dims(data, axis=0)
+
+    def _read_mosaic(
+        self, indexes=None, resampling="nearest", dst_nodata=None, gdal_opts=None
+    ):
+        """Read source tiles one by one, mosaic and resample them."""
+        tiles = [
+            (
+                _tile,
+                read_raster_window(
+                    _path, _tile, indexes=indexes, resampling=resampling,
+                    src_nodata=self._profile["nodata"], dst_nodata=dst_nodata,
+                    gdal_opts=gdal_opts
+                )
+            )
+            for _tile, _path in self._tiles_paths
+        ]
+        return resample_from_array(
+            in_raster=create_mosaic(tiles=tiles, nodata=self._profile["nodata"]),
+            out_tile=self.tile,
+            resampling=resampling,
+            nodataval=self._profile["nodata"]
+        )
+
+    def _get_band_indexes(self, indexes=None):
+        if indexes is None:
+            return list(range(1, self._profile["count"] + 1))
+        elif isinstance(indexes, int):
+            return [indexes]
+        return list(indexes)
+
+    def _gdal_defaults(self):
+        if any(path_is_remote(path) for _, path in self._tiles_paths):
+            return GDAL_HTTP_OPTS
+        return None
+
+
+def _nodata_mask(data, nodata):
+    """Return mask of nodata pixels, also for NaN nodata values."""
+    if isinstance(nodata, float) and math.isnan(nodata):
+        return np.isnan(data)
+    return data == nodata
+
+
+def _masked(data, mask, nodata):
+    """Return masked array with masked pixels set to nodata."""
+    return ma.masked_array(
+        np.where(mask, np.array(nodata).astype(data.dtype), data),
+        mask=mask, fill_value=nodata
+    )
+
+
+def _pixel_factor(td_pyramid, tile, zoom=None):
+    """
+    Return how many tile directory pixels fit into one process tile pixel.
+
+    Returns None if pixel grids are not aligned or the tile directory pixels
+    are larger than the process tile pixels.
+    """
+    zoom = tile.zoom if zoom is None else zoom
+    if td_pyramid is None or td_pyramid.crs != tile.crs:
+        return None
+    x_size = td_pyramid.pixel_x_size(zoom)
+    y_size = td_pyramid.pixel_y_size(zoom)
+    factor = int(round(tile.pixel_x_size / x_size))
+    if (
+        factor >= 1 and
+        math.isclose(x_size * factor, tile.pixel_x_size) and
+        math.isclose(y_size * factor, tile.pixel_y_size) and
+        _is_aligned(td_pyramid.left - tile.tile_pyramid.left, x_size) and
+        _is_aligned(td_pyramid.top - tile.tile_pyramid.top, y_size) and
+        _is_aligned(tile.bounds.left - tile.tile_pyramid.left, x_size) and
+        _is_aligned(tile.tile_pyramid.top - tile.bounds.top, y_size)
+    ):
+        return factor
+    return None
+
+
+def _is_aligned(offset, pixel_size):
+    return math.isclose(offset / pixel_size, round(offset / pixel_size), abs_tol=1e-6)
+
+
+def _tiles_vrt(tiles_paths, indexes, crs, dtype, nodata):
+    """Return VRT XML mosaicking tiles of one zoom level."""
+    tiles = [tile for tile, _ in tiles_paths]
+    x_size, y_size = tiles[0].pixel_x_size, tiles[0].pixel_y_size
+    left = min(tile.bounds.left for tile in tiles)
+    top = max(tile.bounds.top for tile in tiles)
+    right = max(tile.bounds.right for tile in tiles)
+    bottom = min(tile.bounds.bottom for tile in tiles)
+    vrt = ET.Element(
+        "VRTDataset",
+        rasterXSize=str(int(round((right - left) / x_size))),
+        rasterYSize=str(int(round((top - bottom) / y_size)))
+    )
+    ET.SubElement(vrt, "SRS").text = crs.wkt
+    ET.SubElement(vrt, "GeoTransform").text = ", ".join(
+        str(v) for v in (left, x_size, 0, top, 0, -y_size)
+    )
+    for band, index in enumerate(indexes, 1):
+        vrt_band = ET.SubElement(
+            vrt, "VRTRasterBand", dataType=_gdal_typename(dtype), band=str(band)
+        )
+        ET.SubElement(vrt_band, "NoDataValue").text = str(nodata)
+        for tile, path in tiles_paths:
+            # nodata pixels do not overwrite overlapping tile buffers
+            source = ET.SubElement(vrt_band, "ComplexSource")
+            ET.SubElement(
+                source, "SourceFilename", relativeToVRT="0"
+            ).text = _gdal_path(path)
+            ET.SubElement(source, "SourceBand").text = str(index)
+            ET.SubElement(
+                source, "SrcRect", xOff="0", yOff="0",
+                xSize=str(tile.width), ySize=str(tile.height)
+            )
+            ET.SubElement(
+                source, "DstRect",
+                xOff=str(int(round((tile.bounds.left - left) / x_size))),
+                yOff=str(int(round((top - tile.bounds.top) / y_size))),
+                xSize=str(tile.width), ySize=str(tile.height)
+            )
+            ET.SubElement(source, "NODATA").text = str(nodata)
+    return ET.tostring(vrt)
+
+
+def _gdal_path(path):
+    if path.startswith("s3://"):
+        return "/vsis3/" + path[len("s3://"):]
+    elif path_is_remote(path):
+        return "/vsicurl/" + path
+    return path
@@ -2,14 +2,43 @@
 Vector file input which can be read by fiona.
 
 Currently limited by extensions .shp and .geojson but could be extended easily.
+
+With ``cache: memory`` all features are read once per process, reprojected to
+the process CRS, repaired and indexed in an STRtree. Tile reads then only query
+the index and clip candidate features instead of scanning the file.
+
+Inputs too large to be held in memory can use ``cache: sidecar`` instead. On
+first use, features are reprojected to the process CRS, repaired and written
+into a GeoPackage with an R-tree index. The sidecar file is keyed by source
+path, source modification time (or ETag for remote files) and process CRS, so
+it is reused by all workers and following runs until the source changes.
+
+With ``footprint: true`` the process area is limited to a coarse footprint of
+all features instead of the file bounding box. Footprints are cached on disk
+(see ``mapchete.io.footprint``).
 """
 
 import fiona
-from shapely.geometry import box
+import hashlib
+import logging
+import os
+from shapely.geometry import box, mapping, Polygon
 from rasterio.crs import CRS
+import tempfile
+import threading
 
+from mapchete.errors import MapcheteConfigError
 from mapchete.formats import base
-from mapchete.io.vector import reproject_geometry, read_vector_window
+from mapchete.io import absolute_path, path_is_remote
+from mapchete.io.footprint import cached_footprint, vector_footprint
+from mapchete.io.remote_cache import FileLock, remote_file_info
+from mapchete.io.vector import (
+    reproject_geometry, read_vector_window, read_reprojected_features,
+    IndexedFeatures
+)
+
+
+logger = logging.getLogger(__name__)
 
 
 METADATA = {
@@ -19,6 +48,20 @@ METADATA = {
     "file_extensions": ["shp", "geojson"]
 }
 
+CACHE_MODES = [None, "memory", "sidecar"]
+
+SIDECAR_DIR = os.path.join(tempfile.gettempdir(), "mapchete_vector_index")
+
+# in-memory indexes by file path and CRS, built once per process and shared by
+# all tiles; kept out of InputData as it is pickled for every task
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+# sidecar paths by file path, sidecar directory and CRS, checked once per
+# process
+_SIDECARS = {}
+_SIDECARS_LOCK = threading.Lock()
+
 
 class InputData(base.InputData):
     """
@@ -41,6 +84,14 @@ class InputData(base.InputData):
         object describing the process coordinate reference system
     srid : string
         spatial reference ID of CRS (e.g. "{'init': 'epsg:4326'}")
+    cache : string
+        None, "memory" or "sidecar"
+    sidecar_dir : string
+        directory where sidecar files are stored
+    use_footprint : bool
+        limit data area to coarse footprint instead of bounding box
+    footprint_dir : string
+        directory where footprints of remote files are cached
     """
 
     METADATA = {
@@ -53,7 +104,34 @@ class InputData(base.InputData):
     def __init__(self, input_params, **kwargs):
         """Initialize."""
         super(InputData, self).__init__(input_params, **kwargs)
-        self.path = input_params["path"]
+        if "abstract" in input_params:
+            self.path = absolute_path(
+                path=input_params["abstract"]["path"],
+                base_dir=input_params["conf_dir"]
+            )
+            self.cache = input_params["abstract"].get("cache")
+            self.sidecar_dir = absolute_path(
+                path=input_params["abstract"].get("sidecar_dir", SIDECAR_DIR),
+                base_dir=input_params["conf_dir"]
+            )
+            self.use_footprint = input_params["abstract"].get("footprint", False)
+            self.footprint_dir = input_params["abstract"].get("footprint_dir")
+            if self.footprint_dir:
+                self.footprint_dir = absolute_path(
+                    path=self.footprint_dir, base_dir=input_params["conf_dir"]
+                )
+        else:
+            self.path = input_params["path"]
+            self.cache = None
+            self.sidecar_dir = SIDECAR_DIR
+            self.use_footprint = False
+            self.footprint_dir = None
+        # footprints per output CRS
+        self._footprints = {}
+        if self.cache not in CACHE_MODES:
+            raise MapcheteConfigError(
+                "vector_file cache must be one of %s" % CACHE_MODES
+            )
 
     def open(self, tile, **kwargs):
         """
@@ -85,12 +163,107 @@ class InputData(base.InputData):
             Shapely geometry object
         """
         out_crs = self.pyramid.crs if out_crs is None else out_crs
-        with fiona.open(self.path) as inp:
+        if self.cache == "memory" and out_crs == self.pyramid.crs:
+            bounds = self.index().bounds
+            return box(*bounds) if bounds else Polygon()
+        with fiona.open(
+            self.sidecar() if self.cache == "sidecar" else self.path
+        ) as inp:
             inp_crs = CRS(inp.crs)
             bbox = box(*inp.bounds)
         # TODO find a way to get a good segmentize value in bbox source CRS
         return reproject_geometry(bbox, src_crs=inp_crs, dst_crs=out_crs)
 
+    def footprint(self, out_crs=None):
+        """
+        Return coarse footprint or bounding box if footprint is not used.
+
+        Parameters
+        ----------
+        out_crs : ``rasterio.crs.CRS``
+            rasterio CRS object (default: CRS of process pyramid)
+
+        Returns
+        -------
+        footprint : geometry
+            Shapely geometry object
+        """
+        out_crs = self.pyramid.crs if out_crs is None else out_crs
+        if not self.use_footprint:
+            return self.bbox(out_crs=out_crs)
+        key = str(out_crs)
+        if key not in self._footprints:
+            footprint, inp_crs = cached_footprint(
+                self.path, vector_footprint, cache_dir=self.footprint_dir
+            )
+            self._footprints[key] = footprint if footprint.is_empty else (
+                reproject_geometry(footprint, src_crs=inp_crs, dst_crs=out_crs)
+            )
+        return self._footprints[key]
+
+    def index(self):
+        """
+        Return in-memory index of features in process CRS.
+
+        The index is built on first access and then shared by all tiles read
+        within the current process.
+
+        Returns
+        -------
+        index : ``mapchete.io.vector.IndexedFeatures``
+        """
+        key = (self.path, self.pyramid.crs.to_string())
+        with _INDEXES_LOCK:
+            if key not in _INDEXES:
+                logger.debug("build in-memory index of %s", self.path)
+                _INDEXES[key] = IndexedFeatures(
+                    read_reprojected_features(self.path, self.pyramid.crs)
+                )
+                logger.debug(
+                    "%s features of %s indexed", len(_INDEXES[key]), self.path
+                )
+            return _INDEXES[key]
+
+    def sidecar(self):
+        """
+        Return path to sidecar GeoPackage in process CRS.
+
+        The sidecar is built on first access if it does not exist yet. Workers
+        wait for each other so it is only built once.
+
+        Returns
+        -------
+        path : string
+        """
+        key = (self.path, self.sidecar_dir, self.pyramid.crs.to_string())
+        with _SIDECARS_LOCK:
+            if key not in _SIDECARS:
+                _SIDECARS[key] = self._build_sidecar()
+            return _SIDECARS[key]
+
+    def _build_sidecar(self):
+        if path_is_remote(self.path):
+            version = remote_file_info(self.path)[1]
+        else:
+            version = os.path.getmtime(self.path)
+        sidecar_path = os.path.join(
+            self.sidecar_dir,
+            hashlib.sha256(
+                ("%s %s %s" % (
+                    self.path, version, self.pyramid.crs.to_string()
+                )).encode()
+            ).hexdigest() + ".gpkg"
+        )
+        if not os.path.isfile(sidecar_path):
+            os.makedirs(self.sidecar_dir, exist_ok=True)
+            with FileLock(sidecar_path + ".lock"):
+                if not os.path.isfile(sidecar_path):
+                    logger.debug(
+                        "build sidecar of %s: %s", self.path, sidecar_path
+                    )
+                    _write_sidecar(self.path, sidecar_path, self.pyramid.crs)
+        return sidecar_path
+
 
 class InputTile(base.InputTile):
     """
@@ -139,15 +312,44 @@ class InputTile(base.InputTile):
         -------
         is empty : bool
         """
-        if not self.tile.bbox.intersects(self.vector_file.bbox()):
+        if not self.tile.bbox.intersects(self.vector_file.footprint()):
             return True
         return len(self._read_from_cache(True)) == 0
 
     def _read_from_cache(self, validity_check):
         checked = "checked" if validity_check else "not_checked"
-        if checked not in self._cache:
+        if checked not in self._cache and self.vector_file.cache == "memory":
+            # geometries were already validated when building the index
+            self._cache[checked] = self.vector_file.index().read(self.tile)
+        elif checked not in self._cache and self.vector_file.cache == "sidecar":
+            self._cache[checked] = list(read_vector_window(
+                self.vector_file.sidecar(), self.tile,
+                validity_check=validity_check)
+            )
+        elif checked not in self._cache:
             self._cache[checked] = list(read_vector_window(
                 self.vector_file.path, self.tile,
                 validity_check=validity_check)
             )
         return self._cache[checked]
+
+
+def _write_sidecar(src_path, dst_path, crs):
+    """Write reprojected features into temporary file and move into place."""
+    tmp_path = "%s.%s.tmp.gpkg" % (dst_path, os.getpid())
+    with fiona.open(src_path) as src:
+        # geometry types can change to multipart after reprojection
+        schema = dict(src.schema, geometry="Unknown")
+    try:
+        with fiona.open(
+            tmp_path, "w", driver="GPKG", schema=schema, crs_wkt=crs.to_wkt()
+        ) as dst:
+            dst.writerecords(
+                dict(geometry=mapping(geom), properties=properties)
+                for geom, properties in read_reprojected_features(src_path, crs)
+            )
+        os.replace(tmp_path, dst_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
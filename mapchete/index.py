@@ -17,7 +17,6 @@ generate GPKG files 3.gpkg, 4.gpkg and 5.gpkg for zoom levels 3, 4 and 5.
 import concurrent.futures
 from contextlib import ExitStack
 from copy import deepcopy
-import fiona
 import logging
 import os
 from shapely.geometry import mapping
@@ -179,6 +178,8 @@ class VectorFileWriter():
     def __init__(
         self, out_path=None, crs=None, fieldname=None, driver=None
     ):
+        import fiona
+
         self._append = "a" in fiona.supported_drivers[driver]
         logger.debug("initialize %s writer with append %s", driver, self._append)
         self.path = out_path
@@ -1,16 +1,19 @@
 """Functions for reading and writing data."""
 
-import boto3
+from cachetools import LRUCache
+from contextlib import ExitStack
 import json
 import logging
 import os
 import rasterio
 from shapely.geometry import box
+import threading
 from tilematrix import TilePyramid
-from urllib.request import urlopen
+from urllib.request import Request, urlopen
 from urllib.error import HTTPError
 
 from mapchete.errors import MapcheteConfigError
+from mapchete.io.s3 import get_s3_client, split_s3_path
 from mapchete.io.vector import reproject_geometry, segmentize_geometry
 
 
@@ -23,6 +26,41 @@ GDAL_HTTP_OPTS = dict(
     GDAL_HTTP_TIMEOUT=30
 )
 
+# existence of remote paths checked or written during the current run
+PATH_EXISTS_CACHE_SIZE = 32768
+_PATH_EXISTS_CACHE = LRUCache(maxsize=PATH_EXISTS_CACHE_SIZE)
+_PATH_EXISTS_CACHE_LOCK = threading.Lock()
+
+
+def gdal_env(gdal_opts=None, defaults=None):
+    """
+    Return a rasterio.Env only if GDAL options differ from active environment.
+
+    Entering a new rasterio.Env resets GDAL configuration options on exit, so
+    this should be avoided on hot paths. If an environment is already active,
+    only options which differ are applied. Without options to set, no
+    environment is entered.
+
+    Parameters
+    ----------
+    gdal_opts : dict
+        GDAL options which have to be set
+    defaults : dict
+        GDAL options which are only set if not already configured in the active
+        environment
+
+    Returns
+    -------
+    context manager : ``rasterio.Env`` or a no-op context manager
+    """
+    active = rasterio.env.getenv() if rasterio.env.hasenv() else {}
+    opts = {k: v for k, v in (defaults or {}).items() if k not in active}
+    opts.update(gdal_opts or {})
+    opts = {k: v for k, v in opts.items() if k not in active or active[k] != v}
+    if not opts:
+        return ExitStack()
+    return rasterio.Env(**opts)
+
 
 def get_best_zoom_level(input_file, tile_pyramid_type):
     """
@@ -111,6 +149,9 @@ def path_exists(path):
     """
     Check if file exists either remote or local.
 
+    Results for remote paths are cached until ``clear_path_exists_cache()`` is
+    called.
+
     Parameters:
     -----------
     path : path to file
@@ -119,26 +160,100 @@ def path_exists(path):
     --------
     exists : bool
     """
-    if path.startswith(("http://", "https://")):
-        try:
-            urlopen(path).info()
-            return True
-        except HTTPError as e:
-            if e.code == 404:
-                return False
-            else:
-                raise
-    elif path.startswith("s3://"):
-        bucket_name = path.split("/")[2]
-        bucket = boto3.resource('s3').Bucket(bucket_name)
-        key = "/".join(path.split("/")[3:])
-        for obj in bucket.objects.filter(Prefix=key):
-            if obj.key == key:
-                return True
-        else:
-            return False
-    else:
+    if not path_is_remote(path):
         return os.path.exists(path)
+    with _PATH_EXISTS_CACHE_LOCK:
+        if path in _PATH_EXISTS_CACHE:
+            return _PATH_EXISTS_CACHE[path]
+    if path.startswith("s3://"):
+        exists = _s3_key_exists(path)
+    else:
+        exists = _url_exists(path)
+    set_path_exists(path, exists)
+    return exists
+
+
+def list_directory(path):
+    """
+    Return names of files in a local directory or below an S3 prefix.
+
+    Parameters:
+    -----------
+    path : path to directory
+
+    Returns:
+    --------
+    names : set or None
+        file names; None for HTTP paths, as they cannot be listed
+    """
+    if path.startswith("s3://"):
+        bucket, prefix = split_s3_path(path)
+        prefix = prefix.rstrip("/") + "/"
+        names = set()
+        for page in get_s3_client().get_paginator("list_objects_v2").paginate(
+            Bucket=bucket, Prefix=prefix, Delimiter="/"
+        ):
+            names.update(
+                obj["Key"][len(prefix):] for obj in page.get("Contents", [])
+            )
+        return names
+    elif path_is_remote(path):
+        return None
+    try:
+        return set(os.listdir(path))
+    except FileNotFoundError:
+        return set()
+
+
+def set_path_exists(path, exists=True):
+    """
+    Update existence cache for a remote path, e.g. after writing it.
+
+    Parameters:
+    -----------
+    path : path to file
+    exists : bool
+    """
+    if path_is_remote(path):
+        with _PATH_EXISTS_CACHE_LOCK:
+            _PATH_EXISTS_CACHE[path] = exists
+
+
+def clear_path_exists_cache():
+    """Clear cached existence checks of remote paths."""
+    with _PATH_EXISTS_CACHE_LOCK:
+        _PATH_EXISTS_CACHE.clear()
+
+
+def _s3_key_exists(path):
+    from botocore.exceptions import ClientError
+    bucket, key = split_s3_path(path)
+    try:
+        get_s3_client().head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+def _url_exists(url):
+    try:
+        urlopen(Request(url, method="HEAD")).close()
+        return True
+    except HTTPError as e:
+        if e.code == 404:
+            return False
+        # some servers do not support HEAD requests
+        elif e.code not in (403, 405, 501):
+            raise
+    try:
+        urlopen(Request(url, headers={"Range": "bytes=0-0"})).close()
+        return True
+    except HTTPError as e:
+        if e.code == 404:
+            return False
+        raise
 
 
 def absolute_path(path=None, base_dir=None):
@@ -196,14 +311,14 @@ def write_json(path, params):
     """Write local or remote."""
     logger.debug("write %s to %s", params, path)
     if path.startswith("s3://"):
-        bucket_name = path.split("/")[2]
-        bucket = boto3.resource('s3').Bucket(bucket_name)
-        key = "/".join(path.split("/")[3:])
+        bucket, key = split_s3_path(path)
         logger.debug("upload %s", key)
-        bucket.put_object(
+        get_s3_client().put_object(
+            Bucket=bucket,
             Key=key,
             Body=json.dumps(params, sort_keys=True, indent=4)
         )
+        set_path_exists(path)
     else:
         makedirs(os.path.dirname(path))
         with open(path, 'w') as dst:
@@ -218,13 +333,14 @@ def read_json(path):
         except HTTPError:
             raise FileNotFoundError("%s not found", path)
     elif path.startswith("s3://"):
-        bucket_name = path.split("/")[2]
-        bucket = boto3.resource('s3').Bucket(bucket_name)
-        key = "/".join(path.split("/")[3:])
-        for obj in bucket.objects.filter(Prefix=key):
-            if obj.key == key:
-                return json.loads(obj.get()['Body'].read().decode())
-        raise FileNotFoundError("%s not found", path)
+        bucket, key = split_s3_path(path)
+        client = get_s3_client()
+        try:
+            return json.loads(
+                client.get_object(Bucket=bucket, Key=key)["Body"].read().decode()
+            )
+        except client.exceptions.NoSuchKey:
+            raise FileNotFoundError("%s not found", path)
     else:
         try:
             with open(path, "r") as src:
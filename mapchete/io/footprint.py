@@ -0,0 +1,231 @@
+"""
+Valid-data footprints of raster and vector files.
+
+A footprint is a simplified polygon covering all valid data of a file. It is
+derived from a coarse grid of at most ``FOOTPRINT_SIZE`` pixels along the
+longer side: raster files read their dataset mask decimated to this grid (using
+overviews if available), vector files rasterize their features onto it. The
+valid cells are vectorized, buffered by two cells and simplified by one cell, so
+the footprint may be larger than the valid area but never smaller.
+
+Footprints are cached as GeoJSON in the source file CRS. For local files the
+cache is stored next to the file as ``<path>.footprint.geojson`` and otherwise
+in ``cache_dir``. Cache files store the source modification time and size (or
+the ETag for remote files) and are rebuilt once the source changes.
+
+Settings can be changed via environment variables:
+
+MAPCHETE_FOOTPRINT_SIZE
+    maximum grid size in pixels used to derive footprints (default: 1024)
+"""
+
+import hashlib
+import json
+import logging
+import math
+import numpy as np
+import os
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.features import rasterize, shapes
+from rasterio.transform import Affine, array_bounds
+from shapely.geometry import box, mapping, Polygon, shape
+from shapely.ops import unary_union
+import tempfile
+
+from mapchete.io import gdal_env, path_is_remote, GDAL_HTTP_OPTS
+from mapchete.io.remote_cache import FileLock, remote_file_info
+
+
+logger = logging.getLogger(__name__)
+
+FOOTPRINT_SIZE = int(os.environ.get("MAPCHETE_FOOTPRINT_SIZE", 1024))
+
+FOOTPRINT_DIR = os.path.join(tempfile.gettempdir(), "mapchete_footprints")
+
+
+def raster_footprint(path, size=None):
+    """
+    Derive valid-data footprint of raster file.
+
+    Parameters
+    ----------
+    path : string
+        path to raster file
+    size : int
+        maximum size of mask grid in pixels (default: FOOTPRINT_SIZE)
+
+    Returns
+    -------
+    (footprint, crs) : tuple
+        shapely geometry and ``rasterio.crs.CRS`` of raster file
+    """
+    size = size or FOOTPRINT_SIZE
+    with gdal_env(
+        defaults=GDAL_HTTP_OPTS if path_is_remote(path) else None
+    ), rasterio.open(path) as src:
+        height, width = _grid_shape(src.height, src.width, size)
+        # averaging keeps cells containing at least one valid pixel
+        mask = src.dataset_mask(
+            out_shape=(height, width), resampling=Resampling.average
+        )
+        transform = src.transform * Affine.scale(
+            src.width / width, src.height / height
+        )
+        return (
+            _mask_to_footprint(
+                mask > 0, transform, box(*array_bounds(
+                    src.height, src.width, src.transform
+                ))
+            ),
+            src.crs
+        )
+
+
+def vector_footprint(path, size=None):
+    """
+    Derive coarse footprint of vector file.
+
+    Parameters
+    ----------
+    path : string
+        path to vector file
+    size : int
+        maximum size of grid in pixels features are rasterized on (default:
+        FOOTPRINT_SIZE)
+
+    Returns
+    -------
+    (footprint, crs) : tuple
+        shapely geometry and ``rasterio.crs.CRS`` of vector file
+    """
+    import fiona
+
+    size = size or FOOTPRINT_SIZE
+    with fiona.open(path) as src:
+        crs = CRS(src.crs)
+        geometries = [f["geometry"] for f in src if f["geometry"]]
+        if not geometries:
+            return Polygon(), crs
+        left, bottom, right, top = src.bounds
+    resolution = max(right - left, top - bottom) / size
+    # points and axis-parallel lines have no extent to rasterize
+    if not resolution or not (right - left and top - bottom):
+        return box(left, bottom, right, top), crs
+    height, width = (
+        max(1, int(math.ceil((top - bottom) / resolution))),
+        max(1, int(math.ceil((right - left) / resolution)))
+    )
+    transform = Affine(resolution, 0, left, 0, -resolution, top)
+    mask = rasterize(
+        geometries, out_shape=(height, width), transform=transform,
+        all_touched=True, dtype="uint8"
+    )
+    return (
+        _mask_to_footprint(mask > 0, transform, box(left, bottom, right, top)),
+        crs
+    )
+
+
+def cached_footprint(path, footprint_func, cache_dir=None):
+    """
+    Return footprint of file from disk cache or derive and cache it.
+
+    Parameters
+    ----------
+    path : string
+        path to file
+    footprint_func : callable
+        function returning footprint and CRS for a path, e.g.
+        ``raster_footprint()``
+    cache_dir : string
+        directory used for remote files or if the directory of the file is
+        not writable (default: FOOTPRINT_DIR)
+
+    Returns
+    -------
+    (footprint, crs) : tuple
+        shapely geometry and ``rasterio.crs.CRS`` of file
+    """
+    if path_is_remote(path):
+        version = str(remote_file_info(path)[1])
+    else:
+        stat = os.stat(path)
+        version = "%s %s" % (stat.st_mtime, stat.st_size)
+    cache_path = _cache_path(path, cache_dir or FOOTPRINT_DIR)
+    footprint = _read_cache(cache_path, version)
+    if footprint is None:
+        with FileLock(cache_path + ".lock"):
+            footprint = _read_cache(cache_path, version)
+            if footprint is None:
+                logger.debug("derive footprint of %s: %s", path, cache_path)
+                footprint = footprint_func(path)
+                _write_cache(cache_path, version, *footprint)
+    return footprint
+
+
+def _grid_shape(height, width, size):
+    scale = max(1., max(height, width) / size)
+    return (
+        max(1, int(math.ceil(height / scale))),
+        max(1, int(math.ceil(width / scale)))
+    )
+
+
+def _mask_to_footprint(mask, transform, bbox):
+    """Vectorize valid cells and enlarge result so it covers all valid data."""
+    if not mask.any():
+        return Polygon()
+    resolution = max(abs(transform.a), abs(transform.e))
+    footprint = unary_union([
+        shape(geometry)
+        for geometry, _ in shapes(
+            mask.astype(np.uint8), mask=mask, transform=transform
+        )
+    ])
+    # simplification moves boundaries by at most the tolerance, so buffering
+    # by twice the tolerance keeps the result covering the valid cells
+    return footprint.buffer(2 * resolution).simplify(resolution).intersection(
+        bbox
+    )
+
+
+def _cache_path(path, cache_dir):
+    if not path_is_remote(path) and os.access(
+        os.path.dirname(os.path.abspath(path)), os.W_OK
+    ):
+        return path + ".footprint.geojson"
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(
+        cache_dir, hashlib.sha256(path.encode()).hexdigest() + ".geojson"
+    )
+
+
+def _read_cache(cache_path, version):
+    try:
+        with open(cache_path) as src:
+            feature = json.load(src)
+    except (IOError, ValueError):
+        return None
+    if feature["properties"].get("source_version") != version:
+        return None
+    return (
+        shape(feature["geometry"]),
+        CRS.from_wkt(feature["properties"]["crs"])
+    )
+
+
+def _write_cache(cache_path, version, footprint, crs):
+    """Write into temporary file first so readers never see incomplete files."""
+    tmp_path = "%s.%s.tmp" % (cache_path, os.getpid())
+    with open(tmp_path, "w") as dst:
+        json.dump(
+            dict(
+                type="Feature",
+                geometry=mapping(footprint),
+                properties=dict(source_version=version, crs=crs.to_wkt())
+            ),
+            dst
+        )
+    os.replace(tmp_path, cache_path)
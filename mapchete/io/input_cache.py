@@ -0,0 +1,159 @@
+"""
+Per-worker cache of decoded input arrays.
+
+Neighbouring tiles, repeated ``InputTile.read()`` calls with different band
+indexes or reads of the same tile by other processes in a worker decode the
+same source blocks again. ``InputCache`` keeps decoded input arrays in memory,
+keyed by input, tile and read parameters. Raster drivers read all bands once
+and return copies of the requested bands, so cached arrays are never modified.
+
+If the cached arrays exceed ``max_size``, least recently used arrays are
+removed. There is one cache per process and cache ID: each process configuration
+uses its own cache ID, so closing one process does not clear the cache of
+another process in the same worker. Unpickling an ``InputCache`` in a worker
+returns the cache of this worker.
+"""
+
+from collections import OrderedDict
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# default maximum size of cached arrays in MB
+INPUT_CACHE_SIZE = 256
+
+_MB = 1024 * 1024
+
+
+class InputCache(object):
+    """
+    Least recently used cache of decoded input arrays with a size limit.
+
+    Parameters
+    ----------
+    max_size : integer or float
+        maximum size of cached arrays in MB
+    cache_id : string
+        identifier of the process configuration using this cache (optional)
+
+    Attributes
+    ----------
+    hits : integer
+        number of reads served from cache
+    misses : integer
+        number of reads done
+    """
+
+    def __init__(self, max_size=INPUT_CACHE_SIZE, cache_id=None):
+        """Initialize."""
+        self.max_size = max_size
+        self.cache_id = cache_id
+        self.max_bytes = int(max_size * _MB)
+        self.hits = 0
+        self.misses = 0
+        self._arrays = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, read_func):
+        """
+        Return cached array or read and cache it.
+
+        Parameters
+        ----------
+        key : tuple
+            hashable identifier of input, tile and read parameters
+        read_func : callable
+            returns array if key is not cached
+
+        Returns
+        -------
+        data : array
+            cached array which must not be modified
+        """
+        with self._lock:
+            if key in self._arrays:
+                self._arrays.move_to_end(key)
+                self.hits += 1
+                return self._arrays[key]
+        data = read_func()
+        size = data.nbytes
+        with self._lock:
+            self.misses += 1
+            if size > self.max_bytes or key in self._arrays:
+                return data
+            self._arrays[key] = data
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._arrays.popitem(last=False)
+                self._bytes -= evicted.nbytes
+        return data
+
+    @property
+    def nbytes(self):
+        """Return size of cached arrays in bytes."""
+        return self._bytes
+
+    def clear(self):
+        """Remove all cached arrays and reset counters."""
+        with self._lock:
+            self._arrays.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        """Remove all cached arrays and release cache of current process."""
+        self.clear()
+        if _CACHES.get((self.cache_id, self.max_size)) is self:
+            del _CACHES[(self.cache_id, self.max_size)]
+
+    def __len__(self):
+        """Return number of cached arrays."""
+        return len(self._arrays)
+
+    def __reduce__(self):
+        """Unpickle as the cache of the current process."""
+        return (input_cache, (self.max_size, self.cache_id))
+
+
+_CACHES = {}
+
+
+def input_cache(max_size=INPUT_CACHE_SIZE, cache_id=None):
+    """
+    Return the cache of the current process with the given maximum size and ID.
+
+    Parameters
+    ----------
+    max_size : integer or float
+        maximum size of cached arrays in MB
+    cache_id : string
+        identifier of the process configuration using this cache (optional)
+
+    Returns
+    -------
+    cache : ``InputCache``
+    """
+    key = (cache_id, max_size)
+    if key not in _CACHES:
+        logger.debug("create input cache %s with %s MB", cache_id, max_size)
+        _CACHES[key] = InputCache(max_size=max_size, cache_id=cache_id)
+    return _CACHES[key]
+
+
+def tile_key(tile):
+    """
+    Return hashable identifier of a tile window.
+
+    Parameters
+    ----------
+    tile : ``BufferedTile`` or ``SuperTile``
+
+    Returns
+    -------
+    key : tuple
+    """
+    return (tuple(tile.bounds), tuple(tile.shape), tile.crs.to_string())
@@ -0,0 +1,341 @@
+"""
+Read inputs of upcoming process tiles in background threads.
+
+Workers otherwise read all inputs synchronously from within the user process,
+so the CPU idles while waiting for I/O and I/O idles while the process computes.
+``InputPrefetcher`` records which inputs a process reads (input ID, ``open()``
+and ``read()`` arguments) and repeats these reads for the next ``depth`` tiles
+of the tile queue while the current tile is processed. ``InputTile.read()``
+calls of the user process are then served from the prefetched data.
+
+Prefetched data is held in memory only until its tile is processed. If the
+estimated size of prefetched data would exceed ``max_size``, no further reads
+are scheduled and the process reads synchronously instead.
+"""
+
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import six
+import threading
+
+from mapchete.io import gdal_env
+
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_DEFAULTS = dict(
+    # number of upcoming tiles read ahead
+    depth=1,
+    # maximum size of prefetched data in MB
+    max_size=256,
+    # number of threads reading inputs
+    threads=4,
+    # number of process tiles sent to a worker at once
+    batch_size=16
+)
+
+_MB = 1024 * 1024
+
+
+class InputPrefetcher(object):
+    """
+    Prefetch inputs of upcoming process tiles.
+
+    Parameters
+    ----------
+    config : ``MapcheteConfig``
+        process configuration
+    depth : integer
+        number of upcoming tiles read ahead
+    max_size : integer or float
+        maximum size of prefetched data in MB
+    threads : integer
+        number of threads reading inputs
+    batch_size : integer
+        ignored, only used when tiles are distributed to workers
+
+    Attributes
+    ----------
+    hits : integer
+        number of reads served from prefetched data
+    misses : integer
+        number of reads done synchronously
+    """
+
+    def __init__(
+        self, config, depth=1, max_size=256, threads=4, batch_size=None
+    ):
+        """Initialize."""
+        self.config = config
+        self.depth = depth
+        self.max_bytes = int(max_size * _MB)
+        self.hits = 0
+        self.misses = 0
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._lock = threading.Lock()
+        # read signatures observed per zoom level
+        self._reads = {}
+        # futures of scheduled reads by tile ID and read signature
+        self._pending = OrderedDict()
+        # size of read results by signature and of finished prefetched reads
+        self._sizes = {}
+        self._bytes = 0
+        # upcoming tiles which will be processed
+        self._upcoming = []
+
+    def tiles(self, process_tiles, skip=None):
+        """
+        Yield process tiles and prefetch inputs of upcoming tiles.
+
+        Parameters
+        ----------
+        process_tiles : iterable
+            process tiles in processing order
+        skip : callable
+            returns True for tiles which will not be processed (optional)
+
+        Returns
+        -------
+        process tiles : generator
+        """
+        process_tiles = iter(process_tiles)
+        upcoming = deque()
+        while True:
+            while len(upcoming) <= self.depth:
+                try:
+                    upcoming.append(next(process_tiles))
+                except StopIteration:
+                    break
+            if not upcoming:
+                self._upcoming = []
+                return
+            tile = upcoming.popleft()
+            self._upcoming = [
+                t for t in upcoming if skip is None or not skip(t)
+            ]
+            for next_tile in self._upcoming:
+                self._schedule(next_tile)
+            try:
+                yield tile
+            finally:
+                self._discard(tile)
+
+    def open(self, input_id, input_tile, **kwargs):
+        """
+        Wrap input tile so reads are served from prefetched data.
+
+        Parameters
+        ----------
+        input_id : string
+            input identifier from configuration
+        input_tile : ``InputTile``
+            opened input tile
+        kwargs : keyword arguments
+            arguments passed on to ``InputData.open()``
+
+        Returns
+        -------
+        input tile : ``PrefetchedInputTile``
+        """
+        return PrefetchedInputTile(self, input_id, input_tile, kwargs)
+
+    def read(self, input_id, input_tile, open_kwargs, args, kwargs):
+        """
+        Return prefetched data or read synchronously and record the read.
+
+        Parameters
+        ----------
+        input_id : string
+            input identifier from configuration
+        input_tile : ``InputTile``
+            opened input tile
+        open_kwargs : dict
+            arguments passed on to ``InputData.open()``
+        args, kwargs : list, dict
+            arguments passed on to ``InputTile.read()``
+
+        Returns
+        -------
+        data : array or list
+        """
+        tile = input_tile.tile
+        try:
+            signature = _signature(input_id, open_kwargs, args, kwargs)
+        except TypeError:
+            # unhashable arguments cannot be prefetched
+            return input_tile.read(*args, **kwargs)
+        with self._lock:
+            future, _ = self._pending.pop((tile.id, signature), (None, None))
+        if future is not None:
+            # wait for reads which are scheduled or running
+            try:
+                data = future.result()
+            except Exception as e:
+                # read again synchronously so errors are raised from here
+                logger.debug("prefetching %s failed: %s", signature, e)
+            else:
+                with self._lock:
+                    self._bytes -= _nbytes(data)
+                    self.hits += 1
+                return data
+        with self._lock:
+            self.misses += 1
+            reads = self._reads.setdefault(tile.zoom, OrderedDict())
+            learned = signature not in reads
+            reads[signature] = (
+                input_id, dict(open_kwargs), list(args), dict(kwargs)
+            )
+        if learned:
+            # also read for tiles which were already scheduled
+            for next_tile in self._upcoming:
+                self._schedule(next_tile)
+        data = input_tile.read(*args, **kwargs)
+        with self._lock:
+            self._sizes[signature] = _nbytes(data)
+        return data
+
+    def close(self):
+        """Cancel scheduled reads and stop threads."""
+        with self._lock:
+            for future, _ in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        self._executor.shutdown(wait=True)
+        self._bytes = 0
+        logger.debug(
+            "prefetched reads: %s hits, %s misses", self.hits, self.misses
+        )
+
+    def __enter__(self):
+        """Enter context."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit context."""
+        self.close()
+
+    def _schedule(self, tile):
+        with self._lock:
+            for signature, call in six.iteritems(self._reads.get(tile.zoom, {})):
+                key = (tile.id, signature)
+                if key in self._pending:
+                    continue
+                reserved = self._sizes.get(signature, 0)
+                if self._bytes + reserved > self.max_bytes:
+                    logger.debug("prefetch limit reached, skip %s", key)
+                    return
+                # reserve memory until data was read and consumed
+                self._bytes += reserved
+                self._pending[key] = (
+                    self._executor.submit(
+                        self._prefetch, tile, signature, call, reserved
+                    ),
+                    reserved
+                )
+
+    def _prefetch(self, tile, signature, call, reserved):
+        input_id, open_kwargs, args, kwargs = call
+        try:
+            # GDAL environment of worker is not active in other threads
+            with gdal_env(self.config.gdal_opts):
+                data = self.config.params_at_zoom(tile.zoom)["input"][
+                    input_id
+                ].open(tile, **open_kwargs).read(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._bytes -= reserved
+            raise
+        size = _nbytes(data)
+        with self._lock:
+            self._bytes += size - reserved
+            self._sizes[signature] = size
+        return data
+
+    def _discard(self, tile):
+        """Drop unused prefetched data of a processed tile."""
+        with self._lock:
+            for key in [k for k in self._pending if k[0] == tile.id]:
+                future, reserved = self._pending.pop(key)
+                if future.cancel():
+                    self._bytes -= reserved
+                else:
+                    future.add_done_callback(self._release)
+
+    def _release(self, future):
+        if not future.exception():
+            with self._lock:
+                self._bytes -= _nbytes(future.result())
+
+
+class PrefetchedInputTile(object):
+    """
+    Input tile serving reads from prefetched data.
+
+    All other attributes and methods are passed on to the wrapped input tile.
+
+    Parameters
+    ----------
+    prefetcher : ``InputPrefetcher``
+    input_id : string
+        input identifier from configuration
+    input_tile : ``InputTile``
+        opened input tile
+    open_kwargs : dict
+        arguments passed on to ``InputData.open()``
+    """
+
+    def __init__(self, prefetcher, input_id, input_tile, open_kwargs):
+        """Initialize."""
+        self._prefetcher = prefetcher
+        self._input_id = input_id
+        self._input_tile = input_tile
+        self._open_kwargs = open_kwargs
+
+    def read(self, *args, **kwargs):
+        """
+        Read input data, from prefetched data if available.
+
+        Returns
+        -------
+        data : array or list
+        """
+        return self._prefetcher.read(
+            self._input_id, self._input_tile, self._open_kwargs, args, kwargs
+        )
+
+    def __getattr__(self, attr):
+        """Pass on to input tile."""
+        return getattr(self._input_tile, attr)
+
+    def __enter__(self):
+        """Enter context."""
+        self._input_tile.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        """Exit context."""
+        return self._input_tile.__exit__(*args)
+
+
+def _signature(input_id, open_kwargs, args, kwargs):
+    signature = (
+        input_id,
+        _freeze(open_kwargs),
+        tuple(_freeze(a) for a in args),
+        _freeze(kwargs)
+    )
+    hash(signature)
+    return signature
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in six.iteritems(value)))
+    elif isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _nbytes(data):
+    return getattr(data, "nbytes", 0)
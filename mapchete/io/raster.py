@@ -3,12 +3,16 @@
 import itertools
 import rasterio
 import logging
+import os
 import six
 import numpy as np
+import warnings
 import numpy.ma as ma
 from affine import Affine
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from rasterio.enums import Resampling
+from rasterio.errors import NotGeoreferencedWarning
 from rasterio.io import MemoryFile
 from rasterio.vrt import WarpedVRT
 from rasterio.warp import reproject
@@ -18,7 +22,8 @@ from tilematrix import clip_geometry_to_srs_bounds
 from types import GeneratorType
 
 from mapchete.tile import BufferedTile
-from mapchete.io import path_is_remote, GDAL_HTTP_OPTS
+from mapchete.io import path_is_remote, set_path_exists, gdal_env, GDAL_HTTP_OPTS
+from mapchete.io.s3 import get_s3_client, split_s3_path, S3_CLIENT_OPTS
 
 
 logger = logging.getLogger(__name__)
@@ -28,7 +33,7 @@ ReferencedRaster = namedtuple("ReferencedRaster", ("data", "affine"))
 
 def read_raster_window(
     input_file, tile, indexes=None, resampling="nearest", src_nodata=None,
-    dst_nodata=None, gdal_opts=None
+    dst_nodata=None, gdal_opts=None, remote_cache=None
 ):
     """
     Return NumPy arrays from an input raster.
@@ -53,18 +58,19 @@ def read_raster_window(
     dst_nodata : int or float, optional
         if not set, the nodata value from the source dataset will be used
     gdal_opts : dict
-        GDAL options passed on to rasterio.Env()
+        GDAL options passed on to rasterio.Env() if they differ from the
+        active environment
+    remote_cache : ``RemoteFileCache``
+        if given, remote files are read from a local copy
 
     Returns
     -------
     raster : MaskedArray
     """
+    if remote_cache is not None:
+        input_file = remote_cache.local_path(input_file)
     dst_shape = tile.shape
-    user_opts = {} if gdal_opts is None else dict(**gdal_opts)
-    if path_is_remote(input_file, s3=True):
-        gdal_opts = dict(GDAL_HTTP_OPTS, **user_opts)
-    else:
-        gdal_opts = user_opts
+    gdal_opts = {} if gdal_opts is None else dict(**gdal_opts)
 
     if not isinstance(indexes, int):
         if indexes is None:
@@ -149,7 +155,10 @@ def _get_warped_array(
     gdal_opts=None
 ):
     """Extract a numpy array from a raster file."""
-    with rasterio.Env(**gdal_opts):
+    with gdal_env(
+        gdal_opts,
+        defaults=GDAL_HTTP_OPTS if path_is_remote(input_file, s3=True) else None
+    ):
         with rasterio.open(input_file, "r") as src:
             if indexes is None:
                 dst_shape = (len(src.indexes), dst_shape[-2], dst_shape[-1], )
@@ -161,12 +170,12 @@ def _get_warped_array(
                 crs=dst_crs,
                 src_nodata=src_nodata,
                 nodata=dst_nodata,
-                width=dst_shape[-2],
-                height=dst_shape[-1],
+                width=dst_shape[-1],
+                height=dst_shape[-2],
                 transform=Affine(
-                    (dst_bounds[2] - dst_bounds[0]) / dst_shape[-2],
+                    (dst_bounds[2] - dst_bounds[0]) / dst_shape[-1],
                     0, dst_bounds[0], 0,
-                    (dst_bounds[1] - dst_bounds[3]) / dst_shape[-1],
+                    (dst_bounds[1] - dst_bounds[3]) / dst_shape[-2],
                     dst_bounds[3]
                 ),
                 resampling=Resampling[resampling]
@@ -202,10 +211,9 @@ class RasterWindowMemoryFile():
 
     def __enter__(self):
         """Open MemoryFile, write data and return."""
-        self.rio_memfile = MemoryFile()
-        with self.rio_memfile.open(**self.profile) as dst:
-            dst.write(self.data.astype(self.profile["dtype"]))
-            _write_tags(dst, self.tags)
+        self.rio_memfile = _encode_to_memoryfile(
+            self.data, self.profile, self.tags
+        )
         return self.rio_memfile
 
     def __exit__(self, *args):
@@ -233,6 +241,7 @@ def write_raster_window(
         output path to write to
     tags : optional tags to be added to GeoTIFF file
     bucket_resource : boto3 bucket resource to write to in case of S3 output
+        (default: S3 client shared by the current process)
     """
     if out_path == "memoryfile":
         raise DeprecationWarning(
@@ -259,27 +268,82 @@ def write_raster_window(
     if window_data.all() is not ma.masked:
 
         if out_path.startswith("s3://"):
-            with RasterWindowMemoryFile(
-                in_tile=out_tile,
-                in_data=window_data,
-                out_profile=out_profile,
-                out_tile=out_tile,
-                tags=tags
-            ) as memfile:
+            # encode already extracted window in memory and upload
+            with _encode_to_memoryfile(window_data, out_profile, tags) as memfile:
                 logger.debug((out_tile.id, "upload tile", out_path))
-                bucket_resource.put_object(
-                    Key="/".join(out_path.split("/")[3:]),
-                    Body=memfile
-                )
+                bucket, key = split_s3_path(out_path)
+                if bucket_resource is None:
+                    get_s3_client().put_object(Bucket=bucket, Key=key, Body=memfile)
+                else:
+                    bucket_resource.put_object(Key=key, Body=memfile)
+            set_path_exists(out_path)
         else:
-            with rasterio.open(out_path, 'w', **out_profile) as dst:
+            # write GeoTIFFs to temporary file first so readers never open
+            # incomplete files, e.g. other workers reading output of a fused
+            # input; other drivers may write sidecar files
+            atomic = out_profile.get("driver") == "GTiff"
+            dst_path = (
+                "%s.%s.tmp" % (out_path, os.getpid()) if atomic else out_path
+            )
+            with rasterio.open(dst_path, 'w', **out_profile) as dst:
                 logger.debug((out_tile.id, "write tile", out_path))
                 dst.write(window_data.astype(out_profile["dtype"]))
                 _write_tags(dst, tags)
+            if atomic:
+                os.replace(dst_path, out_path)
     else:
         logger.debug((out_tile.id, "array window empty", out_path))
 
 
+def write_raster_windows(in_tile=None, in_data=None, out_windows=None, tags=None):
+    """
+    Write multiple windows from a numpy array to output files.
+
+    Windows written to S3 are encoded and uploaded concurrently using the S3
+    client shared by the current process, local files are written one after
+    the other.
+
+    Parameters
+    ----------
+    in_tile : ``BufferedTile``
+        ``BufferedTile`` with a data attribute holding NumPy data
+    in_data : array
+    out_windows : iterable
+        (out_tile, out_profile, out_path) tuples
+    tags : optional tags to be added to GeoTIFF files
+    """
+    out_windows = list(out_windows)
+    remote = [w for w in out_windows if w[2].startswith("s3://")]
+    for out_tile, out_profile, out_path in out_windows:
+        if not out_path.startswith("s3://"):
+            write_raster_window(
+                in_tile=in_tile, in_data=in_data, out_profile=out_profile,
+                out_tile=out_tile, out_path=out_path, tags=tags
+            )
+    if remote:
+        with ThreadPoolExecutor(
+            max_workers=min(len(remote), S3_CLIENT_OPTS["max_pool_connections"])
+        ) as executor:
+            # raise first exception if any upload failed
+            for future in [
+                executor.submit(
+                    write_raster_window, in_tile=in_tile, in_data=in_data,
+                    out_profile=out_profile, out_tile=out_tile,
+                    out_path=out_path, tags=tags
+                )
+                for out_tile, out_profile, out_path in remote
+            ]:
+                future.result()
+
+
+def _encode_to_memoryfile(data, profile, tags=None):
+    memfile = MemoryFile()
+    with memfile.open(**profile) as dst:
+        dst.write(data.astype(profile["dtype"]))
+        _write_tags(dst, tags)
+    return memfile
+
+
 def _write_tags(dst, tags):
     if tags:
         for k, v in six.iteritems(tags):
@@ -485,11 +549,67 @@ def create_mosaic(tiles, nodata=0):
     return ReferencedRaster(data=mosaic, affine=affine)
 
 
+MERGE_METHODS = ("first", "last", "min", "max", "mean")
+
+
+def merge_arrays(arrays, method="first"):
+    """
+    Merge overlapping arrays of the same shape into one array.
+
+    Parameters
+    ----------
+    arrays : list
+        masked arrays with identical shapes
+    method : string
+        "first" or "last" use the first or last valid value of a pixel, "min",
+        "max" and "mean" aggregate all valid values (default: "first")
+
+    Returns
+    -------
+    merged : MaskedArray
+        masked array with data type of first array
+    """
+    if method not in MERGE_METHODS:
+        raise ValueError("method must be one of %s" % (MERGE_METHODS, ))
+    if not arrays:
+        raise ValueError("arrays list is empty")
+    arrays = [ma.masked_array(a, copy=False) for a in arrays]
+    dtype = arrays[0].dtype
+    if method in ("first", "last"):
+        if method == "last":
+            arrays = arrays[::-1]
+        merged = arrays[0].copy()
+        mask = ma.getmaskarray(merged).copy()
+        for arr in arrays[1:]:
+            if not mask.any():
+                break
+            fill = mask & ~ma.getmaskarray(arr)
+            merged.data[fill] = arr.data[fill]
+            mask &= ~fill
+        merged.mask = mask
+        return merged
+    stacked = ma.stack(arrays)
+    merged = getattr(stacked, method)(axis=0)
+    if method == "mean" and np.issubdtype(dtype, np.integer):
+        merged = ma.round(merged)
+    return ma.masked_array(
+        merged.astype(dtype, copy=False),
+        mask=ma.getmaskarray(merged),
+        fill_value=arrays[0].fill_value
+    )
+
+
 def _bounds_to_ranges(bounds, affine, shape):
+    # round to pixel precision first to avoid floating point errors on grids
+    # like mercator where e.g. 255.9999999 would be floored to 255
     return map(int, itertools.chain(
             *from_bounds(
                 *bounds, transform=affine, height=shape[-2], width=shape[-1]
-            ).round_lengths().round_offsets().toranges()
+            ).round_lengths(
+                pixel_precision=3
+            ).round_offsets(
+                pixel_precision=3
+            ).toranges()
         )
     )
 
@@ -537,6 +657,60 @@ def memory_file(data=None, profile=None):
     return memfile
 
 
+def raster_to_bytes(data, profile):
+    """
+    Encode array into an image or GeoTIFF without georeference.
+
+    Parameters
+    ----------
+    data : array
+        3D array to be encoded
+    profile : dict
+        rasterio profile containing at least driver, dtype and nodata
+
+    Returns
+    -------
+    encoded data : bytes
+    """
+    profile = dict(
+        profile, count=data.shape[0], height=data.shape[1], width=data.shape[2]
+    )
+    for k in ["crs", "transform", "affine"]:
+        profile.pop(k, None)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=NotGeoreferencedWarning)
+        with MemoryFile() as memfile:
+            with memfile.open(**profile) as dst:
+                dst.write(data)
+            return memfile.read()
+
+
+def raster_from_bytes(data, nodata=None):
+    """
+    Decode an image or GeoTIFF encoded by ``raster_to_bytes()``.
+
+    Parameters
+    ----------
+    data : bytes
+        encoded raster
+    nodata : integer or float
+        value to be masked (default: nodata value of encoded raster)
+
+    Returns
+    -------
+    decoded data : masked array
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=NotGeoreferencedWarning)
+        with MemoryFile(data) as memfile:
+            with memfile.open() as src:
+                nodata = src.nodata if nodata is None else nodata
+                arr = src.read()
+    return ma.masked_array(
+        data=arr, mask=arr == nodata if nodata is not None else False
+    )
+
+
 def prepare_array(data, masked=True, nodata=0, dtype="int16"):
     """
     Turn input data into a proper array for further usage.
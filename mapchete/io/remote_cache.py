@@ -0,0 +1,257 @@
+"""
+Local disk cache for remote input files.
+
+Remote rasters read via ``/vsicurl/`` or ``/vsis3/`` are downloaded again by
+every worker and for every zoom level, as GDAL's ``VSI_CACHE`` lives only
+within one process. ``RemoteFileCache`` downloads whole remote files once into
+a local directory shared by all worker processes and returns the local path.
+
+Two modes are available:
+
+cache
+    Files are stored in a persistent cache directory, keyed by URL and ETag
+    (or Last-Modified and Content-Length if no ETag is available), so changed
+    remote files are downloaded again. If the cache exceeds ``max_size``, least
+    recently used files are removed.
+stage
+    Files up to ``max_file_size`` are copied once per run into a temporary
+    scratch directory which is removed on ``cleanup()``.
+
+Files are written to a temporary file first and then moved into place, so
+other processes never see partial files. Eviction is guarded by a file lock.
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from urllib.request import Request, urlopen
+
+from mapchete.io.s3 import get_s3_client, split_s3_path
+
+
+logger = logging.getLogger(__name__)
+
+# VRTs can reference files relative to their own location and are not cached
+_NOT_CACHED_EXTENSIONS = [".vrt"]
+
+_LOCK_FILE = ".lock"
+
+_MB = 1024 * 1024
+
+
+class RemoteFileCache(object):
+    """
+    Read-through cache of remote files on local disk.
+
+    Parameters
+    ----------
+    mode : string
+        either "cache" or "stage" (default: "cache")
+    path : string
+        cache directory (only used in cache mode; default:
+        <system temp dir>/mapchete_remote_cache)
+    max_size : integer or float
+        maximum cache size in MB (only used in cache mode; default: 1024)
+    max_file_size : integer or float
+        remote files larger than this value in MB are not cached (default:
+        max_size in cache mode, 64 in stage mode)
+
+    Attributes
+    ----------
+    mode : string
+    path : string
+        directory where local copies are stored
+    """
+
+    def __init__(self, mode="cache", path=None, max_size=1024, max_file_size=None):
+        """Initialize."""
+        if mode not in ["cache", "stage"]:
+            raise ValueError("remote cache mode must be 'cache' or 'stage'")
+        self.mode = mode
+        if mode == "stage":
+            # scratch directory is created by the parent process so all
+            # workers share it
+            self.path = tempfile.mkdtemp(prefix="mapchete_stage_")
+            self.max_size = None
+            self.max_file_size = int(
+                (64 if max_file_size is None else max_file_size) * _MB
+            )
+        else:
+            self.path = path or os.path.join(
+                tempfile.gettempdir(), "mapchete_remote_cache"
+            )
+            os.makedirs(self.path, exist_ok=True)
+            self.max_size = int(max_size * _MB)
+            self.max_file_size = int(
+                (max_size if max_file_size is None else max_file_size) * _MB
+            )
+        self._creator_pid = os.getpid()
+        # local paths already resolved by this process
+        self._local_paths = {}
+
+    def local_path(self, path):
+        """
+        Return path to local copy of a remote file.
+
+        Local paths, files which are too large and files which cannot be cached
+        are returned unchanged.
+
+        Parameters
+        ----------
+        path : string
+            remote (HTTP or S3) or local path
+
+        Returns
+        -------
+        path : string
+        """
+        if not path.startswith(("http://", "https://", "s3://")):
+            return path
+        if os.path.splitext(path)[1].lower() in _NOT_CACHED_EXTENSIONS:
+            return path
+        if path not in self._local_paths:
+            self._local_paths[path] = self._resolve(path)
+        local_path = self._local_paths[path]
+        if local_path != path and self.mode == "cache":
+            # mark as recently used and download again if evicted meanwhile
+            try:
+                os.utime(local_path)
+            except FileNotFoundError:
+                self._local_paths[path] = local_path = self._resolve(path)
+        return local_path
+
+    def cleanup(self):
+        """Remove staging directory if created by this process."""
+        if self.mode == "stage" and os.getpid() == self._creator_pid:
+            logger.debug("remove staging directory %s", self.path)
+            shutil.rmtree(self.path, ignore_errors=True)
+        self._local_paths = {}
+
+    def _resolve(self, path):
+        size, version = remote_file_info(path)
+        if size is not None and size > self.max_file_size:
+            logger.debug("%s too large for remote cache, read remotely", path)
+            return path
+        local_path = os.path.join(
+            self.path,
+            hashlib.sha256(
+                ("%s %s" % (path, version)).encode()
+            ).hexdigest() + os.path.splitext(path)[1]
+        )
+        if os.path.isfile(local_path):
+            logger.debug("%s found in remote cache: %s", path, local_path)
+            return local_path
+        # hold a lock per file so workers don't download the same file twice
+        with FileLock(local_path + _LOCK_FILE):
+            if not os.path.isfile(local_path):
+                logger.debug("download %s to %s", path, local_path)
+                _download(path, local_path)
+        if self.mode == "cache":
+            self._evict(keep=local_path)
+        return local_path
+
+    def _evict(self, keep=None):
+        with FileLock(os.path.join(self.path, _LOCK_FILE)):
+            files = []
+            for entry in os.scandir(self.path):
+                if entry.is_file() and not entry.name.endswith(
+                    (_LOCK_FILE, ".tmp")
+                ):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size = sum(f[1] for f in files)
+            # remove least recently used files first
+            for _, size, path in sorted(files):
+                if total_size <= self.max_size:
+                    break
+                if path == keep:
+                    continue
+                logger.debug("evict %s from remote cache", path)
+                try:
+                    os.remove(path)
+                    os.remove(path + _LOCK_FILE)
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+
+    def __repr__(self):
+        return "RemoteFileCache(mode=%s, path=%s)" % (self.mode, self.path)
+
+
+class FileLock(object):
+    """
+    Exclusive lock across processes using a lock file.
+
+    Parameters
+    ----------
+    path : string
+        path to lock file, which is created if it does not exist
+    """
+
+    def __init__(self, path):
+        """Initialize."""
+        self.path = path
+
+    def __enter__(self):
+        """Acquire lock."""
+        self._file = open(self.path, "a")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        """Release lock."""
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+def remote_file_info(path):
+    """
+    Return file size and a version string identifying the file content.
+
+    Parameters
+    ----------
+    path : string
+        S3 or HTTP path
+
+    Returns
+    -------
+    size, version : tuple
+        size in bytes (None if unknown) and ETag or Last-Modified and size
+    """
+    if path.startswith("s3://"):
+        bucket, key = split_s3_path(path)
+        head = get_s3_client().head_object(Bucket=bucket, Key=key)
+        return head["ContentLength"], head["ETag"]
+    else:
+        with urlopen(Request(path, method="HEAD")) as response:
+            headers = response.info()
+        size = headers.get("Content-Length")
+        return (
+            int(size) if size is not None else None,
+            headers.get("ETag") or "%s %s" % (headers.get("Last-Modified"), size)
+        )
+
+
+def _download(path, local_path):
+    """Download into temporary file and move it into place atomically."""
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(local_path), suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as dst:
+            if path.startswith("s3://"):
+                bucket, key = split_s3_path(path)
+                get_s3_client().download_fileobj(bucket, key, dst)
+            else:
+                with urlopen(path) as src:
+                    shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, local_path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
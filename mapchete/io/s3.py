@@ -0,0 +1,158 @@
+"""
+Process-wide S3 client handling.
+
+All S3 requests in mapchete should use the client returned by
+``get_s3_client()``. Clients are cached per process, as they must not be
+shared between forked workers, but are shared between threads of the same
+process. This way every worker pays for session setup and the TLS connection
+pool only once.
+
+Client settings can be changed using ``configure_s3_client()`` or via
+environment variables:
+
+MAPCHETE_S3_MAX_POOL_CONNECTIONS
+    maximum number of connections kept in the connection pool (default: 16)
+MAPCHETE_S3_MAX_ATTEMPTS
+    maximum number of retries of failed requests (default: 5); botocore retries
+    with an exponential backoff using a random (jittered) base
+MAPCHETE_S3_CONNECT_TIMEOUT
+    connection timeout in seconds (default: 10)
+MAPCHETE_S3_READ_TIMEOUT
+    read timeout in seconds (default: 60)
+"""
+
+from collections import Counter
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+S3_CLIENT_OPTS = dict(
+    max_pool_connections=int(os.environ.get("MAPCHETE_S3_MAX_POOL_CONNECTIONS", 16)),
+    max_attempts=int(os.environ.get("MAPCHETE_S3_MAX_ATTEMPTS", 5)),
+    connect_timeout=int(os.environ.get("MAPCHETE_S3_CONNECT_TIMEOUT", 10)),
+    read_timeout=int(os.environ.get("MAPCHETE_S3_READ_TIMEOUT", 60)),
+)
+
+# S3 clients by process ID, as clients must not be shared between processes
+_S3_CLIENTS = {}
+_S3_CLIENTS_LOCK = threading.Lock()
+
+# number of S3 requests by process ID and operation name
+_S3_REQUEST_COUNTS = {}
+_S3_REQUEST_COUNTS_LOCK = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Return a boto3 S3 client shared by all threads of the current process.
+
+    Returns
+    -------
+    client : ``botocore.client.S3``
+    """
+    pid = os.getpid()
+    with _S3_CLIENTS_LOCK:
+        if pid not in _S3_CLIENTS:
+            # drop clients inherited from a parent process
+            _S3_CLIENTS.clear()
+            _S3_CLIENTS[pid] = _new_client()
+        return _S3_CLIENTS[pid]
+
+
+def configure_s3_client(**kwargs):
+    """
+    Update S3 client settings.
+
+    Cached clients are dropped, so the new settings apply to all following
+    requests.
+
+    Parameters
+    ----------
+    max_pool_connections : int
+        maximum number of connections kept in the connection pool
+    max_attempts : int
+        maximum number of retries of failed requests
+    connect_timeout : int
+        connection timeout in seconds
+    read_timeout : int
+        read timeout in seconds
+    """
+    for k in kwargs:
+        if k not in S3_CLIENT_OPTS:
+            raise TypeError("unknown S3 client option: %s" % k)
+    with _S3_CLIENTS_LOCK:
+        S3_CLIENT_OPTS.update(kwargs)
+        _S3_CLIENTS.clear()
+
+
+def s3_request_counts():
+    """
+    Return number of S3 requests by operation name of the current process.
+
+    Retries of a failed request are not counted separately.
+
+    Returns
+    -------
+    counts : dictionary
+        e.g. {"PutObject": 16, "HeadObject": 2}
+    """
+    with _S3_REQUEST_COUNTS_LOCK:
+        return dict(_S3_REQUEST_COUNTS.get(os.getpid(), {}))
+
+
+def reset_s3_request_counts():
+    """Reset S3 request counts of the current process."""
+    with _S3_REQUEST_COUNTS_LOCK:
+        _S3_REQUEST_COUNTS.pop(os.getpid(), None)
+
+
+def split_s3_path(path):
+    """
+    Split S3 path into bucket name and key.
+
+    Parameters
+    ----------
+    path : string
+        S3 path (i.e. s3://bucket/some/key.tif)
+
+    Returns
+    -------
+    bucket, key : tuple
+    """
+    if not path.startswith("s3://"):
+        raise ValueError("not an S3 path: %s" % path)
+    return path.split("/")[2], "/".join(path.split("/")[3:])
+
+
+def _new_client():
+    # boto3 takes a while to import and is only needed when S3 is used
+    import boto3
+    from botocore.config import Config
+
+    logger.debug("create S3 client for process %s: %s", os.getpid(), S3_CLIENT_OPTS)
+    # sessions are not thread safe, so don't use the default session
+    client = boto3.session.Session().client(
+        "s3",
+        config=Config(
+            max_pool_connections=S3_CLIENT_OPTS["max_pool_connections"],
+            connect_timeout=S3_CLIENT_OPTS["connect_timeout"],
+            read_timeout=S3_CLIENT_OPTS["read_timeout"],
+            retries=dict(max_attempts=S3_CLIENT_OPTS["max_attempts"])
+        )
+    )
+    client.meta.events.register("before-call.s3", _count_request)
+    return client
+
+
+def _count_request(model=None, **kwargs):
+    pid = os.getpid()
+    with _S3_REQUEST_COUNTS_LOCK:
+        if pid not in _S3_REQUEST_COUNTS:
+            # drop counts inherited from a parent process
+            _S3_REQUEST_COUNTS.clear()
+            _S3_REQUEST_COUNTS[pid] = Counter()
+        _S3_REQUEST_COUNTS[pid][model.name] += 1
@@ -0,0 +1,132 @@
+"""
+SQLite connection handling for single-file tile stores.
+
+Connections are cached per process and file, as they must not be shared between
+forked workers. All connections use write-ahead logging, so readers are not
+blocked by the writer, and wait for locks held by other processes instead of
+failing immediately. SQLite allows only one writer at a time, so all tiles of a
+process tile are written within one transaction.
+
+Settings can be changed via environment variables:
+
+MAPCHETE_SQLITE_BUSY_TIMEOUT
+    time in milliseconds to wait for locks held by other processes
+    (default: 60000)
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+SQLITE_BUSY_TIMEOUT = int(os.environ.get("MAPCHETE_SQLITE_BUSY_TIMEOUT", 60000))
+
+# connections by process ID and path
+_CONNECTIONS = {}
+_CONNECTIONS_LOCK = threading.Lock()
+
+# threads of a process share connections, so transactions must not overlap
+_WRITE_LOCK = threading.Lock()
+
+
+def get_connection(path):
+    """
+    Return SQLite connection to file shared by all threads of current process.
+
+    Parameters
+    ----------
+    path : string
+        path to SQLite file
+
+    Returns
+    -------
+    connection : ``sqlite3.Connection``
+    """
+    pid = os.getpid()
+    with _CONNECTIONS_LOCK:
+        if any(key[0] != pid for key in _CONNECTIONS):
+            # drop connections inherited from a parent process without closing
+            # them, as this would affect the parent process
+            for key in [key for key in _CONNECTIONS if key[0] != pid]:
+                del _CONNECTIONS[key]
+        connection, file_id = _CONNECTIONS.get((pid, path), (None, None))
+        if connection is not None and _file_id(path) != file_id:
+            # file was removed or replaced since the connection was opened
+            logger.debug("reopen SQLite connection to %s", path)
+            connection.close()
+            connection = None
+        if connection is None:
+            logger.debug("open SQLite connection to %s", path)
+            connection = sqlite3.connect(
+                path, timeout=SQLITE_BUSY_TIMEOUT / 1000, check_same_thread=False
+            )
+            connection.execute("PRAGMA busy_timeout = %s" % SQLITE_BUSY_TIMEOUT)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            _CONNECTIONS[(pid, path)] = (connection, _file_id(path))
+        return connection
+
+
+def close_connection(path):
+    """
+    Close connection to file opened by current process.
+
+    Parameters
+    ----------
+    path : string
+        path to SQLite file
+    """
+    with _CONNECTIONS_LOCK:
+        connection, _ = _CONNECTIONS.pop((os.getpid(), path), (None, None))
+    if connection is not None:
+        logger.debug("close SQLite connection to %s", path)
+        connection.close()
+
+
+def write_rows(path, statements):
+    """
+    Execute statements on many rows within one transaction.
+
+    Parameters
+    ----------
+    path : string
+        path to SQLite file
+    statements : list
+        tuples of SQL statement and list of row parameters
+    """
+    connection = get_connection(path)
+    with _WRITE_LOCK, connection:
+        for statement, rows in statements:
+            if rows:
+                connection.executemany(statement, rows)
+
+
+def _file_id(path):
+    try:
+        stat = os.stat(path)
+        return stat.st_dev, stat.st_ino
+    except FileNotFoundError:
+        return None
+
+
+def query(path, statement, parameters=()):
+    """
+    Return all rows of a query.
+
+    Parameters
+    ----------
+    path : string
+        path to SQLite file
+    statement : string
+        SQL statement
+    parameters : tuple
+        statement parameters
+
+    Returns
+    -------
+    rows : list
+    """
+    return get_connection(path).execute(statement, parameters).fetchall()
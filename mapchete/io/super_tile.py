@@ -0,0 +1,226 @@
+"""
+Read inputs once for groups of neighbouring process tiles.
+
+With a ``pixelbuffer``, neighbouring process tiles read overlapping windows
+from their inputs, so pixels along tile borders are read and decoded multiple
+times. ``SuperTileReader`` reads each input once over the buffered bounds of a
+group of neighbouring process tiles (a ``SuperTile``) and serves the process
+tiles copies of their windows of this array using ``extract_from_array()``, so
+processes can still modify input data in place. Outputs are still written per
+process tile.
+"""
+
+from collections import OrderedDict
+import logging
+
+from mapchete.io.prefetch import _signature
+from mapchete.io.raster import extract_from_array
+from mapchete.tile import SuperTile
+
+
+logger = logging.getLogger(__name__)
+
+
+class SuperTileReader(object):
+    """
+    Serve input reads of process tiles from reads over their super-tile.
+
+    Parameters
+    ----------
+    config : ``MapcheteConfig``
+        process configuration
+    process_tiles : list
+        neighbouring process tiles of one zoom level which will be processed
+
+    Attributes
+    ----------
+    super_tile : ``SuperTile`` or None
+        covered area or None if tiles are read individually
+    hits : integer
+        number of reads served from super-tile data
+    misses : integer
+        number of reads over the super-tile
+    """
+
+    def __init__(self, config, process_tiles):
+        """Initialize."""
+        self.config = config
+        process_tiles = list(process_tiles)
+        self.super_tile = (
+            SuperTile(process_tiles) if len(process_tiles) > 1 else None
+        )
+        # windows exceeding the pyramid edges have to be split up which is only
+        # done for single tiles by read_raster_window()
+        if (
+            self.super_tile is not None and
+            self.super_tile.pixelbuffer and
+            self.super_tile.is_on_edge()
+        ):
+            logger.debug("%s is on pyramid edge, read tiles", self.super_tile)
+            self.super_tile = None
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def open(self, input_id, input_tile, **kwargs):
+        """
+        Wrap input tile so reads are served from super-tile data.
+
+        Parameters
+        ----------
+        input_id : string
+            input identifier from configuration
+        input_tile : ``InputTile``
+            opened input tile
+        kwargs : keyword arguments
+            arguments passed on to ``InputData.open()``
+
+        Returns
+        -------
+        input tile : ``SuperTileInputTile`` or ``InputTile``
+            input tile is returned unchanged if it cannot be read over the
+            super-tile
+        """
+        if self.super_tile is None or not self._input(input_id).SUPER_TILE_READS:
+            return input_tile
+        return SuperTileInputTile(self, input_id, input_tile, kwargs)
+
+    def read(self, input_id, input_tile, open_kwargs, args, kwargs):
+        """
+        Return copy of super-tile data window, reading it if necessary.
+
+        Parameters
+        ----------
+        input_id : string
+            input identifier from configuration
+        input_tile : ``InputTile``
+            opened input tile
+        open_kwargs : dict
+            arguments passed on to ``InputData.open()``
+        args, kwargs : list, dict
+            arguments passed on to ``InputTile.read()``
+
+        Returns
+        -------
+        data : array
+        """
+        try:
+            signature = _signature(input_id, open_kwargs, args, kwargs)
+        except TypeError:
+            # unhashable arguments cannot be cached
+            return input_tile.read(*args, **kwargs)
+        if signature in self._data:
+            self.hits += 1
+        else:
+            self.misses += 1
+            data = self._input(input_id).open(
+                self.super_tile, **open_kwargs
+            ).read(*args, **kwargs)
+            self._data[signature] = data
+        # data is shared with the other tiles
+        return extract_from_array(
+            in_raster=self._data[signature],
+            in_affine=self.super_tile.affine,
+            out_tile=input_tile.tile
+        ).copy()
+
+    def close(self):
+        """Release super-tile data."""
+        self._data.clear()
+        logger.debug(
+            "super-tile reads: %s hits, %s misses", self.hits, self.misses
+        )
+
+    def __enter__(self):
+        """Enter context."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit context."""
+        self.close()
+
+    def _input(self, input_id):
+        return self.config.params_at_zoom(self.super_tile.zoom)["input"][input_id]
+
+
+class SuperTileInputTile(object):
+    """
+    Input tile serving reads from super-tile data.
+
+    All other attributes and methods are passed on to the wrapped input tile.
+
+    Parameters
+    ----------
+    reader : ``SuperTileReader``
+    input_id : string
+        input identifier from configuration
+    input_tile : ``InputTile``
+        opened input tile
+    open_kwargs : dict
+        arguments passed on to ``InputData.open()``
+    """
+
+    def __init__(self, reader, input_id, input_tile, open_kwargs):
+        """Initialize."""
+        self._reader = reader
+        self._input_id = input_id
+        self._input_tile = input_tile
+        self._open_kwargs = open_kwargs
+
+    def read(self, *args, **kwargs):
+        """
+        Read input data from super-tile data.
+
+        Returns
+        -------
+        data : array
+        """
+        return self._reader.read(
+            self._input_id, self._input_tile, self._open_kwargs, args, kwargs
+        )
+
+    def __getattr__(self, attr):
+        """Pass on to input tile."""
+        return getattr(self._input_tile, attr)
+
+    def __enter__(self):
+        """Enter context."""
+        self._input_tile.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        """Exit context."""
+        return self._input_tile.__exit__(*args)
+
+
+def super_tiles(process_tiles, size):
+    """
+    Group process tiles into blocks of up to size x size neighbouring tiles.
+
+    Tiles are expected in row-major order as returned by ``tiles_from_geom()``.
+    Groups are yielded once all of their rows were passed.
+
+    Parameters
+    ----------
+    process_tiles : iterable
+        process tiles
+    size : integer
+        maximum number of rows and columns of a group
+
+    Returns
+    -------
+    groups : generator
+        lists of process tiles
+    """
+    groups = OrderedDict()
+    band = None
+    for tile in process_tiles:
+        tile_band = (tile.zoom, tile.row // size)
+        if tile_band != band:
+            for group in groups.values():
+                yield group
+            groups.clear()
+            band = tile_band
+        groups.setdefault(tile.col // size, []).append(tile)
+    for group in groups.values():
+        yield group
@@ -1,20 +1,28 @@
 """Functions handling vector data."""
 
+from functools import lru_cache
 import os
 import logging
-import fiona
-from fiona.transform import transform_geom
-from fiona.io import MemoryFile
+import numpy as np
 from rasterio.crs import CRS
+from rasterio.warp import transform
+import shapely
 from shapely.geometry import (
-    box, shape, mapping, MultiPoint, MultiLineString, MultiPolygon, Polygon,
-    LinearRing, LineString, base
+    box, shape, mapping, GeometryCollection, MultiPoint, MultiLineString,
+    MultiPolygon, Point, Polygon, LinearRing, LineString, base
 )
 from shapely.errors import TopologicalError
+from shapely.prepared import prep
+from shapely.strtree import STRtree
 from shapely.validation import explain_validity
 import six
 from tilematrix import clip_geometry_to_srs_bounds
-from itertools import chain
+from itertools import chain, islice
+
+from mapchete.io.s3 import get_s3_client, split_s3_path
+
+# fiona is imported within the functions using it as importing it takes a while
+# and many processes never read or write vector data
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +30,9 @@ logger = logging.getLogger(__name__)
 logging.getLogger("shapely").setLevel(logging.ERROR)
 logging.getLogger("Fiona").setLevel(logging.ERROR)
 
+# STRtree queries return indices of geometries from shapely 2.0 on
+_STRTREE_INDICES = int(shapely.__version__.split(".")[0]) >= 2
+
 CRS_BOUNDS = {
     # http://spatialreference.org/ref/epsg/wgs-84/
     'epsg:4326': (-180., -90., 180., 90.),
@@ -31,6 +42,9 @@ CRS_BOUNDS = {
     'epsg:3035': (-10.6700, 34.5000, 31.5500, 71.0500)
 }
 
+# number of features reprojected at once when reading whole files
+REPROJECTION_CHUNKSIZE = 10000
+
 
 def reproject_geometry(
     geometry, src_crs=None, dst_crs=None, error_on_clip=False,
@@ -61,55 +75,273 @@ def reproject_geometry(
     -------
     geometry : ``shapely.geometry``
     """
-    src_crs = _validated_crs(src_crs)
-    dst_crs = _validated_crs(dst_crs)
+    out_geom = _reproject_geometries(
+        [geometry], _validated_crs(src_crs), _validated_crs(dst_crs),
+        validity_check=validity_check, error_on_clip=error_on_clip
+    )[0]
+    if out_geom is None:
+        raise TopologicalError("invalid geometry after reprojection")
+    return out_geom
+
+
+def reproject_geometries(geometries, src_crs=None, dst_crs=None, validity_check=True):
+    """
+    Reproject multiple geometries to target CRS at once.
+
+    Coordinates of all geometries are transformed in one call using a
+    transformer cached per CRS pair. Like ``reproject_geometry()``, geometries
+    are clipped to the destination CRS boundary if known.
+
+    Parameters
+    ----------
+    geometries : iterable
+        ``shapely.geometry`` objects
+    src_crs : ``rasterio.crs.CRS`` or EPSG code
+        CRS of source data
+    dst_crs : ``rasterio.crs.CRS`` or EPSG code
+        target CRS
+    validity_check : bool
+        checks if reprojected geometries are valid (default: True)
+
+    Returns
+    -------
+    geometries : list
+        reprojected geometries in the same order; geometries which are invalid
+        after reprojection are None if validity_check is activated
+    """
+    return _reproject_geometries(
+        list(geometries), _validated_crs(src_crs), _validated_crs(dst_crs),
+        validity_check=validity_check
+    )
 
+
+def _reproject_geometries(
+    geometries, src_crs, dst_crs, validity_check=True, error_on_clip=False
+):
     def _repair(geom):
         if geom.geom_type in ["Polygon", "MultiPolygon"]:
             return geom.buffer(0)
         else:
             return geom
 
-    def _reproject_geom(geometry, src_crs, dst_crs):
-        if geometry.is_empty or src_crs == dst_crs:
-            return _repair(geometry)
-        out_geom = _repair(
-            to_shape(
-                transform_geom(
-                    src_crs.to_dict(), dst_crs.to_dict(), mapping(geometry)
-                )
-            )
-        )
-        if validity_check and (not out_geom.is_valid or out_geom.is_empty):
-            raise TopologicalError("invalid geometry after reprojection")
-        return out_geom
-
-    # return repaired geometry if no reprojection needed
+    def _reproject_geoms(geometries, src_crs, dst_crs):
+        out_geoms = []
+        for geom, out_geom in zip(
+            geometries, _transform_geometries(geometries, src_crs, dst_crs)
+        ):
+            if geom is None or geom.is_empty:
+                out_geoms.append(geom if geom is None else _repair(geom))
+                continue
+            out_geom = _repair(out_geom)
+            if validity_check and (not out_geom.is_valid or out_geom.is_empty):
+                out_geom = None
+            out_geoms.append(out_geom)
+        return out_geoms
+
+    # return repaired geometries if no reprojection needed
     if src_crs == dst_crs:
-        return _repair(geometry)
+        return [_repair(geom) for geom in geometries]
+
+    crs_bbox = _crs_bounds(dst_crs)
+    src_bbox = None if crs_bbox is None else _src_crs_bounds(src_crs, dst_crs)
+    # if geometries potentially have to be clipped, clip with CRS bounds
+    # transformed into the source CRS and transform clipped geometries once
+    if src_bbox is not None:
+        src_bbox, prepared_bbox = src_bbox
+        within = [
+            geom is None or geom.is_empty or prepared_bbox.contains(geom)
+            for geom in geometries
+        ]
+        # raise error if geometry has to be clipped
+        if error_on_clip and not all(within):
+            raise RuntimeError("geometry outside target CRS bounds")
+        return _reproject_geoms(
+            [
+                geom if is_within else _clip(geom, src_bbox)
+                for geom, is_within in zip(geometries, within)
+            ],
+            src_crs,
+            dst_crs
+        )
 
-    # if geometry potentially has to be clipped, reproject to WGS84 and clip
-    # with CRS bounds
-    elif dst_crs.is_epsg_code and (
-        dst_crs.get("init") in CRS_BOUNDS) and (  # if known CRS
-        not dst_crs.get("init") == "epsg:4326"  # WGS84 does not need clipping
-    ):
-        wgs84_crs = CRS().from_epsg(4326)
-        # get dst_crs boundaries
-        crs_bbox = box(*CRS_BOUNDS[dst_crs.get("init")])
-        # reproject geometry to WGS84
-        geometry_4326 = _reproject_geom(geometry, src_crs, wgs84_crs)
+    # if CRS bounds cannot be transformed into the source CRS, clip with CRS
+    # bounds in WGS84
+    elif crs_bbox is not None:
+        wgs84_crs = _wgs84_crs()
+        if src_crs == wgs84_crs:
+            geometries_4326 = [_repair(geom) for geom in geometries]
+        else:
+            geometries_4326 = _reproject_geoms(geometries, src_crs, wgs84_crs)
         # raise error if geometry has to be clipped
-        if error_on_clip and not geometry_4326.within(crs_bbox):
+        if error_on_clip and any(
+            geom is not None and not geom.within(crs_bbox)
+            for geom in geometries_4326
+        ):
             raise RuntimeError("geometry outside target CRS bounds")
-        # clip geometry dst_crs boundaries and return
-        return _reproject_geom(
-            crs_bbox.intersection(geometry_4326), wgs84_crs, dst_crs
+        # clip geometries to dst_crs boundaries
+        return _reproject_geoms(
+            [
+                None if geom is None else crs_bbox.intersection(geom)
+                for geom in geometries_4326
+            ],
+            wgs84_crs,
+            dst_crs
+        )
+
+    # reproject without clipping if destination CRS does not have defined bounds
+    else:
+        return _reproject_geoms(geometries, src_crs, dst_crs)
+
+
+@lru_cache()
+def _wgs84_crs():
+    return CRS.from_epsg(4326)
+
+
+@lru_cache()
+def _crs_bounds(crs):
+    """Return CRS bounds in WGS84 if known and clipping is required."""
+    if (
+        crs.is_epsg_code and
+        crs.get("init") in CRS_BOUNDS and
+        # WGS84 does not need clipping
+        crs.get("init") != "epsg:4326"
+    ):
+        return box(*CRS_BOUNDS[crs.get("init")])
+
+
+@lru_cache()
+def _src_crs_bounds(src_crs, dst_crs):
+    """
+    Return CRS bounds of dst_crs in src_crs.
+
+    Bounds are segmentized before being transformed, so curved edges are
+    approximated. Bounds are returned together with their prepared geometry or
+    None if they cannot be represented as a valid polygon in src_crs.
+    """
+    crs_bbox = _crs_bounds(dst_crs)
+    if src_crs == _wgs84_crs():
+        return crs_bbox, prep(crs_bbox)
+    try:
+        src_bbox = _transform_geometries(
+            [segmentize_geometry(crs_bbox, 1.)], _wgs84_crs(), src_crs
+        )[0]
+    except Exception as e:
+        logger.debug("cannot transform CRS bounds into %s: %s", src_crs, e)
+        return None
+    if (
+        src_bbox.is_empty or
+        not src_bbox.is_valid or
+        not np.isfinite(src_bbox.bounds).all()
+    ):
+        logger.debug("CRS bounds are not valid in %s", src_crs)
+        return None
+    return src_bbox, prep(src_bbox)
+
+
+def _clip(geometry, bbox):
+    try:
+        return bbox.intersection(geometry)
+    except (TopologicalError, ValueError):
+        # repair only geometries which cannot be clipped
+        return bbox.intersection(geometry.buffer(0))
+
+
+@lru_cache()
+def _transformer(src_crs, dst_crs):
+    """Return function transforming coordinate arrays between two CRSes."""
+    try:
+        # pyproj>=2.2 transformers can be reused for all calls of a CRS pair
+        from pyproj import Transformer
+        transformer = Transformer.from_crs(
+            src_crs.to_wkt(), dst_crs.to_wkt(), always_xy=True
         )
 
-    # return without clipping if destination CRS does not have defined bounds
+        def _transform(xs, ys):
+            return transformer.transform(xs, ys)
+
+    # pyproj<2.1 has no Transformer and pyproj 2.1 no always_xy
+    except (ImportError, TypeError):
+        def _transform(xs, ys):
+            return transform(src_crs, dst_crs, xs, ys)
+
+    return _transform
+
+
+def _transform_geometries(geometries, src_crs, dst_crs):
+    """Transform coordinates of all geometries in one call."""
+    geom_coords = [
+        [] if geom is None else [_as_xy_array(c) for c in _coord_sequences(geom)]
+        for geom in geometries
+    ]
+    coords = list(chain.from_iterable(geom_coords))
+    if not coords:
+        return list(geometries)
+    all_coords = np.concatenate(coords)
+    xs, ys = _transformer(src_crs, dst_crs)(all_coords[:, 0], all_coords[:, 1])
+    # split up transformed coordinates into the original sequences
+    sequences = iter(np.split(
+        np.column_stack([xs, ys]), np.cumsum([len(c) for c in coords])[:-1]
+    ))
+    out_geoms = []
+    for geom, c in zip(geometries, geom_coords):
+        geom_sequences = [next(sequences) for _ in c]
+        if geom is None or geom.is_empty:
+            out_geoms.append(geom)
+        elif all(np.isfinite(seq).all() for seq in geom_sequences):
+            out_geoms.append(_from_coord_sequences(geom, iter(geom_sequences)))
+        else:
+            # let OGR handle geometries with coordinates which cannot be
+            # transformed
+            from fiona.transform import transform_geom
+            out_geoms.append(to_shape(transform_geom(
+                src_crs.to_dict(), dst_crs.to_dict(), mapping(geom)
+            )))
+    return out_geoms
+
+
+def _as_xy_array(coords):
+    array = np.asarray(coords, dtype="float64")
+    return array[:, :2] if array.size else np.empty((0, 2))
+
+
+def _coord_sequences(geom):
+    if geom.is_empty:
+        return
+    elif geom.geom_type in ["Point", "LineString", "LinearRing"]:
+        yield geom.coords
+    elif geom.geom_type == "Polygon":
+        yield geom.exterior.coords
+        for interior in geom.interiors:
+            yield interior.coords
     else:
-        return _reproject_geom(geometry, src_crs, dst_crs)
+        for part in geom:
+            for c in _coord_sequences(part):
+                yield c
+
+
+def _from_coord_sequences(geom, sequences):
+    if geom.is_empty:
+        return geom
+    elif geom.geom_type == "Point":
+        return Point(next(sequences)[0])
+    elif geom.geom_type == "LineString":
+        return LineString(next(sequences))
+    elif geom.geom_type == "LinearRing":
+        return LinearRing(next(sequences))
+    elif geom.geom_type == "Polygon":
+        return Polygon(
+            next(sequences), [next(sequences) for _ in geom.interiors]
+        )
+    else:
+        return {
+            "MultiPoint": MultiPoint,
+            "MultiLineString": MultiLineString,
+            "MultiPolygon": MultiPolygon,
+            "GeometryCollection": GeometryCollection,
+        }[geom.geom_type]([
+            _from_coord_sequences(part, sequences) for part in geom
+        ])
 
 
 def _validated_crs(crs):
@@ -208,31 +440,85 @@ def write_vector_window(
         tile used for output extent
     out_path : string
         output path for GeoJSON file
+    bucket_resource : boto3 bucket resource to write to in case of S3 output
+        (default: S3 client shared by the current process)
     """
-    # Delete existing file.
-    try:
-        os.remove(out_path)
-    except OSError:
-        pass
+    _write_vector_features(
+        out_features=_clipped_features(
+            IndexedFeatures(_parsed_features(in_data)), out_schema, out_tile
+        ),
+        out_schema=out_schema,
+        out_tile=out_tile,
+        out_path=out_path,
+        bucket_resource=bucket_resource
+    )
+
+
+def write_vector_windows(in_data=None, out_schema=None, out_windows=None):
+    """
+    Write features to multiple GeoJSON files.
 
-    out_features = []
+    Features are parsed and spatially indexed only once, so every output
+    window only has to clip features intersecting with it.
+
+    Parameters
+    ----------
+    in_data : features
+    out_schema : dictionary
+        output schema for fiona
+    out_windows : iterable
+        (out_tile, out_path) tuples
+    """
+    index = IndexedFeatures(_parsed_features(in_data))
+    for out_tile, out_path in out_windows:
+        _write_vector_features(
+            out_features=_clipped_features(index, out_schema, out_tile),
+            out_schema=out_schema,
+            out_tile=out_tile,
+            out_path=out_path
+        )
+
+
+def _parsed_features(in_data):
+    """Yield shapely geometries and properties of GeoJSON-like features."""
     for feature in in_data:
         try:
-            # clip feature geometry to tile bounding box and append for writing
-            # if clipped feature still
+            yield to_shape(feature["geometry"]), feature["properties"]
+        except Exception:
+            logger.exception("failed to prepare geometry for writing")
+
+
+def _clipped_features(index, out_schema, out_tile):
+    """Return features clipped to output tile with output geometry type."""
+    out_features = []
+    for geom, properties in index.clipped(out_tile.bbox):
+        try:
+            # append clipped feature geometry if it still matches the output
+            # geometry type
             for out_geom in multipart_to_singleparts(
-                clean_geometry_type(
-                    to_shape(feature["geometry"]).intersection(out_tile.bbox),
-                    out_schema["geometry"]
-                )
+                clean_geometry_type(geom, out_schema["geometry"])
             ):
                 out_features.append({
                     "geometry": mapping(out_geom),
-                    "properties": feature["properties"]
+                    "properties": properties
                 })
         except Exception:
             logger.exception("failed to prepare geometry for writing")
             continue
+    return out_features
+
+
+def _write_vector_features(
+    out_features=None, out_schema=None, out_tile=None, out_path=None,
+    bucket_resource=None
+):
+    import fiona
+
+    # Delete existing file.
+    try:
+        os.remove(out_path)
+    except OSError:
+        pass
 
     # write if there are output features
     if out_features:
@@ -246,10 +532,14 @@ def write_vector_window(
                 driver="GeoJSON"
             ) as memfile:
                 logger.debug((out_tile.id, "upload tile", out_path))
-                bucket_resource.put_object(
-                    Key="/".join(out_path.split("/")[3:]),
-                    Body=memfile
-                )
+                bucket, key = split_s3_path(out_path)
+                if bucket_resource is None:
+                    get_s3_client().put_object(Bucket=bucket, Key=key, Body=memfile)
+                else:
+                    bucket_resource.put_object(Key=key, Body=memfile)
+            # imported here to avoid circular import
+            from mapchete.io import set_path_exists
+            set_path_exists(out_path)
         else:
             # write data to local file
             with fiona.open(
@@ -276,6 +566,7 @@ class VectorWindowMemoryFile():
 
     def __enter__(self):
         """Open MemoryFile, write data and return."""
+        from fiona.io import MemoryFile
         self.fio_memfile = MemoryFile()
         with self.fio_memfile.open(
             schema=self.schema,
@@ -293,6 +584,8 @@ class VectorWindowMemoryFile():
 def _get_reprojected_features(
     input_file=None, dst_bounds=None, dst_crs=None, validity_check=False
 ):
+    import fiona
+
     with fiona.open(input_file, 'r') as vector:
         vector_crs = CRS(vector.crs)
         # Reproject tile bounding box to source file CRS for filter:
@@ -303,38 +596,233 @@ def _get_reprojected_features(
                 box(*dst_bounds), src_crs=dst_crs, dst_crs=vector_crs,
                 validity_check=True
             )
-        for feature in vector.filter(bbox=dst_bbox.bounds):
-            feature_geom = to_shape(feature['geometry'])
-            if not feature_geom.is_valid:
-                feature_geom = feature_geom.buffer(0)
-                # skip feature if geometry cannot be repaired
-                if not feature_geom.is_valid:
-                    logger.exception(
-                        "feature omitted: %s", explain_validity(feature_geom))
-                    continue
+        clipped = []
+        for feature_geom, properties in _repaired_features(
+            vector.filter(bbox=dst_bbox.bounds)
+        ):
             # only return feature if geometry type stayed the same after
-            # reprojecction
+            # clipping
             geom = clean_geometry_type(
                 feature_geom.intersection(dst_bbox), feature_geom.geom_type)
             if geom:
-                # Reproject each feature to tile CRS
+                clipped.append((geom, properties))
+            else:
+                logger.error(
+                    "feature omitted: geometry type changed after clipping"
+                )
+    # reproject all features of window at once
+    for geom, (_, properties) in zip(
+        reproject_geometries(
+            [g for g, _ in clipped], src_crs=vector_crs, dst_crs=dst_crs,
+            validity_check=validity_check
+        ),
+        clipped
+    ):
+        if geom is None:
+            logger.error("feature omitted: reprojection failed")
+            continue
+        yield {'properties': properties, 'geometry': mapping(geom)}
+
+
+def _repaired_features(features):
+    """Yield shapely geometries and properties, repaired if necessary."""
+    for feature in features:
+        if feature['geometry'] is None:
+            continue
+        geom = to_shape(feature['geometry'])
+        if not geom.is_valid:
+            geom = geom.buffer(0)
+            # skip feature if geometry cannot be repaired
+            if not geom.is_valid:
+                logger.error("feature omitted: %s", explain_validity(geom))
+                continue
+        yield geom, feature['properties']
+
+
+def read_reprojected_features(input_file, dst_crs):
+    """
+    Read all features of a vector file, repaired and reprojected.
+
+    Invalid geometries are repaired using ``buffer(0)``, features which cannot
+    be repaired or reprojected are omitted.
+
+    Parameters
+    ----------
+    input_file : string
+        path to vector file
+    dst_crs : ``rasterio.crs.CRS``
+        target CRS
+
+    Returns
+    -------
+    features : generator
+        (geometry, properties) tuples with shapely geometries
+    """
+    import fiona
+
+    with fiona.open(input_file, 'r') as vector:
+        vector_crs = CRS(vector.crs)
+        features = _repaired_features(vector)
+        # reproject features in chunks to limit memory usage of coordinates
+        while True:
+            chunk = list(islice(features, REPROJECTION_CHUNKSIZE))
+            if not chunk:
+                break
+            for geom, (_, properties) in zip(
+                reproject_geometries(
+                    [g for g, _ in chunk], src_crs=vector_crs, dst_crs=dst_crs
+                ),
+                chunk
+            ):
+                if geom is None:
+                    logger.error("feature omitted: reprojection failed")
+                elif not geom.is_empty:
+                    yield geom, properties
+
+
+class IndexedFeatures(object):
+    """
+    Features held in memory and indexed by an STRtree.
+
+    Parameters
+    ----------
+    features : iterable
+        (geometry, properties) tuples with shapely geometries
+
+    Attributes
+    ----------
+    bounds : tuple
+        bounds of all features or None if there are no features
+    """
+
+    def __init__(self, features):
+        """Initialize."""
+        self._features = list(features)
+        self._tree = STRtree([geom for geom, _ in self._features])
+        if _STRTREE_INDICES or hasattr(self._tree, "query_items"):
+            self._positions = None
+        else:
+            # before shapely 1.8, STRtree queries return the indexed geometry
+            # objects themselves, so their IDs are mapped to feature positions
+            self._positions = {
+                id(geom): i for i, (geom, _) in enumerate(self._features)
+            }
+        if self._features:
+            all_bounds = [geom.bounds for geom, _ in self._features]
+            self.bounds = (
+                min(b[0] for b in all_bounds), min(b[1] for b in all_bounds),
+                max(b[2] for b in all_bounds), max(b[3] for b in all_bounds)
+            )
+        else:
+            self.bounds = None
+
+    def __len__(self):
+        """Return number of features."""
+        return len(self._features)
+
+    def read(self, tile):
+        """
+        Return features clipped to tile.
+
+        Parameters
+        ----------
+        tile : ``Tile``
+
+        Returns
+        -------
+        features : list
+            GeoJSON-like features
+        """
+        if tile.pixelbuffer and tile.is_on_edge():
+            tile_boxes = clip_geometry_to_srs_bounds(
+                tile.bbox, tile.tile_pyramid, multipart=True
+            )
+        else:
+            tile_boxes = [tile.bbox]
+        return list(chain.from_iterable(self.clip(bbox) for bbox in tile_boxes))
+
+    def clip(self, bbox):
+        """
+        Yield features intersecting with bounding box clipped to bounding box.
+
+        Parameters
+        ----------
+        bbox : ``shapely.geometry.Polygon``
+
+        Returns
+        -------
+        features : generator
+            GeoJSON-like features
+        """
+        for geom, properties in self.clipped(bbox):
+            yield {
+                'properties': dict(properties),
+                'geometry': mapping(geom)
+            }
+
+    def intersecting(self, bbox):
+        """
+        Yield features intersecting with bounding box in original order.
+
+        Parameters
+        ----------
+        bbox : ``shapely.geometry.Polygon``
+
+        Returns
+        -------
+        features : generator
+            (geometry, properties) tuples
+        """
+        prepared = prep(bbox)
+        for i in self._query(bbox):
+            geom, properties = self._features[i]
+            if prepared.intersects(geom):
+                yield geom, properties
+
+    def clipped(self, bbox):
+        """
+        Yield shapely geometries clipped to bounding box and feature properties.
+
+        Geometries within the bounding box are not clipped. Geometries not
+        matching their original geometry type after clipping are omitted.
+
+        Parameters
+        ----------
+        bbox : ``shapely.geometry.Polygon``
+
+        Returns
+        -------
+        features : generator
+            (geometry, properties) tuples
+        """
+        prepared = prep(bbox)
+        for i in self._query(bbox):
+            geom, properties = self._features[i]
+            if prepared.contains(geom):
+                clipped = geom
+            elif prepared.intersects(geom):
                 try:
-                    geom = reproject_geometry(
-                        geom, src_crs=vector_crs, dst_crs=dst_crs,
-                        validity_check=validity_check)
-                    if validity_check and not geom.is_valid:
-                        raise TopologicalError(
-                            "reprojected geometry invalid: %s" % (
-                                explain_validity(geom)))
+                    clipped = geom.intersection(bbox)
                 except TopologicalError:
-                    logger.exception("feature omitted: reprojection failed")
-                yield {
-                    'properties': feature['properties'],
-                    'geometry': mapping(geom)}
+                    logger.exception("feature omitted: clipping failed")
+                    continue
+                if geom.geom_type != "GeometryCollection":
+                    clipped = clean_geometry_type(clipped, geom.geom_type)
             else:
-                logger.exception(
-                    "feature omitted: geometry type changed after reprojection"
-                )
+                continue
+            if clipped:
+                yield clipped, properties
+
+    def _query(self, bbox):
+        """Return sorted positions of features intersecting with bbox envelope."""
+        if not self._features:
+            return []
+        elif _STRTREE_INDICES:
+            return sorted(int(i) for i in self._tree.query(bbox))
+        elif self._positions is None:
+            # shapely 1.8 returns indices as items
+            return sorted(self._tree.query_items(bbox))
+        return sorted(self._positions[id(g)] for g in self._tree.query(bbox))
 
 
 def clean_geometry_type(geometry, target_type, allow_multipart=True):
@@ -1,7 +1,8 @@
 """Mapchtete handling tiles."""
+from affine import Affine
 from cached_property import cached_property
 from shapely.geometry import box
-from tilematrix import Tile, TilePyramid
+from tilematrix import Bounds, Tile, TilePyramid
 
 
 class BufferedTilePyramid(TilePyramid):
@@ -240,3 +241,115 @@ class BufferedTile(Tile):
             self.right >= self.tile_pyramid.right or    # touches_right
             self.top >= self.tile_pyramid.top           # touches_top
         )
+
+
+class SuperTile(object):
+    """
+    Window covering a group of neighbouring tiles of one zoom level.
+
+    A super-tile can be used instead of a ``BufferedTile`` to read inputs once
+    for all tiles of the group.
+
+    Parameters
+    ----------
+    tiles : list
+        ``BufferedTile`` objects of the same zoom level and pyramid
+
+    Attributes
+    ----------
+    tiles : list
+        tiles of group
+    height : integer
+        super-tile height in pixels
+    width : integer
+        super-tile width in pixels
+    shape : tuple
+        super-tile width and height in pixels
+    affine : ``Affine``
+        ``Affine`` object describing super-tile extent and pixel size
+    bounds : tuple
+        left, bottom, right, top values of buffered super-tile boundaries
+    bbox : ``shapely.geometry``
+        super-tile bounding box as shapely geometry
+    pixelbuffer : integer
+        pixelbuffer of tiles
+    """
+
+    def __init__(self, tiles):
+        """Initialize."""
+        self.tiles = list(tiles)
+        if not self.tiles:
+            raise ValueError("super-tile needs at least one tile")
+        tile = self.tiles[0]
+        if any(
+            t.zoom != tile.zoom or t.tile_pyramid != tile.tile_pyramid
+            for t in self.tiles
+        ):
+            raise ValueError("tiles must be from the same zoom and pyramid")
+        self.tile_pyramid = tile.tile_pyramid
+        self.zoom = tile.zoom
+        self.crs = tile.crs
+        self.pixelbuffer = tile.pixelbuffer
+        self.pixel_x_size = tile.pixel_x_size
+        self.pixel_y_size = tile.pixel_y_size
+        self.left = min(t.left for t in self.tiles)
+        self.bottom = min(t.bottom for t in self.tiles)
+        self.right = max(t.right for t in self.tiles)
+        self.top = max(t.top for t in self.tiles)
+
+    @cached_property
+    def bounds(self):
+        """Return buffered bounds."""
+        x_buffer = self.pixelbuffer * self.pixel_x_size
+        y_buffer = self.pixelbuffer * self.pixel_y_size
+        return Bounds(
+            self.left - x_buffer, self.bottom - y_buffer,
+            self.right + x_buffer, self.top + y_buffer
+        )
+
+    @cached_property
+    def height(self):
+        """Return buffered height."""
+        return int(round(
+            (self.bounds.top - self.bounds.bottom) / self.pixel_y_size
+        ))
+
+    @cached_property
+    def width(self):
+        """Return buffered width."""
+        return int(round(
+            (self.bounds.right - self.bounds.left) / self.pixel_x_size
+        ))
+
+    @cached_property
+    def shape(self):
+        """Return buffered shape."""
+        return (self.height, self.width)
+
+    @cached_property
+    def affine(self):
+        """Return buffered Affine."""
+        return Affine(
+            self.pixel_x_size, 0, self.bounds.left,
+            0, -self.pixel_y_size, self.bounds.top
+        )
+
+    @cached_property
+    def bbox(self):
+        """Return buffered bounding box."""
+        return box(*self.bounds)
+
+    def is_on_edge(self):
+        """Determine whether super-tile touches or goes over pyramid edge."""
+        return (
+            self.left <= self.tile_pyramid.left or      # touches_left
+            self.bottom <= self.tile_pyramid.bottom or  # touches_bottom
+            self.right >= self.tile_pyramid.right or    # touches_right
+            self.top >= self.tile_pyramid.top           # touches_top
+        )
+
+    def __repr__(self):
+        """Return string representation."""
+        return "SuperTile(%s tiles, zoom=%s, bounds=%s)" % (
+            len(self.tiles), self.zoom, tuple(self.bounds)
+        )
@@ -53,12 +53,18 @@ setup(
             'serve=mapchete.cli.default.serve:serve',
         ],
         'mapchete.formats.drivers': [
+            'cog=mapchete.formats.default.cog',
             'geojson=mapchete.formats.default.geojson',
             'gtiff=mapchete.formats.default.gtiff',
             'mapchete_input=mapchete.formats.default.mapchete_input',
+            'mbtiles=mapchete.formats.default.mbtiles',
+            'mvt=mapchete.formats.default.mvt',
+            'npy=mapchete.formats.default.npy',
+            'gpkg=mapchete.formats.default.gpkg',
             'png_hillshade=mapchete.formats.default.png_hillshade',
             'png=mapchete.formats.default.png',
             'raster_file=mapchete.formats.default.raster_file',
+            'raster_mosaic=mapchete.formats.default.raster_mosaic',
             'vector_file=mapchete.formats.default.vector_file',
             'tile_directory=mapchete.formats.default.tile_directory'
         ],
@@ -73,13 +79,17 @@ setup(
         'click-plugins',
         'fiona>=1.8b1',
         'flask',
+        'importlib-metadata; python_version < "3.8"',
         'pyproj',
         'pyyaml',
         'rasterio>=1.0.2',
         'tilematrix>=0.17',
         'tqdm'
     ] if not on_rtd else [],
-    extras_require={'contours': ['matplotlib']},
+    extras_require={
+        'contours': ['matplotlib'],
+        'mvt': ['mapbox-vector-tile']
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
@@ -1,15 +1,20 @@
 """Fixtures such as Flask app for serve."""
 
-import boto3
 from collections import namedtuple
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from moto import mock_s3
 import os
 import pytest
 import shutil
 import six
+from socketserver import ThreadingMixIn
+import threading
 import uuid
 import yaml
 
 from mapchete.cli.default.serve import create_app
+from mapchete.io import clear_path_exists_cache
+from mapchete.io.s3 import get_s3_client, split_s3_path, _S3_CLIENTS
 
 if six.PY2:
     from pytest import yield_fixture
@@ -23,6 +28,7 @@ TEMP_DIR = os.path.join(TESTDATA_DIR, "tmp")
 S3_TEMP_DIR = "s3://mapchete-test/tmp/" + uuid.uuid4().hex
 
 
+MOCKED_S3_BUCKET = "mapchete-test"
 ExampleConfig = namedtuple("ExampleConfig", ("path", "dict"))
 
 
@@ -52,16 +58,88 @@ def mp_s3_tmpdir():
     """Setup and teardown temporary directory."""
 
     def _cleanup():
-        for obj in boto3.resource('s3').Bucket(S3_TEMP_DIR.split("/")[2]).objects.filter(
-            Prefix="/".join(S3_TEMP_DIR.split("/")[-2:])
+        bucket, prefix = split_s3_path(S3_TEMP_DIR)
+        client = get_s3_client()
+        for page in client.get_paginator("list_objects_v2").paginate(
+            Bucket=bucket, Prefix=prefix
         ):
-            obj.delete()
+            for obj in page.get("Contents", []):
+                client.delete_object(Bucket=bucket, Key=obj["Key"])
 
     _cleanup()
     yield S3_TEMP_DIR
     _cleanup()
 
 
+# local S3 stand-in
+@yield_fixture
+def mocked_s3(monkeypatch):
+    """Provide empty mocked S3 bucket and return its base path."""
+    for k, v in [
+        ("AWS_ACCESS_KEY_ID", "testing"),
+        ("AWS_SECRET_ACCESS_KEY", "testing"),
+        ("AWS_DEFAULT_REGION", "us-east-1")
+    ]:
+        monkeypatch.setenv(k, v)
+    # clients created outside of the mock would talk to the real S3
+    _S3_CLIENTS.clear()
+    clear_path_exists_cache()
+    with mock_s3():
+        get_s3_client().create_bucket(Bucket=MOCKED_S3_BUCKET)
+        yield "s3://%s/tmp" % MOCKED_S3_BUCKET
+    _S3_CLIENTS.clear()
+    clear_path_exists_cache()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _TestdataRequestHandler(SimpleHTTPRequestHandler):
+    """Serve files from TESTDATA_DIR and record requests."""
+
+    def translate_path(self, path):
+        return os.path.join(
+            TESTDATA_DIR,
+            os.path.relpath(super().translate_path(path), os.getcwd())
+        )
+
+    def do_HEAD(self):
+        self.server.requests.append(("HEAD", self.path))
+        if self.server.head_allowed:
+            super().do_HEAD()
+        else:
+            self.send_error(405)
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path))
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+# local HTTP server serving test data
+@yield_fixture
+def http_testdata():
+    """
+    Serve TESTDATA_DIR via HTTP.
+
+    Returns the server, having a ``url`` attribute, a ``requests`` list of
+    (method, path) tuples and a ``head_allowed`` switch.
+    """
+    server = _ThreadingHTTPServer(("127.0.0.1", 0), _TestdataRequestHandler)
+    server.url = "http://127.0.0.1:%s" % server.server_address[1]
+    server.requests = []
+    server.head_allowed = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
 @pytest.fixture
 def wkt_geom():
     """Example WKT geometry."""
@@ -319,6 +397,41 @@ def cleantopo_br_tiledir():
     return ExampleConfig(path=path, dict=_dict_from_mapchete(path))
 
 
+@pytest.fixture
+def mbtiles():
+    """Fixture for mbtiles.mapchete."""
+    path = os.path.join(TESTDATA_DIR, "mbtiles.mapchete")
+    return ExampleConfig(path=path, dict=_dict_from_mapchete(path))
+
+
+@pytest.fixture
+def npy():
+    """Fixture for npy.mapchete."""
+    path = os.path.join(TESTDATA_DIR, "npy.mapchete")
+    return ExampleConfig(path=path, dict=_dict_from_mapchete(path))
+
+
+@pytest.fixture
+def mvt():
+    """Fixture for mvt.mapchete."""
+    path = os.path.join(TESTDATA_DIR, "mvt.mapchete")
+    return ExampleConfig(path=path, dict=_dict_from_mapchete(path))
+
+
+@pytest.fixture
+def gpkg():
+    """Fixture for gpkg.mapchete."""
+    path = os.path.join(TESTDATA_DIR, "gpkg.mapchete")
+    return ExampleConfig(path=path, dict=_dict_from_mapchete(path))
+
+
+@pytest.fixture
+def cog():
+    """Fixture for cog.mapchete."""
+    path = os.path.join(TESTDATA_DIR, "cog.mapchete")
+    return ExampleConfig(path=path, dict=_dict_from_mapchete(path))
+
+
 @pytest.fixture
 def geojson():
     """Fixture for geojson.mapchete."""
@@ -8,6 +8,9 @@ import pytest
 from shapely import wkt
 import rasterio
 from rasterio.io import MemoryFile
+import subprocess
+import sys
+import time
 import yaml
 
 import mapchete
@@ -47,6 +50,27 @@ def test_main(mp_tmpdir):
     )
 
 
+def test_startup(record_property):
+    """Importing mapchete and running the CLI does not load heavy dependencies."""
+    for name, script in [
+        ("import_mapchete", "import mapchete"),
+        (
+            "cli_help",
+            "from mapchete.cli.main import main; "
+            "main(['--help'], standalone_mode=False)"
+        )
+    ]:
+        start = time.time()
+        loaded = subprocess.check_output([
+            sys.executable, "-c",
+            "%s; import sys; print(' '.join(sorted(sys.modules)))" % script
+        ]).decode().split()
+        # track startup time, e.g. in the junitxml report
+        record_property("%s_seconds" % name, round(time.time() - start, 3))
+        for module in ["matplotlib", "flask", "fiona", "pkg_resources"]:
+            assert module not in loaded
+
+
 def test_missing_input_file(mp_tmpdir):
     """Check if IOError is raised if input_file is invalid."""
     run_cli(
@@ -142,6 +166,23 @@ def test_execute_verbose(mp_tmpdir, example_mapchete):
     run_cli(['execute', example_mapchete.path, "-t", "10", "500", "1040", "--verbose"])
 
 
+def test_execute_gdal_opts(mp_tmpdir, example_mapchete):
+    """Using GDAL options."""
+    run_cli([
+        'execute', example_mapchete.path, "-t", "10", "500", "1040",
+        "--gdal_opt", "GDAL_CACHEMAX=64", "--gdal_opt", "GDAL_NUM_THREADS=2"
+    ])
+    run_cli(
+        [
+            'execute', example_mapchete.path, "-t", "10", "500", "1040",
+            "--gdal_opt", "GDAL_CACHEMAX"
+        ],
+        expected_exit_code=2,
+        output_contains="KEY=VALUE",
+        raise_exc=False
+    )
+
+
 def test_execute_logfile(mp_tmpdir, example_mapchete):
     """Using logfile."""
     logfile = os.path.join(mp_tmpdir, "temp.log")
@@ -342,6 +383,22 @@ def test_serve(client, mp_tmpdir):
     assert response.status_code == 404
 
 
+def test_serve_for_web_without_tile(client, mp_tmpdir, monkeypatch):
+    """Serve outputs of drivers implementing for_web(data)."""
+    from mapchete.formats.default import png
+    for_web = png.OutputData.for_web
+
+    def _for_web(self, data):
+        return for_web(self, data)
+
+    monkeypatch.setattr(png.OutputData, "for_web", _for_web)
+    response = client.get(
+        "/wmts_simple/1.0.0/dem_to_hillshade/default/WGS84/5/30/62.png"
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "image/png"
+
+
 def test_index_geojson(mp_tmpdir, cleantopo_br):
     # execute process at zoom 3
     run_cli(['execute', cleantopo_br.path, '-z', '3', '--debug'])
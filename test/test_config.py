@@ -243,3 +243,38 @@ def test_init_zoom(cleantopo_br):
 def test_process_module(process_module):
     with mapchete.open(process_module.dict) as mp:
         pass
+
+
+def test_remote_cache(cleantopo_br, http_testdata, mp_tmpdir):
+    """Read remote inputs through local cache."""
+    config = deepcopy(cleantopo_br.dict)
+    config["input"].update(file1=http_testdata.url + "/cleantopo_br.tif")
+    config.update(remote_cache=dict(mode="stage"))
+    with mapchete.open(config) as mp:
+        stage_dir = mp.config.remote_cache.path
+        assert mp.config.input[list(mp.config.input.keys())[0]].local_path.startswith(
+            stage_dir
+        )
+        assert "remote_cache" not in mp.config.params_at_zoom(5)
+        tile = mp.config.process_pyramid.tile(5, 3, 7)
+        assert mp.execute(tile).any()
+    # staged files are removed after run
+    assert not os.path.exists(stage_dir)
+    # invalid configuration
+    config.update(remote_cache=dict(mode="invalid"))
+    with pytest.raises(MapcheteConfigError):
+        mapchete.open(config)
+
+
+def test_gdal_opts(cleantopo_br):
+    """Read GDAL options from configuration and kwargs."""
+    config = deepcopy(cleantopo_br.dict)
+    config.update(gdal_opts=dict(GDAL_CACHEMAX=64, VSI_CACHE=True))
+    with mapchete.open(config, gdal_opts=dict(GDAL_CACHEMAX=128)) as mp:
+        assert mp.config.gdal_opts == dict(GDAL_CACHEMAX=128, VSI_CACHE=True)
+        assert "gdal_opts" not in mp.config.params_at_zoom(5)
+        # options are active while running the process
+        assert mp.execute((5, 3, 7)).any()
+    config.update(gdal_opts="invalid")
+    with pytest.raises(MapcheteConfigError):
+        mapchete.open(config)
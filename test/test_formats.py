@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 """Test Mapchete default formats."""
 
+import pickle
 import pytest
+import subprocess
+import sys
 from tilematrix import TilePyramid
 from rasterio.crs import CRS
 
@@ -58,6 +61,24 @@ def test_driver_from_file_errors():
         driver_from_file("invalid_extension.exe")
 
 
+def test_lazy_driver_loading(mp_tmpdir):
+    """Import only driver modules which are used."""
+    script = "; ".join([
+        "import sys",
+        "from mapchete.formats import load_output_writer",
+        "load_output_writer(dict(format='GTiff', path=%r, type='geodetic', "
+        "metatiling=1, pixelbuffer=0), readonly=True)" % mp_tmpdir,
+        "print(' '.join(sorted(m for m in sys.modules if "
+        "m.startswith('mapchete.formats.default.'))))",
+        "print('pkg_resources' in sys.modules)"
+    ])
+    modules, pkg_resources_loaded = subprocess.check_output(
+        [sys.executable, "-c", script]
+    ).decode().split("\n")[:2]
+    assert modules.split() == ["mapchete.formats.default.gtiff"]
+    assert pkg_resources_loaded == "False"
+
+
 def test_mapchete_input(mapchete_input):
     """Mapchete process as input for other process."""
     with mapchete.open(mapchete_input.path) as mp:
@@ -141,6 +162,25 @@ def test_read_from_raster_file(cleantopo_br):
             assert f.read().shape == f.read([1]).shape == f.read(1).shape
 
 
+def test_raster_file_bbox_cache(cleantopo_br):
+    """Cache bounding boxes per CRS and keep input picklable."""
+    with mapchete.open(cleantopo_br.path) as mp:
+        raster_file = mp.config.params_at_zoom(5)["input"]["file1"]
+        assert raster_file.bbox() is raster_file.bbox(out_crs=mp.config.crs)
+        assert raster_file.bbox(out_crs=3857) is raster_file.bbox(out_crs=3857)
+        assert raster_file.bbox(out_crs=3857).bounds != raster_file.bbox().bounds
+        data_tile = next(mp.get_process_tiles(5))
+        for tile in [mp.config.process_pyramid.tile(5, 0, 0), data_tile]:
+            with raster_file.open(tile) as input_tile:
+                assert input_tile.is_empty() == (
+                    not tile.bbox.intersects(raster_file.bbox())
+                )
+        # prepared geometries are not pickled
+        unpickled = pickle.loads(pickle.dumps(raster_file))
+        assert unpickled.bbox().equals(raster_file.bbox())
+        assert not unpickled.open(data_tile).is_empty()
+
+
 def test_invalid_input_type(example_mapchete):
     """Raise MapcheteDriverError."""
     # invalid input type
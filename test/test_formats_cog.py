@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""Test Cloud Optimized GeoTIFF as process output."""
+
+import numpy as np
+import os
+import pytest
+import rasterio
+from rasterio.windows import from_bounds
+
+import mapchete
+from mapchete.formats.default import cog as cog_driver
+from mapchete.errors import MapcheteConfigError
+from mapchete.io.raster import extract_from_array, prepare_array
+
+
+def _read_window(path, bounds):
+    with rasterio.open(path) as src:
+        return src.read(
+            window=from_bounds(*bounds, transform=src.transform), masked=True
+        )
+
+
+def test_output_data(mp_tmpdir, cog):
+    """Stitch process tiles of multiple workers into one GeoTIFF."""
+    with mapchete.open(cog.dict, mode="overwrite") as mp:
+        mp.batch_process(multi=2)
+        path = mp.config.output.path
+        partials_dir = mp.config.output.partials_dir
+        # workers write partial outputs
+        assert os.listdir(partials_dir)
+        assert not os.path.isfile(path)
+        expected = {
+            tile: prepare_array(mp.execute(tile), dtype="uint16")
+            for tile in mp.get_process_tiles(5)
+        }
+        output_tiles = {
+            tile: mp.config.output_pyramid.tile(*tile.id) for tile in expected
+        }
+    assert os.path.isfile(path)
+    assert not os.path.exists(partials_dir)
+    with rasterio.open(path) as src:
+        assert src.is_tiled
+        assert src.block_shapes[0] == (128, 128)
+        assert src.overviews(1) == [2, 4]
+        assert src.res[0] == mp.config.output_pyramid.pixel_x_size(5)
+        left, bottom, right, top = src.bounds
+        assert left == min(tile.left for tile in output_tiles.values())
+        assert top == max(tile.top for tile in output_tiles.values())
+    # process tiles land on whole blocks
+    for tile, data in expected.items():
+        out_tile = output_tiles[tile]
+        window = from_bounds(*out_tile.bounds, transform=src.transform)
+        assert window.col_off % 128 == 0
+        assert window.row_off % 128 == 0
+        data = extract_from_array(
+            in_raster=data, in_affine=tile.affine, out_tile=out_tile
+        )
+        assert np.array_equal(_read_window(path, out_tile.bounds), data)
+
+
+def test_continue(mp_tmpdir, cog):
+    """Extend existing GeoTIFF in subsequent runs."""
+    with mapchete.open(cog.dict, mode="overwrite") as mp:
+        first, second = list(mp.get_process_tiles(5))[:2]
+        first_bounds = mp.config.output_pyramid.tile(*first.id).bounds
+        second_bounds = mp.config.output_pyramid.tile(*second.id).bounds
+        mp.batch_process(tile=first.id)
+        path = mp.config.output.path
+    first_data = _read_window(path, first_bounds)
+    assert not first_data.mask.all()
+    with mapchete.open(cog.dict) as mp:
+        assert mp.config.output.tiles_exist(first)
+        assert not mp.config.output.tiles_exist(second)
+        mp.batch_process(tile=second.id)
+    assert np.array_equal(_read_window(path, first_bounds), first_data)
+    assert not _read_window(path, second_bounds).mask.all()
+
+
+def test_partial_readers(mp_tmpdir, cog):
+    """Load partial tile stores once and reload them after writing."""
+    with mapchete.open(cog.dict, mode="overwrite") as mp:
+        first, second = list(mp.get_process_tiles(5))[:2]
+        output = mp.config.output
+        assert not output.tiles_exist(first)
+        readers = output._partial_readers()
+        assert output._partial_readers() is readers
+        mp.batch_process(tile=first.id)
+        assert output._partial_readers() is not readers
+        assert output.tiles_exist(first)
+        assert not output.tiles_exist(second)
+        assert not output.read(
+            mp.config.output_pyramid.tile(*first.id)
+        ).mask.all()
+    assert not cog_driver._PARTIAL_READERS
+
+
+def test_existing_blocks(mp_tmpdir, cog):
+    """Look up existing tiles in block index of output GeoTIFF."""
+    with mapchete.open(cog.dict, mode="overwrite") as mp:
+        tiles = list(mp.get_process_tiles(5))
+        # output extends over tiles in between which are not written
+        mp.batch_process(tile=tiles[0].id)
+        mp.batch_process(tile=tiles[-1].id)
+        path = mp.config.output.path
+    with rasterio.open(path) as src:
+        assert src.tags()[cog_driver._SPARSE_TAG] == "YES"
+    with mapchete.open(cog.dict) as mp:
+        output = mp.config.output
+        existing = output._existing()
+        assert existing.blocks is not None
+        assert existing.blocks.any() and not existing.blocks.all()
+        exist = [output.tiles_exist(tile) for tile in tiles]
+        assert any(exist) and not all(exist)
+        for tile, tile_exists in zip(tiles, exist):
+            output_tile = mp.config.output_pyramid.tile(*tile.id)
+            assert tile_exists == (
+                not _read_window(path, output_tile.bounds).mask.all()
+            )
+        assert output._existing() is existing
+
+
+def test_lower_zoom_levels(mp_tmpdir, cog):
+    """Only store maximum zoom level and use overviews for lower zoom levels."""
+    config = cog.dict
+    config.update(zoom_levels=dict(min=4, max=5))
+    with mapchete.open(config, mode="overwrite") as mp:
+        mp.batch_process(multi=1)
+        path = mp.config.output.path
+    with rasterio.open(path) as src:
+        assert src.res[0] == mp.config.output_pyramid.pixel_x_size(5)
+        assert src.overviews(1)
+
+
+def test_invalid_config(mp_tmpdir, cog):
+    """Reject invalid output parameters."""
+    for params in [
+        dict(pixelbuffer=2),
+        dict(path=os.path.join(mp_tmpdir, "output.gpkg")),
+        dict(blocksize=100),
+        dict(blocksize=512),
+        dict(overview_resampling="foo")
+    ]:
+        config = cog.dict
+        config["output"].update(params)
+        with pytest.raises(MapcheteConfigError):
+            mapchete.open(config)
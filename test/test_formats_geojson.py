@@ -1,10 +1,19 @@
 #!/usr/bin/env python
 """Test GeoJSON as process output."""
 
+from concurrent.futures import ThreadPoolExecutor
+import fiona
+import os
+import pytest
+from rasterio.crs import CRS
 from shapely.geometry import shape
+import shutil
+import time
 
 import mapchete
 from mapchete import formats
+from mapchete.errors import MapcheteDriverError
+from mapchete.formats.default import vector_file
 from mapchete.tile import BufferedTile
 
 
@@ -41,6 +50,128 @@ def test_input_data_read(mp_tmpdir, geojson, landpoly_3857):
         assert any_data
 
 
+def test_input_data_memory_cache(mp_tmpdir, geojson, landpoly, landpoly_3857):
+    """Read vector_file input from in-memory index."""
+    for path in [landpoly, landpoly_3857]:
+        config = geojson.dict
+        config["pyramid"].update(pixelbuffer=5)
+        config["input"].update(file1=dict(format="vector_file", path=path))
+        with mapchete.open(config) as mp:
+            uncached = {
+                tile: mp.config.params_at_zoom(4)["input"]["file1"].open(tile).read()
+                for tile in mp.get_process_tiles(4)
+            }
+        config["input"].update(
+            file1=dict(format="vector_file", path=path, cache="memory")
+        )
+        with mapchete.open(config) as mp:
+            inp = mp.config.params_at_zoom(4)["input"]["file1"]
+            assert inp.cache == "memory"
+            assert inp.bbox().bounds == inp.index().bounds
+            any_data = False
+            for tile, features in uncached.items():
+                cached = inp.open(tile).read()
+                assert len(cached) == len(features)
+                for a, b in zip(cached, features):
+                    any_data = True
+                    assert a["properties"] == b["properties"]
+                    assert shape(a["geometry"]).is_valid
+                    assert shape(a["geometry"]).area == pytest.approx(
+                        shape(b["geometry"]).area, rel=1e-3
+                    )
+            assert any_data
+
+    # invalid cache mode
+    config["input"].update(
+        file1=dict(format="vector_file", path=landpoly, cache="invalid")
+    )
+    with pytest.raises(MapcheteDriverError):
+        mapchete.open(config)
+
+
+def test_input_data_sidecar(mp_tmpdir, geojson, landpoly_3857):
+    """Read vector_file input from sidecar GeoPackage."""
+    path = os.path.join(mp_tmpdir, "landpoly_3857.geojson")
+    sidecar_dir = os.path.join(mp_tmpdir, "sidecars")
+    os.makedirs(mp_tmpdir, exist_ok=True)
+    shutil.copy(landpoly_3857, path)
+    config = geojson.dict
+    config["input"].update(file1=dict(format="vector_file", path=path))
+    with mapchete.open(config) as mp:
+        uncached = {
+            tile: mp.config.params_at_zoom(4)["input"]["file1"].open(tile).read()
+            for tile in mp.get_process_tiles(4)
+        }
+    config["input"].update(
+        file1=dict(
+            format="vector_file", path=path, cache="sidecar",
+            sidecar_dir=sidecar_dir
+        )
+    )
+    with mapchete.open(config) as mp:
+        inp = mp.config.params_at_zoom(4)["input"]["file1"]
+        any_data = False
+        for tile, features in uncached.items():
+            # feature order follows the sidecar index
+            cached = inp.open(tile).read()
+            assert len(cached) == len(features)
+            if features:
+                any_data = True
+                assert sum(shape(f["geometry"]).area for f in cached) == (
+                    pytest.approx(
+                        sum(shape(f["geometry"]).area for f in features), rel=1e-3
+                    )
+                )
+        assert any_data
+        sidecar = inp.sidecar()
+        assert sidecar.startswith(sidecar_dir)
+        with fiona.open(sidecar) as src:
+            assert CRS(src.crs) == mp.config.process_pyramid.crs
+
+    # sidecar is reused by following runs
+    vector_file._SIDECARS.clear()
+    mtime = os.path.getmtime(sidecar)
+    with mapchete.open(config) as mp:
+        assert mp.config.params_at_zoom(4)["input"]["file1"].sidecar() == sidecar
+    assert os.path.getmtime(sidecar) == mtime
+
+    # and rebuilt if source changes
+    vector_file._SIDECARS.clear()
+    os.utime(path, (mtime + 10, mtime + 10))
+    with mapchete.open(config) as mp:
+        new_sidecar = mp.config.params_at_zoom(4)["input"]["file1"].sidecar()
+        assert new_sidecar != sidecar
+        assert os.path.isfile(new_sidecar)
+
+
+def test_input_data_sidecar_threads(mp_tmpdir, geojson, landpoly_3857, monkeypatch):
+    """Build sidecar only once if requested from concurrent threads."""
+    config = geojson.dict
+    config["input"].update(
+        file1=dict(
+            format="vector_file", path=landpoly_3857, cache="sidecar",
+            sidecar_dir=os.path.join(mp_tmpdir, "sidecars")
+        )
+    )
+    calls = []
+
+    def _build_sidecar(self):
+        calls.append(self.path)
+        time.sleep(0.1)
+        return self.path
+
+    monkeypatch.setattr(vector_file.InputData, "_build_sidecar", _build_sidecar)
+    with mapchete.open(config) as mp:
+        inp = mp.config.params_at_zoom(4)["input"]["file1"]
+        vector_file._SIDECARS.clear()
+        calls.clear()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            sidecars = list(executor.map(lambda _: inp.sidecar(), range(8)))
+    vector_file._SIDECARS.clear()
+    assert sidecars == [landpoly_3857] * 8
+    assert len(calls) == 1
+
+
 def test_for_web(client, mp_tmpdir):
     """Send GTiff via flask."""
     tile_base_url = '/wmts_simple/1.0.0/geojson/default/WGS84/'
@@ -118,3 +249,14 @@ def test_s3_output_data_rw(mp_s3_tmpdir, geojson_s3):
         read_output = mp.get_raw_output(tile)
         assert isinstance(read_output, list)
         assert len(read_output)
+
+
+def test_s3_write_output_data(mocked_s3, geojson):
+    """Write GeoJSON output tiles to S3."""
+    config = geojson.dict
+    config["output"].update(path=mocked_s3)
+    with mapchete.open(config) as mp:
+        tile = mp.config.process_pyramid.tile(4, 3, 7)
+        assert not mp.config.output.tiles_exist(tile)
+        mp.write(tile, mp.execute(tile))
+        assert mp.config.output.tiles_exist(tile)
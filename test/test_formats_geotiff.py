@@ -10,6 +10,7 @@ import shutil
 
 import mapchete
 from mapchete.formats.default import gtiff
+from mapchete.io.s3 import get_s3_client, split_s3_path
 from mapchete.tile import BufferedTilePyramid
 
 
@@ -173,3 +174,29 @@ def test_s3_write_output_data(gtiff_s3, s3_example_tile, mp_s3_tmpdir):
         data = mp.config.output.read(process_tile)
         assert isinstance(data, np.ndarray)
         assert not data[0].mask.all()
+
+
+def test_s3_write_output_metatiles(mocked_s3):
+    """Write all output tiles of a process metatile to S3."""
+    output = gtiff.OutputData(dict(
+        type="geodetic",
+        format="GeoTIFF",
+        path=mocked_s3,
+        pixelbuffer=0,
+        metatiling=1,
+        bands=1,
+        dtype="uint8"
+    ))
+    process_tile = BufferedTilePyramid("geodetic", metatiling=4).tile(5, 1, 1)
+    data = ma.masked_array(np.ones((1, ) + process_tile.shape, dtype="uint8"))
+    output.write(process_tile, data)
+    output_tiles = list(output.pyramid.intersecting(process_tile))
+    assert len(output_tiles) == 16
+    for output_tile in output_tiles:
+        assert output.tiles_exist(output_tile=output_tile)
+        # GDAL cannot read from mocked S3, so fetch using the client
+        bucket, key = split_s3_path(output.get_path(output_tile))
+        body = get_s3_client().get_object(Bucket=bucket, Key=key)["Body"]
+        with MemoryFile(body.read()) as memfile:
+            with memfile.open() as src:
+                assert src.read().all()
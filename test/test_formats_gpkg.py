@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""Test GeoPackage tile store as process output and input."""
+
+import numpy as np
+import os
+import pytest
+import sqlite3
+
+import mapchete
+from mapchete.errors import MapcheteConfigError
+from mapchete.io.raster import extract_from_array, prepare_array
+
+
+def _tiles_count(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_output_data(mp_tmpdir, gpkg):
+    """Write and read GeoPackage output."""
+    with mapchete.open(gpkg.dict, mode="overwrite") as mp:
+        gpkg_path = mp.config.output.path
+        connection = sqlite3.connect(gpkg_path)
+        assert connection.execute("PRAGMA application_id").fetchone()[0] == (
+            1196444487
+        )
+        assert connection.execute(
+            "SELECT data_type FROM gpkg_contents WHERE table_name = 'tiles'"
+        ).fetchone()[0] == "tiles"
+        connection.close()
+        process_tile = mp.config.process_pyramid.tile(5, 3, 7)
+        assert not mp.config.output.tiles_exist(process_tile)
+        data = prepare_array(mp.execute(process_tile), dtype="uint16")
+        mp.write(process_tile, data)
+        assert mp.config.output.tiles_exist(process_tile)
+        expected = {
+            tile: extract_from_array(
+                in_raster=data, in_affine=process_tile.affine, out_tile=tile
+            )
+            for tile in mp.config.output_pyramid.intersecting(process_tile)
+        }
+        # empty output tiles are not written
+        assert _tiles_count(gpkg_path) == len([
+            window for window in expected.values() if not window.mask.all()
+        ])
+        for tile, window in expected.items():
+            assert mp.config.output.get_path(tile) == gpkg_path
+            assert mp.config.output.tiles_exist(output_tile=tile) == (
+                not window.mask.all()
+            )
+            read = mp.config.output.read(tile)
+            assert read.shape == window.shape
+            assert np.array_equal(read.mask, window.mask)
+            assert np.array_equal(read.compressed(), window.compressed())
+        # other tiles are not affected
+        assert not mp.config.output.tiles_exist(
+            output_tile=mp.config.output_pyramid.tile(5, 0, 0)
+        )
+        assert mp.config.output.read(
+            mp.config.output_pyramid.tile(5, 0, 0)
+        ).mask.all()
+        # empty data removes existing tiles
+        mp.write(process_tile, mp.config.output.empty(process_tile))
+        assert not mp.config.output.tiles_exist(process_tile)
+        assert _tiles_count(gpkg_path) == 0
+
+
+def test_batch_process(mp_tmpdir, gpkg):
+    """Write GeoPackage from multiple processes and continue existing output."""
+    with mapchete.open(gpkg.dict) as mp:
+        mp.batch_process(zoom=3, multi=2)
+        gpkg_path = mp.config.output.path
+        written = _tiles_count(gpkg_path)
+        assert written
+    # existing tiles are skipped
+    with mapchete.open(gpkg.dict) as mp:
+        mp.batch_process(zoom=3, multi=2)
+    assert _tiles_count(gpkg_path) == written
+
+
+def test_input_data(mp_tmpdir, gpkg):
+    """Use GeoPackage as input of another process."""
+    with mapchete.open(gpkg.dict) as mp:
+        mp.batch_process(zoom=5)
+        gpkg_path = mp.config.output.path
+        expected = mp.config.output.read(mp.config.output_pyramid.tile(5, 3, 7))
+    config = gpkg.dict
+    config["input"].update(file1=gpkg_path)
+    config["output"].update(path=os.path.join(mp_tmpdir, "chained.gpkg"))
+    config["pyramid"].update(metatiling=2, pixelbuffer=0)
+    with mapchete.open(config) as mp:
+        assert mp.config.input
+        tile = mp.config.process_pyramid.tile(5, 3, 7)
+        data = mp.execute(tile)
+        assert data.shape == expected.shape
+        assert np.array_equal(data.mask, expected.mask)
+        assert np.array_equal(data.compressed(), expected.compressed())
+        # output of this process can be opened by other processes
+        mp.write(tile, data)
+        with mp.config.output.open(tile, mp) as input_tile:
+            assert not input_tile.is_empty()
+            assert np.array_equal(input_tile.read().compressed(), data.compressed())
+
+
+def test_tile_formats(mp_tmpdir, gpkg):
+    """Encode tiles as JPEG, WEBP and compressed GeoTIFF."""
+    for tile_format, bands, lossy in [
+        ("JPEG", 1, True), ("WEBP", 3, True), ("GTiff", 1, False)
+    ]:
+        config = gpkg.dict
+        config["output"].update(
+            tile_format=tile_format, bands=bands, dtype="uint8",
+            path=os.path.join(mp_tmpdir, "%s.gpkg" % tile_format)
+        )
+        with mapchete.open(config) as mp:
+            process_tile = mp.config.process_pyramid.tile(5, 3, 7)
+            band = prepare_array(mp.execute(process_tile), dtype="uint16")[0]
+            data = prepare_array([band / 10] * bands, dtype="uint8")
+            mp.write(process_tile, data)
+            tile = mp.config.output_pyramid.intersecting(process_tile)[0]
+            read = mp.config.output.read(tile)
+            expected = extract_from_array(
+                in_raster=data, in_affine=process_tile.affine, out_tile=tile
+            )
+            assert read.shape == expected.shape
+            assert read.dtype == np.uint8
+            if not lossy:
+                assert np.array_equal(read, expected)
+            web_data, mime_type = mp.config.output.for_web(read)
+            assert isinstance(web_data, bytes)
+            assert mime_type.startswith("image/")
+
+
+def test_invalid_config(mp_tmpdir, gpkg):
+    """Reject invalid output parameters."""
+    for params in [
+        dict(pixelbuffer=2),
+        dict(path=os.path.join(mp_tmpdir, "output.tif")),
+        dict(tile_format="JPEG"),
+        dict(tile_format="PNG", bands=5),
+        dict(tile_format="GIF")
+    ]:
+        config = gpkg.dict
+        config["output"].update(params)
+        with pytest.raises(MapcheteConfigError):
+            mapchete.open(config)
+
+
+def test_existing_output_differs(mp_tmpdir, gpkg):
+    """Reject existing GeoPackage with other output pyramid."""
+    with mapchete.open(gpkg.dict):
+        pass
+    config = gpkg.dict
+    config["output"].update(metatiling=4)
+    with pytest.raises(MapcheteConfigError):
+        mapchete.open(config)
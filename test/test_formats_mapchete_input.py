@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""Test other Mapchete processes as fused input."""
+
+from copy import deepcopy
+import numpy as np
+import os
+import pickle
+import pytest
+import shutil
+import yaml
+
+import mapchete
+from mapchete.errors import MapcheteConfigError, MapcheteDriverError
+from mapchete.io import _PATH_EXISTS_CACHE, set_path_exists
+
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+@pytest.fixture
+def upstream(mp_tmpdir):
+    """Process reading cleantopo_tl.tif with metatiling 1."""
+    # process modules are pickled by name, so the processes cannot share one
+    shutil.copy(
+        os.path.join(SCRIPT_DIR, "example_process.py"),
+        os.path.join(mp_tmpdir, "upstream_process.py")
+    )
+    path = os.path.join(mp_tmpdir, "upstream.mapchete")
+    with open(path, "w") as dst:
+        dst.write(yaml.dump(dict(
+            process="upstream_process.py",
+            zoom_levels=5,
+            pyramid=dict(grid="geodetic", metatiling=1),
+            input=dict(file1="../cleantopo_tl.tif"),
+            output=dict(
+                format="GTiff", path="upstream", dtype="uint16", bands=1
+            )
+        )))
+    return path
+
+
+def _config(cleantopo_tl, upstream, **params):
+    config = deepcopy(cleantopo_tl.dict)
+    config.update(
+        input=dict(file1=dict(format="Mapchete", path=upstream, **params)),
+        zoom_levels=5
+    )
+    # process tiles are larger than the input process tiles
+    config["pyramid"].update(metatiling=2, pixelbuffer=5)
+    config["output"].update(metatiling=2, pixelbuffer=0)
+    return config
+
+
+def _upstream_tiles(upstream):
+    return os.path.join(os.path.dirname(upstream), "upstream", "5")
+
+
+@pytest.mark.parametrize("multi", [1, 2])
+def test_fused(cleantopo_tl, upstream, multi):
+    """Write the same output as running the processes one after another."""
+    with mapchete.open(upstream, mode="overwrite") as mp:
+        mp.batch_process(zoom=5)
+    with mapchete.open(_config(cleantopo_tl, upstream), mode="overwrite") as mp:
+        mp.batch_process(zoom=5, multi=multi)
+        tiles = list(mp.get_process_tiles(5))
+        expected = [mp.config.output.read(tile) for tile in tiles]
+    assert not all(data.mask.all() for data in expected)
+    shutil.rmtree(_upstream_tiles(upstream))
+    for fused in [True, "continue"]:
+        with mapchete.open(
+            _config(cleantopo_tl, upstream, fused=fused), mode="overwrite"
+        ) as mp:
+            mp.batch_process(zoom=5, multi=multi)
+            for tile, data in zip(tiles, expected):
+                assert np.array_equal(mp.config.output.read(tile), data)
+        # only written with write-through
+        assert os.path.exists(_upstream_tiles(upstream)) == (fused == "continue")
+
+
+def test_cache(cleantopo_tl, upstream):
+    """Compute input process tiles once and keep a limited number."""
+    with mapchete.open(
+        _config(cleantopo_tl, upstream, fused=True, cache_size=2)
+    ) as mp:
+        mapchete_input = mp.config.params_at_zoom(5)["input"]["file1"]
+        process = mapchete_input.process
+        assert process.config.mode == "memory"
+        tile = next(mp.get_process_tiles(5))
+        with mapchete_input.open(tile) as input_tile:
+            data = input_tile.read()
+            assert data.shape[-2:] == tile.shape
+            assert len(process.process_tile_cache) == 2
+            assert np.array_equal(input_tile.read(), data)
+        # process is pickled without cached data
+        unpickled = pickle.loads(pickle.dumps(mp))
+        unpickled_process = unpickled.config.params_at_zoom(5)["input"][
+            "file1"
+        ].process
+        assert len(unpickled_process.process_tile_cache) == 0
+        with unpickled.config.params_at_zoom(5)["input"]["file1"].open(
+            tile
+        ) as input_tile:
+            assert np.array_equal(input_tile.read(), data)
+    assert not os.path.exists(_upstream_tiles(upstream))
+
+
+def test_shared_caches(cleantopo_tl, upstream):
+    """Do not clear caches of the process using the input."""
+    url = "http://example.com/cleantopo_tl.tif"
+    with mapchete.open(_config(cleantopo_tl, upstream, fused=True)) as mp:
+        mapchete_input = mp.config.params_at_zoom(5)["input"]["file1"]
+        assert not mapchete_input.process.clear_caches
+        set_path_exists(url)
+        tile = next(mp.get_process_tiles(5))
+        with mapchete_input.open(tile) as input_tile:
+            input_tile.read()
+        mapchete_input.cleanup()
+        assert url in _PATH_EXISTS_CACHE
+    assert url not in _PATH_EXISTS_CACHE
+
+
+def test_invalid_config(cleantopo_tl, upstream):
+    """Reject invalid fused parameters."""
+    for params in [
+        dict(fused="yes"), dict(fused=1), dict(fused=True, cache_size=0),
+        dict(fused=True, cache_size=True)
+    ]:
+        with pytest.raises(MapcheteDriverError) as e:
+            mapchete.open(_config(cleantopo_tl, upstream, **params))
+        assert isinstance(e.value.args[0], MapcheteConfigError)
+    with mapchete.open(_config(cleantopo_tl, upstream)) as mp:
+        process = mp.config.params_at_zoom(5)["input"]["file1"].process
+        assert process.config.mode == "readonly"
+        assert not process.with_cache
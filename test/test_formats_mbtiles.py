@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""Test MBTiles as process output and input."""
+
+import numpy as np
+import numpy.ma as ma
+import os
+import pytest
+import sqlite3
+
+import mapchete
+from mapchete.cli.default.serve import create_app
+from mapchete.errors import MapcheteConfigError
+
+
+def _query(path, statement):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(statement).fetchall()
+    finally:
+        connection.close()
+
+
+def test_output_data(mp_tmpdir, mbtiles):
+    """Write and read MBTiles output."""
+    with mapchete.open(mbtiles.dict, mode="overwrite") as mp:
+        mp.batch_process(multi=2)
+        path = mp.config.output.path
+        process_tile = mp.config.process_pyramid.tile(5, 15, 15)
+        assert mp.config.output.tiles_exist(process_tile)
+        for tile in mp.config.output_pyramid.intersecting(process_tile):
+            # rows are stored in TMS scheme
+            rows = _query(
+                path,
+                "SELECT tile_data FROM tiles WHERE zoom_level = %s "
+                "AND tile_column = %s AND tile_row = %s" % (
+                    tile.zoom, tile.col, 2 ** tile.zoom - 1 - tile.row
+                )
+            )
+            assert bool(rows) == mp.config.output.tiles_exist(output_tile=tile)
+            data = mp.config.output.read(tile)
+            assert data.shape == (4, 256, 256)
+            assert data.dtype == np.uint8
+            if rows:
+                assert rows[0][0].startswith(b"\x89PNG")
+                assert not data.mask.all()
+            else:
+                assert data.mask.all()
+    metadata = dict(_query(path, "SELECT name, value FROM metadata"))
+    assert metadata["format"] == "png"
+    assert metadata["minzoom"] == "3"
+    assert metadata["maxzoom"] == "5"
+
+
+def test_deduplicate_tiles(mp_tmpdir, mbtiles):
+    """Identical tiles share one image."""
+    with mapchete.open(mbtiles.dict, mode="overwrite") as mp:
+        path = mp.config.output.path
+        process_tile = mp.config.process_pyramid.tile(5, 14, 15)
+        mp.write(process_tile, ma.ones((3, ) + process_tile.shape) * 100)
+        assert _query(path, "SELECT COUNT(*) FROM map")[0][0] == 4
+        assert _query(path, "SELECT COUNT(*) FROM images")[0][0] == 1
+        # replaced tiles leave unused images which are removed on close
+        mp.write(process_tile, ma.ones((3, ) + process_tile.shape) * 200)
+        assert _query(path, "SELECT COUNT(*) FROM images")[0][0] == 2
+        # fully transparent tiles are removed
+        mp.write(process_tile, ma.zeros((3, ) + process_tile.shape))
+        assert not mp.config.output.tiles_exist(process_tile)
+    assert _query(path, "SELECT COUNT(*) FROM images")[0][0] == 0
+
+
+def test_input_data(mp_tmpdir, mbtiles):
+    """Use MBTiles as input of another process."""
+    with mapchete.open(mbtiles.dict, mode="overwrite") as mp:
+        mp.batch_process(zoom=5)
+        path = mp.config.output.path
+        tile = mp.config.output_pyramid.tile(5, 31, 31)
+        expected = mp.config.output.read(tile)
+    assert not expected.mask.all()
+    config = mbtiles.dict
+    config["input"].update(file1=path)
+    config["output"].update(path=os.path.join(mp_tmpdir, "chained.mbtiles"))
+    config["pyramid"].update(metatiling=1)
+    with mapchete.open(config, mode="overwrite") as mp:
+        data = mp.execute(mp.config.process_pyramid.tile(5, 31, 31))
+        assert np.array_equal(data, expected)
+        assert np.array_equal(data.mask, expected.mask)
+
+
+def test_serve(mp_tmpdir, mbtiles):
+    """Serve tiles from MBTiles output."""
+    with mapchete.open(mbtiles.dict, mode="overwrite") as mp:
+        mp.batch_process(zoom=5)
+    client = create_app(
+        mapchete_files=[mbtiles.path], mode="readonly", debug=True
+    ).test_client()
+    response = client.get("/wmts_simple/1.0.0/mbtiles/default/g/5/31/31.png")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "image/png"
+    assert response.data.startswith(b"\x89PNG")
+
+
+def test_invalid_config(mp_tmpdir, mbtiles):
+    """Reject invalid output parameters."""
+    for params in [
+        dict(metatiling=2),
+        dict(pixelbuffer=2),
+        dict(path=os.path.join(mp_tmpdir, "output.gpkg")),
+        dict(tile_format="WEBP")
+    ]:
+        config = mbtiles.dict
+        config["output"].update(params)
+        with pytest.raises(MapcheteConfigError):
+            mapchete.open(config)
+    config = mbtiles.dict
+    config["pyramid"].update(grid="geodetic")
+    with pytest.raises(MapcheteConfigError):
+        mapchete.open(config)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Test Mapbox Vector Tiles as process output."""
+
+import gzip
+import mapbox_vector_tile
+import os
+import pytest
+from shapely.geometry import shape
+
+import mapchete
+from mapchete.cli.default.serve import create_app
+from mapchete.errors import MapcheteConfigError
+
+
+def test_output_data(mp_tmpdir, mvt):
+    """Write and read MVT output."""
+    with mapchete.open(mvt.dict) as mp:
+        process_tile = mp.config.process_pyramid.tile(4, 0, 0)
+        process_output = mp.execute(process_tile)
+        mp.write(process_tile, process_output)
+        any_data = False
+        for tile in mp.config.output_pyramid.intersecting(process_tile):
+            path = mp.config.output.get_path(tile)
+            if not os.path.isfile(path):
+                continue
+            any_data = True
+            assert path.endswith(".pbf")
+            with open(path, "rb") as src:
+                assert "default" in mapbox_vector_tile.decode(src.read())
+            # features are clipped to buffered tile and quantized to tile extent
+            tolerance = tile.pixel_x_size * tile.width / 4096
+            features = mp.config.output.read(tile)
+            assert features
+            for feature in features:
+                geom = shape(feature["geometry"])
+                assert geom.within(tile.bbox.buffer(tolerance * 2))
+                assert set(feature["properties"]) <= set(["name", "id", "area"])
+            # output can be read by other processes
+            with mp.config.output.open(tile, mp) as input_tile:
+                assert not input_tile.is_empty()
+        assert any_data
+        # empty tiles are not written
+        empty_tile = mp.config.process_pyramid.tile(4, 3, 3)
+        mp.write(empty_tile, [])
+        assert not mp.config.output.tiles_exist(empty_tile)
+
+
+def test_output_data_gzip_simplify(mp_tmpdir, mvt):
+    """Write gzipped and simplified MVT output."""
+    with mapchete.open(mvt.dict) as mp:
+        process_tile = mp.config.process_pyramid.tile(4, 0, 0)
+        process_output = mp.execute(process_tile)
+        mp.write(process_tile, process_output)
+        uncompressed = {
+            tile: os.path.getsize(mp.config.output.get_path(tile))
+            for tile in mp.config.output_pyramid.intersecting(process_tile)
+            if os.path.isfile(mp.config.output.get_path(tile))
+        }
+    config = mvt.dict
+    config["output"].update(compress="gzip", simplify=4)
+    with mapchete.open(config, mode="overwrite") as mp:
+        mp.write(process_tile, process_output)
+        for tile, size in uncompressed.items():
+            path = mp.config.output.get_path(tile)
+            with open(path, "rb") as src:
+                data = src.read()
+            assert data.startswith(b"\x1f\x8b")
+            assert len(data) < size
+            decoded = mapbox_vector_tile.decode(gzip.decompress(data))
+            assert decoded["default"]["features"]
+            assert mp.config.output.read(tile)
+
+
+def test_invalid_config(mp_tmpdir, mvt):
+    """MVT output requires mercator pyramid and known compression."""
+    config = mvt.dict
+    config["output"].update(compress="lzw")
+    with pytest.raises(MapcheteConfigError):
+        mapchete.open(config)
+    config = mvt.dict
+    config["pyramid"].update(grid="geodetic")
+    with pytest.raises(ValueError):
+        mapchete.open(config)
+
+
+def test_for_web(mp_tmpdir, mvt):
+    """Send vector tiles via flask."""
+    client = create_app(
+        mapchete_files=[mvt.path], mode="overwrite", debug=True
+    ).test_client()
+    tile_base_url = '/wmts_simple/1.0.0/mvt/default/g/'
+    features = 0
+    for url in [tile_base_url + "4/3/2.pbf", tile_base_url + "4/5/1.pbf"]:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == (
+            "application/vnd.mapbox-vector-tile"
+        )
+        if response.data:
+            decoded = mapbox_vector_tile.decode(response.data)
+            features += len(decoded["default"]["features"])
+    assert features
+
+
+def test_for_web_requires_tile(mvt):
+    """Vector tiles can only be encoded for a tile."""
+    with mapchete.open(mvt.dict) as mp:
+        with pytest.raises(ValueError):
+            mp.config.output.for_web([])
+        tile = mp.config.output_pyramid.tile(4, 3, 2)
+        data, mime_type = mp.config.output.for_web([], tile=tile)
+        assert data == b""
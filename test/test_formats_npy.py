@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Test NumPy array tiles as process output and input."""
+
+import numpy as np
+import os
+import pytest
+import six
+
+import mapchete
+from mapchete.errors import MapcheteConfigError
+from mapchete.io.raster import extract_from_array, prepare_array
+
+
+def test_output_data(mp_tmpdir, npy):
+    """Write and read NumPy array tiles."""
+    with mapchete.open(npy.dict, mode="overwrite") as mp:
+        process_tile = mp.config.process_pyramid.tile(5, 7, 15)
+        assert not mp.config.output.tiles_exist(process_tile)
+        data = prepare_array(mp.execute(process_tile), dtype="uint16")
+        mp.write(process_tile, data)
+        assert mp.config.output.tiles_exist(process_tile)
+        assert os.path.isfile(
+            os.path.join(mp.config.output.path, "5", "index.sqlite")
+        )
+        for tile in mp.config.output_pyramid.intersecting(process_tile):
+            expected = extract_from_array(
+                in_raster=data, in_affine=process_tile.affine,
+                out_tile=tile
+            )
+            assert mp.config.output.tiles_exist(output_tile=tile) == (
+                not expected.mask.all()
+            )
+            if not expected.mask.all():
+                # data and mask are stored in one file
+                path = mp.config.output.get_path(tile)
+                assert np.load(path).dtype.names == ("data", "mask")
+                assert not any(
+                    name.endswith(".mask.npy")
+                    for name in os.listdir(os.path.dirname(path))
+                )
+            read = mp.config.output.read(tile)
+            assert read.shape == expected.shape
+            assert np.array_equal(read.mask, expected.mask)
+            assert np.array_equal(read.compressed(), expected.compressed())
+            if not expected.mask.all():
+                # tiles are memory mapped
+                assert isinstance(read.data.base, np.memmap)
+                # changing data does not alter stored tiles
+                read[:] = 0
+                assert np.array_equal(
+                    mp.config.output.read(tile).compressed(),
+                    expected.compressed()
+                )
+        # empty data removes existing tiles
+        mp.write(process_tile, mp.config.output.empty(process_tile))
+        assert not mp.config.output.tiles_exist(process_tile)
+        for tile in mp.config.output_pyramid.intersecting(process_tile):
+            assert not os.path.isfile(mp.config.output.get_path(tile))
+
+
+def test_continue(mp_tmpdir, npy):
+    """Skip existing tiles using the tile index."""
+    with mapchete.open(npy.dict) as mp:
+        mp.batch_process(zoom=5, multi=2)
+        tiles = list(mp.get_process_tiles(5))
+        existing = [t for t in tiles if mp.config.output.tiles_exist(t)]
+        assert existing
+    with mapchete.open(npy.dict) as mp:
+        assert all(mp.config.output.tiles_exist(t) for t in existing)
+        assert not any(
+            mp.config.output.tiles_exist(t)
+            for t in mp.config.process_pyramid.tiles_from_bounds(
+                (-180, 0, 0, 90), 5
+            )
+        )
+
+
+def test_input_data(mp_tmpdir, npy):
+    """Use NumPy array tiles as input of other processes."""
+    with mapchete.open(npy.dict) as mp:
+        mp.batch_process(zoom=5)
+        output_path = mp.config.output.path
+        tile = mp.config.output_pyramid.tile(5, 15, 31)
+        expected = mp.config.output.read(tile)
+    assert not expected.mask.all()
+    for input_path in [
+        # mapchete file
+        npy.path,
+        # tile directory
+        output_path
+    ]:
+        config = npy.dict
+        config["input"].update(file1=input_path)
+        config["output"].update(path=os.path.join(mp_tmpdir, "chained"))
+        config["pyramid"].update(metatiling=2, pixelbuffer=0)
+        with mapchete.open(config, mode="readonly") as mp:
+            process_tile = mp.config.process_pyramid.tile(*tile.id)
+            input_tile = next(six.itervalues(
+                mp.config.params_at_zoom(5)["input"]
+            )).open(process_tile)
+            assert not input_tile.is_empty()
+            data = input_tile.read()
+            assert np.array_equal(data.mask, expected.mask)
+            assert np.array_equal(data.compressed(), expected.compressed())
+            assert np.array_equal(input_tile.read(1), data[0])
+            # tiles on the same grid are not copied
+            assert isinstance(data.data.base, np.memmap)
+
+
+def test_invalid_config(mp_tmpdir, npy):
+    """Reject invalid output parameters."""
+    for param in ["bands", "dtype"]:
+        config = npy.dict
+        config["output"].pop(param)
+        with pytest.raises(MapcheteConfigError):
+            mapchete.open(config)
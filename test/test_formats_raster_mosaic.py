@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""Test raster mosaic input."""
+
+import json
+import numpy as np
+import numpy.ma as ma
+import os
+import pickle
+import pytest
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_bounds
+from shapely.geometry import box, mapping
+
+import mapchete
+from mapchete.errors import MapcheteDriverError
+from mapchete.formats.default import raster_mosaic
+from mapchete.io.raster import merge_arrays, read_raster_window
+
+
+def _write_raster(path, bounds, value, valid_rows=None):
+    data = np.full((200, 200), value, dtype="uint8")
+    if valid_rows is not None:
+        data[valid_rows:] = 0
+    with rasterio.open(
+        path, "w", driver="GTiff", width=200, height=200, count=1,
+        dtype="uint8", nodata=0, crs=CRS.from_epsg(4326),
+        transform=from_bounds(*bounds, width=200, height=200)
+    ) as dst:
+        dst.write(data, 1)
+
+
+@pytest.fixture
+def scenes(mp_tmpdir):
+    """Two overlapping scenes, the second one only valid in its upper half."""
+    paths = [
+        os.path.join(mp_tmpdir, "scenes", name) for name in ["a.tif", "b.tif"]
+    ]
+    os.makedirs(os.path.dirname(paths[0]))
+    _write_raster(paths[0], (0, 0, 10, 10), 1)
+    _write_raster(paths[1], (5, 0, 15, 10), 2, valid_rows=100)
+    return paths
+
+
+def _config(cleantopo_br, **params):
+    config = cleantopo_br.dict
+    config.update(
+        zoom_levels=5,
+        input=dict(file1=dict(format="raster_mosaic", **params))
+    )
+    config["pyramid"].update(pixelbuffer=0, metatiling=1)
+    config["output"].update(pixelbuffer=0, metatiling=1)
+    return config
+
+
+def test_merge_arrays():
+    """Merge overlapping masked arrays."""
+    a = ma.masked_array([[1, 1], [1, 1]], mask=[[False, True], [True, True]])
+    b = ma.masked_array([[3, 3], [3, 3]], mask=[[False, False], [True, True]])
+    first = merge_arrays([a, b])
+    assert first.tolist() == [[1, 3], [None, None]]
+    last = merge_arrays([a, b], method="last")
+    assert last.tolist() == [[3, 3], [None, None]]
+    assert merge_arrays([a, b], method="min").tolist() == [[1, 3], [None, None]]
+    assert merge_arrays([a, b], method="mean").tolist() == [[2, 3], [None, None]]
+    assert merge_arrays([a, b], method="mean").dtype == a.dtype
+    # input arrays are not modified
+    assert a.mask.tolist() == [[False, True], [True, True]]
+    with pytest.raises(ValueError):
+        merge_arrays([a, b], method="invalid")
+
+
+def test_read(cleantopo_br, scenes):
+    """Read and merge intersecting files."""
+    with mapchete.open(
+        _config(cleantopo_br, paths=os.path.join(
+            os.path.dirname(scenes[0]), "*.tif"
+        ))
+    ) as mp:
+        mosaic = mp.config.params_at_zoom(5)["input"]["file1"]
+        assert [path for _, path in mosaic.sources] == scenes
+        assert mp.config.area_at_zoom(5).equals(mosaic.footprint())
+        assert mosaic.bbox().equals(box(0, 0, 15, 10))
+        # tile covering both scenes
+        tile = mp.config.process_pyramid.tile(5, 15, 33)
+        a, b = [read_raster_window(path, tile) for path in scenes]
+        assert not a.mask.all() and not b.mask.all()
+        with mosaic.open(tile) as input_tile:
+            assert not input_tile.is_empty()
+            assert input_tile._paths == scenes
+            for method, expected in [
+                ("first", np.where(a.mask, b, a)),
+                ("last", np.where(b.mask, a, b)),
+                ("max", np.where(b.mask, a, b))
+            ]:
+                mosaic.method = method
+                data = input_tile.read()
+                assert data.shape == (1, ) + tile.shape
+                assert np.array_equal(data.mask, a.mask & b.mask)
+                assert np.array_equal(
+                    data.compressed(),
+                    ma.masked_array(expected, mask=a.mask & b.mask).compressed()
+                )
+            assert input_tile.read(1).shape == tile.shape
+        # tile covering only second scene
+        with mosaic.open(mp.config.process_pyramid.tile(5, 15, 34)) as input_tile:
+            assert input_tile._paths == scenes[1:]
+        # tile outside of all scenes
+        with mosaic.open(mp.config.process_pyramid.tile(5, 0, 0)) as input_tile:
+            assert input_tile.is_empty()
+            assert input_tile.read().mask.all()
+        # spatial index is not pickled
+        unpickled = pickle.loads(pickle.dumps(mosaic))
+        assert unpickled.open(tile)._paths == scenes
+
+
+def test_read_gdal_opts(cleantopo_br, scenes, monkeypatch):
+    """Read files in threads with GDAL options of the process."""
+    read = raster_mosaic.read_raster_window
+    envs = []
+
+    def _read_raster_window(*args, **kwargs):
+        envs.append(rasterio.env.getenv() if rasterio.env.hasenv() else {})
+        return read(*args, **kwargs)
+
+    monkeypatch.setattr(raster_mosaic, "read_raster_window", _read_raster_window)
+    config = _config(cleantopo_br, paths=scenes, method="max")
+    config.update(gdal_opts=dict(GDAL_CACHEMAX=123))
+    with mapchete.open(config) as mp:
+        mosaic = mp.config.params_at_zoom(5)["input"]["file1"]
+        assert mosaic.gdal_opts == dict(GDAL_CACHEMAX=123)
+        with mosaic.open(mp.config.process_pyramid.tile(5, 15, 33)) as input_tile:
+            input_tile.read()
+    assert len(envs) == 2
+    assert all(env.get("GDAL_CACHEMAX") == 123 for env in envs)
+
+
+def test_sources(mp_tmpdir, cleantopo_br, scenes):
+    """Provide files as list, glob or GeoJSON index."""
+    index_path = os.path.join(mp_tmpdir, "index.geojson")
+    with open(index_path, "w") as dst:
+        json.dump(
+            dict(
+                type="FeatureCollection",
+                features=[
+                    dict(
+                        type="Feature",
+                        geometry=mapping(geometry),
+                        properties=dict(
+                            location=os.path.relpath(path, mp_tmpdir)
+                        )
+                    )
+                    for geometry, path in [
+                        (box(0, 0, 10, 10), scenes[0]),
+                        (box(5, 5, 15, 10), scenes[1])
+                    ]
+                ]
+            ),
+            dst
+        )
+    tile_ids = []
+    for params in [
+        dict(paths=scenes[::-1]),
+        dict(paths=scenes, footprint=True),
+        dict(index=index_path, index_path_field="location")
+    ]:
+        config = _config(cleantopo_br, **params)
+        config.update(zoom_levels=6)
+        with mapchete.open(config) as mp:
+            mosaic = mp.config.params_at_zoom(6)["input"]["file1"]
+            assert sorted(path for _, path in mosaic.sources) == scenes
+            tile_ids.append(set(t.id for t in mp.get_process_tiles(6)))
+    # footprints exclude the empty half of second scene
+    assert tile_ids[1] == tile_ids[2]
+    assert tile_ids[1] < tile_ids[0]
+
+
+def test_invalid_config(cleantopo_br, scenes):
+    """Reject invalid input parameters."""
+    for params in [
+        dict(),
+        dict(paths=scenes, index="index.geojson"),
+        dict(paths=scenes, method="invalid")
+    ]:
+        with pytest.raises(MapcheteDriverError):
+            mapchete.open(_config(cleantopo_br, **params))
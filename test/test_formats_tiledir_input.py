@@ -1,12 +1,21 @@
 """Test Mapchete default formats."""
 
 from copy import deepcopy
+import numpy as np
+import os
 import pytest
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_bounds
 import shutil
 import six
+import subprocess
+import sys
 
 from mapchete.formats import available_input_formats
+from mapchete.formats.default import tile_directory
 from mapchete.errors import MapcheteDriverError
+from mapchete.tile import BufferedTilePyramid
 
 import mapchete
 
@@ -16,6 +25,15 @@ def test_driver_available():
     assert "TileDirectory" in available_input_formats()
 
 
+def test_lazy_npy_import():
+    """Only import NPY driver for NumPy array tiles."""
+    assert subprocess.check_output([
+        sys.executable, "-c",
+        "import sys; import mapchete.formats.default.tile_directory; "
+        "print('mapchete.formats.default.npy' in sys.modules)"
+    ]).decode().strip() == "False"
+
+
 def test_parse_bounds(geojson_tiledir):
     """Read and configure bounds."""
     # fall back to pyramid bounds
@@ -106,6 +124,218 @@ def test_read_remote_raster_data(mp_tmpdir, cleantopo_remote):
             for tile in mp.get_process_tiles(1)])
 
 
+@pytest.fixture
+def gradient_tiledir(mp_tmpdir, cleantopo_tl):
+    """Tile directory with buffered metatiles written from a gradient raster."""
+    path = os.path.join(mp_tmpdir, "gradient", "gradient.tif")
+    os.makedirs(os.path.dirname(path))
+    with rasterio.open(
+        path, "w", driver="GTiff", width=400, height=300, count=1,
+        dtype="uint16", nodata=0, crs=CRS.from_epsg(4326),
+        transform=from_bounds(1, 1, 21, 16, width=400, height=300)
+    ) as dst:
+        dst.write(
+            (np.arange(400 * 300).reshape(300, 400) % 60000 + 1).astype("uint16"),
+            1
+        )
+    config = deepcopy(cleantopo_tl.dict)
+    config.update(input=dict(file1=path), zoom_levels=5)
+    config["pyramid"].update(metatiling=2, pixelbuffer=10)
+    config["output"].update(
+        path=os.path.join(mp_tmpdir, "gradient_tiles"), metatiling=2,
+        pixelbuffer=10
+    )
+    with mapchete.open(config) as mp:
+        mp.batch_process(zoom=5)
+    config = deepcopy(cleantopo_tl.dict)
+    config.update(
+        input=dict(file1=dict(
+            format="TileDirectory", path=os.path.join(mp_tmpdir, "gradient_tiles"),
+            type="geodetic", metatiling=2, pixelbuffer=10, extension="tif",
+            dtype="uint16", count=1
+        )),
+        zoom_levels=5
+    )
+    config["pyramid"].update(metatiling=1, pixelbuffer=5)
+    config["output"].update(path=os.path.join(mp_tmpdir, "gradient_out"))
+    return config
+
+
+def test_read_single_pass(gradient_tiledir, monkeypatch):
+    """Copy pixels directly or warp one VRT instead of resampling twice."""
+    # tile existence is only taken from directory listings
+    monkeypatch.setattr(tile_directory, "path_exists", None)
+    listed = []
+    list_directory = tile_directory.list_directory
+
+    def _list_directory(path):
+        listed.append(path)
+        return list_directory(path)
+
+    monkeypatch.setattr(tile_directory, "list_directory", _list_directory)
+    with mapchete.open(gradient_tiledir) as mp:
+        tiledir = mp.config.params_at_zoom(5)["input"]["file1"]
+        tiles = [
+            mp.config.process_pyramid.tile(5, row, col)
+            for row in range(12, 16) for col in range(31, 36)
+        ]
+        for tile in tiles:
+            input_tile = tiledir.open(tile)
+            assert tile_directory._pixel_factor(tiledir.td_pyramid, tile) == 1
+            data = input_tile.read()
+            assert data.shape == (1, ) + tile.shape
+            mosaic = input_tile._read_mosaic()
+            assert np.array_equal(data.mask, mosaic.mask)
+            assert np.array_equal(data, mosaic)
+            vrt = input_tile._read_vrt()
+            assert np.array_equal(data.mask, vrt.mask)
+            assert np.array_equal(data, vrt)
+            assert input_tile.read(1).shape == (1, ) + tile.shape
+        assert any(not tiledir.open(tile).read().mask.all() for tile in tiles)
+        assert tiledir.open(
+            mp.config.process_pyramid.tile(5, 20, 20)
+        ).is_empty()
+        # one listing per row of the tile directory and opened tile
+        del listed[:]
+        input_tile = tiledir.open(tiles[0])
+        assert len(listed) == len(set(
+            _tile.row
+            for _tile in tiledir.td_pyramid.tiles_from_bounds(tiles[0].bounds, 5)
+        ))
+        # listings are not kept, so tiles written in the meantime are found
+        row_dir = os.path.dirname(input_tile._tiles_paths[0][1])
+        shutil.move(row_dir, row_dir + "_moved")
+        assert len(tiledir.open(tiles[0])._tiles_paths) < len(
+            input_tile._tiles_paths
+        )
+        shutil.move(row_dir + "_moved", row_dir)
+        assert len(tiledir.open(tiles[0])._tiles_paths) == len(
+            input_tile._tiles_paths
+        )
+
+
+def test_read_dst_nodata(gradient_tiledir):
+    """Set masked pixels to dst_nodata when reading pixels directly."""
+    config = deepcopy(gradient_tiledir)
+    config["input"]["file1"].update(nearest_zoom=True)
+    for zoom, resampling in [(5, "nearest"), (4, "average")]:
+        with mapchete.open(dict(config, zoom_levels=zoom)) as mp:
+            tiledir = mp.config.params_at_zoom(zoom)["input"]["file1"]
+            # tiles on the edge of the gradient raster
+            input_tiles = [
+                tiledir.open(tile) for tile in mp.get_process_tiles(zoom)
+            ]
+            input_tiles = [
+                input_tile for input_tile in input_tiles
+                if input_tile.read().mask.any() and
+                not input_tile.read().mask.all()
+            ]
+            assert input_tiles
+            for input_tile in input_tiles:
+                data = input_tile.read(resampling=resampling, dst_nodata=7)
+                assert (data.data[data.mask] == 7).all()
+                assert data.fill_value == 7
+                assert np.array_equal(
+                    data.mask, input_tile.read(resampling=resampling).mask
+                )
+
+
+def test_nodata_mask():
+    """Mask NaN nodata values."""
+    data = np.array([np.nan, 1., 0.])
+    assert tile_directory._nodata_mask(data, float("nan")).tolist() == [
+        True, False, False
+    ]
+    assert tile_directory._nodata_mask(data, 0).tolist() == [False, False, True]
+    masked = tile_directory._masked(
+        data, tile_directory._nodata_mask(data, float("nan")), -1
+    )
+    assert masked.data.tolist() == [-1., 1., 0.]
+    assert masked.mask.tolist() == [True, False, False]
+
+
+def test_pixel_factor():
+    """Detect whether pixel grids of tile directory and process tile match."""
+    geodetic = BufferedTilePyramid("geodetic", pixelbuffer=10)
+    tile = geodetic.tile(5, 10, 10)
+    assert tile_directory._pixel_factor(BufferedTilePyramid("geodetic"), tile) == 1
+    assert tile_directory._pixel_factor(
+        BufferedTilePyramid("geodetic", metatiling=4, pixelbuffer=2), tile
+    ) == 1
+    assert tile_directory._pixel_factor(
+        BufferedTilePyramid("geodetic", tile_size=512), tile
+    ) == 2
+    assert tile_directory._pixel_factor(
+        BufferedTilePyramid("geodetic"), tile, zoom=7
+    ) == 4
+    assert tile_directory._pixel_factor(
+        BufferedTilePyramid("geodetic"), tile, zoom=4
+    ) is None
+    assert tile_directory._pixel_factor(BufferedTilePyramid("mercator"), tile) is None
+
+
+def test_read_nearest_zoom(gradient_tiledir):
+    """Read from nearest available zoom level."""
+    nearest = deepcopy(gradient_tiledir)
+    nearest["input"]["file1"].update(nearest_zoom=True)
+    for zoom, source_zoom in [(3, 5), (4, 5), (5, 5), (6, 5), (7, 5)]:
+        with mapchete.open(
+            dict(nearest, zoom_levels=zoom, bounds=[2, 2, 20, 15])
+        ) as mp:
+            tiledir = mp.config.params_at_zoom(zoom)["input"]["file1"]
+            assert tiledir.available_zooms() == [5]
+            assert tiledir.source_zoom(zoom) == source_zoom
+            tiles = list(mp.get_process_tiles(zoom))
+            assert tiles
+            for tile in tiles:
+                input_tile = tiledir.open(tile)
+                assert not input_tile.is_empty()
+                for resampling in ["nearest", "average"]:
+                    data = input_tile.read(resampling=resampling)
+                    assert data.shape == (1, ) + tile.shape
+                if zoom < 5 and not (tile.pixelbuffer and tile.is_on_edge()):
+                    # averaged blocks are close to warped average
+                    vrt = input_tile._read_vrt(resampling="average")
+                    assert np.array_equal(data.mask, vrt.mask)
+                    assert np.abs(
+                        data.astype("float") - vrt.astype("float")
+                    ).max() <= 1
+            assert any(
+                not tiledir.open(tile).read().mask.all() for tile in tiles
+            )
+    # zoom levels from configuration
+    config = deepcopy(nearest)
+    config.update(zoom_levels=4)
+    config["input"]["file1"].update(zoom_levels=[5, 8])
+    with mapchete.open(config) as mp:
+        tiledir = mp.config.params_at_zoom(4)["input"]["file1"]
+        assert tiledir.available_zooms() == [5, 6, 7, 8]
+    # only zoom levels within max_zoom_distance
+    config["input"]["file1"].update(zoom_levels=None)
+    for max_zoom_distance, zoom, source_zoom in [
+        (3, 2, 5), (2, 2, 2), (1, 4, 5), (0, 4, 4)
+    ]:
+        config["input"]["file1"].update(max_zoom_distance=max_zoom_distance)
+        with mapchete.open(config) as mp:
+            tiledir = mp.config.params_at_zoom(4)["input"]["file1"]
+            assert tiledir.source_zoom(zoom) == source_zoom
+    # only read from process zoom level by default
+    config = deepcopy(gradient_tiledir)
+    config.update(zoom_levels=4)
+    with mapchete.open(config) as mp:
+        tiledir = mp.config.params_at_zoom(4)["input"]["file1"]
+        assert tiledir.source_zoom(4) == 4
+        assert all(tiledir.open(tile).is_empty() for tile in mp.get_process_tiles(4))
+    for params in [
+        dict(nearest_zoom="yes"), dict(max_zoom_distance=-1),
+        dict(max_zoom_distance=True)
+    ]:
+        config = deepcopy(gradient_tiledir)
+        config["input"]["file1"].update(params)
+        with pytest.raises(MapcheteDriverError):
+            mapchete.open(config)
+
+
 def test_parse_errors(geojson_tiledir, cleantopo_br_tiledir):
     """Different configuration exceptions."""
     # without path
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 """Test Mapchete io module."""
 
+import os
 import pytest
 import shutil
 import rasterio
@@ -8,23 +9,35 @@ import tempfile
 import numpy as np
 import numpy.ma as ma
 import fiona
-from shapely.geometry import shape, box, Polygon, MultiPolygon
+from shapely.geometry import (
+    shape, box, GeometryCollection, LineString, MultiPolygon, Point, Polygon
+)
 from shapely.ops import unary_union
 from rasterio.enums import Compression
 from rasterio.crs import CRS
+from rasterio.io import MemoryFile
 from itertools import product
+from multiprocessing import Pool
 
 from mapchete.config import MapcheteConfig
 from mapchete.tile import BufferedTilePyramid
-from mapchete.io import get_best_zoom_level, path_exists, absolute_path, read_json
+from mapchete.io import (
+    get_best_zoom_level, path_exists, absolute_path, read_json, write_json,
+    set_path_exists, clear_path_exists_cache, gdal_env
+)
+from mapchete.io import s3
+from mapchete.io.remote_cache import RemoteFileCache
+from mapchete.io.s3 import get_s3_client, split_s3_path
 from mapchete.io.raster import (
-    read_raster_window, write_raster_window, extract_from_array,
-    resample_from_array, create_mosaic, ReferencedRaster, prepare_array,
-    RasterWindowMemoryFile
+    read_raster_window, write_raster_window, write_raster_windows,
+    extract_from_array, resample_from_array, create_mosaic, ReferencedRaster,
+    prepare_array, RasterWindowMemoryFile
 )
+from mapchete.io import vector
 from mapchete.io.vector import (
-    read_vector_window, reproject_geometry, clean_geometry_type,
-    segmentize_geometry)
+    read_vector_window, reproject_geometry, reproject_geometries,
+    write_vector_window, write_vector_windows, clean_geometry_type,
+    segmentize_geometry, IndexedFeatures, _src_crs_bounds)
 
 
 def test_best_zoom_level(dummy1_tif):
@@ -211,6 +224,65 @@ def test_write_raster_window_memory():
                 in_tile=tile, in_data=data, out_profile=out_profile, out_path=path)
 
 
+def test_write_raster_window_s3(mocked_s3):
+    """Write window to S3 and read it back."""
+    tile = BufferedTilePyramid("geodetic", metatiling=4).tile(5, 1, 1)
+    data = ma.masked_array(np.ones((2, ) + tile.shape))
+    out_tile = BufferedTilePyramid("geodetic").tile(5, 5, 5)
+    out_profile = dict(
+        driver="GTiff", count=2, dtype="uint8", compress="lzw", nodata=0,
+        height=out_tile.height, width=out_tile.width, affine=out_tile.affine
+    )
+    out_path = mocked_s3 + "/5/5/5.tif"
+    write_raster_window(
+        in_tile=tile, in_data=data, out_profile=out_profile, out_tile=out_tile,
+        out_path=out_path
+    )
+    bucket, key = split_s3_path(out_path)
+    body = get_s3_client().get_object(Bucket=bucket, Key=key)["Body"].read()
+    with MemoryFile(body) as memfile:
+        with memfile.open() as src:
+            assert src.shape == out_tile.shape
+            assert src.read().all()
+            assert src.transform == out_tile.affine
+
+
+def test_write_raster_windows(mocked_s3, mp_tmpdir):
+    """Write multiple windows to S3 and local files."""
+    tile = BufferedTilePyramid("geodetic", metatiling=2).tile(5, 2, 2)
+    data = ma.masked_array(np.ones((1, ) + tile.shape))
+    out_tiles = list(BufferedTilePyramid("geodetic").intersecting(tile))
+    assert len(out_tiles) == 4
+
+    def _profile(out_tile):
+        return dict(
+            driver="GTiff", count=1, dtype="uint8", nodata=0,
+            height=out_tile.height, width=out_tile.width,
+            affine=out_tile.affine
+        )
+
+    s3_paths = [mocked_s3 + "/%s/%s/%s.tif" % t.id for t in out_tiles]
+    local_paths = [
+        os.path.join(mp_tmpdir, "%s_%s_%s.tif" % t.id) for t in out_tiles
+    ]
+    write_raster_windows(
+        in_tile=tile, in_data=data, out_windows=[
+            (out_tile, _profile(out_tile), out_path)
+            for out_tile, out_path in zip(
+                out_tiles + out_tiles, s3_paths + local_paths
+            )
+        ]
+    )
+    for out_path in s3_paths + local_paths:
+        assert path_exists(out_path)
+    # errors in upload threads are raised
+    with pytest.raises(TypeError):
+        write_raster_windows(
+            in_tile=tile, in_data=data,
+            out_windows=[(out_tiles[0], "invalid profile", s3_paths[0])]
+        )
+
+
 def test_raster_window_memoryfile():
     """Use context manager for rasterio MemoryFile."""
     tp = BufferedTilePyramid("geodetic")
@@ -615,6 +687,60 @@ def test_reproject_geometry(landpoly):
         reproject_geometry(big_box, 1.0, 1.0)
 
 
+def test_reproject_geometries(landpoly):
+    """Reproject multiple geometries at once."""
+    with fiona.open(landpoly, "r") as src:
+        geometries = [shape(f["geometry"]).buffer(0) for f in src]
+    for dst_crs in [3857, 3035, 32633, 4326]:
+        batch = reproject_geometries(geometries, 4326, dst_crs)
+        assert len(batch) == len(geometries)
+        for geometry, reprojected in zip(geometries, batch):
+            single = reproject_geometry(geometry, 4326, dst_crs)
+            assert reprojected.is_valid
+            assert reprojected.symmetric_difference(single).area < (
+                single.area * 1e-6 + 1e-6
+            )
+
+    # mixed geometry types and empty geometries
+    geometries = [
+        Point(10, 50),
+        LineString([(0, 0), (1, 1)]),
+        Polygon(),
+        GeometryCollection([Point(1, 1), LineString([(2, 2), (3, 3)])]),
+        box(-180, -90, 180, 90)
+    ]
+    batch = reproject_geometries(geometries, 4326, 3857)
+    assert [g.geom_type for g in batch] == [g.geom_type for g in geometries]
+    assert batch[0].equals_exact(reproject_geometry(geometries[0], 4326, 3857), 1e-6)
+    assert batch[2].is_empty
+    # clipped to CRS bounds
+    assert batch[4].equals(reproject_geometry(geometries[4], 4326, 3857))
+
+    # no geometries
+    assert reproject_geometries([], 4326, 3857) == []
+
+
+def test_reproject_geometries_clip():
+    """Clip with CRS bounds in source CRS."""
+    # ETRS89 bounds are valid in spherical mercator, global mercator bounds are
+    # not valid in ETRS89 and are applied in WGS84
+    assert _src_crs_bounds(CRS.from_epsg(3857), CRS.from_epsg(3035))
+    assert _src_crs_bounds(CRS.from_epsg(3035), CRS.from_epsg(3857)) is None
+    inside = reproject_geometry(box(0, 40, 10, 50), 4326, 3857)
+    crossing = reproject_geometry(box(-20, 40, 10, 50), 4326, 3857)
+    outside = reproject_geometry(box(-60, 40, -50, 50), 4326, 3857)
+    batch = reproject_geometries([inside, crossing, outside], 3857, 3035)
+    assert batch[0].equals_exact(
+        reproject_geometries([inside], 3857, 3035)[0], 1e-6
+    )
+    # clipped at the western bound
+    expected = reproject_geometry(box(-10.67, 40, 10, 50), 4326, 3035)
+    assert batch[1].symmetric_difference(expected).area < expected.area * 0.01
+    assert batch[2].is_empty
+    with pytest.raises(RuntimeError):
+        reproject_geometry(crossing, 3857, 3035, error_on_clip=True)
+
+
 def test_segmentize_geometry():
     """Segmentize function."""
     # Polygon
@@ -626,6 +752,35 @@ def test_segmentize_geometry():
         segmentize_geometry(polygon.centroid, 1)
 
 
+def test_indexed_features(monkeypatch):
+    """Query features in original order, also with STRtrees returning indices."""
+    features = [
+        (box(i, 0, i + 1, 1), dict(id=i)) for i in reversed(range(10))
+    ]
+    bbox = box(2.5, 0.2, 5.5, 0.8)
+    # in original feature order
+    expected = [5, 4, 3, 2]
+    index = IndexedFeatures(features)
+    assert [p["id"] for _, p in index.intersecting(bbox)] == expected
+
+    class _IndexTree(object):
+        def __init__(self, geoms):
+            self.geoms = geoms
+
+        def query(self, geom):
+            return np.array([
+                i for i, g in enumerate(self.geoms) if g.intersects(geom)
+            ][::-1])
+
+    monkeypatch.setattr(vector, "_STRTREE_INDICES", True)
+    monkeypatch.setattr(vector, "STRtree", _IndexTree)
+    index = IndexedFeatures(features)
+    assert index._positions is None
+    assert [p["id"] for _, p in index.intersecting(bbox)] == expected
+    assert [p["id"] for _, p in index.clipped(bbox)] == expected
+    assert not list(IndexedFeatures([]).intersecting(bbox))
+
+
 def test_clean_geometry_type():
     """Filter and break up geometries."""
     polygon = box(-18, -9, 18, 9)
@@ -682,5 +837,238 @@ def test_read_json(s3_metadata_json, http_metadata_json):
         read_json("https://ungarj.github.io/mapchete_testdata/tiled_data/raster/cleantopo/invalid_metadata.json")
 
 
+def test_s3_client(mocked_s3, monkeypatch):
+    """Share one S3 client per process."""
+    client = get_s3_client()
+    assert get_s3_client() is client
+    # forked worker processes get their own client
+    monkeypatch.setattr(s3.os, "getpid", lambda: -1)
+    assert get_s3_client() is not client
+    assert list(s3._S3_CLIENTS.keys()) == [-1]
+
+
+def test_configure_s3_client(mocked_s3):
+    """Change S3 client settings."""
+    client = get_s3_client()
+    default_opts = dict(s3.S3_CLIENT_OPTS)
+    try:
+        s3.configure_s3_client(max_pool_connections=4, max_attempts=2)
+        new_client = get_s3_client()
+        assert new_client is not client
+        assert new_client.meta.config.max_pool_connections == 4
+        with pytest.raises(TypeError):
+            s3.configure_s3_client(invalid_option=1)
+    finally:
+        s3.configure_s3_client(**default_opts)
+
+
+def test_s3_request_counts(mocked_s3):
+    """Count S3 requests by operation."""
+    s3.reset_s3_request_counts()
+    path = mocked_s3 + "/metadata.json"
+    write_json(path, dict(foo="bar"))
+    assert read_json(path) == dict(foo="bar")
+    assert path_exists(path)
+    assert not path_exists(mocked_s3 + "/invalid.json")
+    with pytest.raises(FileNotFoundError):
+        read_json(mocked_s3 + "/invalid.json")
+    counts = s3.s3_request_counts()
+    assert counts["PutObject"] == 1
+    assert counts["GetObject"] == 2
+    s3.reset_s3_request_counts()
+    assert not s3.s3_request_counts()
+
+
+def test_s3_path_exists_head(mocked_s3):
+    """Check existence of single S3 keys using HEAD requests."""
+    clear_path_exists_cache()
+    s3.reset_s3_request_counts()
+    path = mocked_s3 + "/5/12/3.tif"
+    # a key sharing the prefix must not be taken as existing file
+    write_json(path + ".aux.xml", {})
+    assert not path_exists(path)
+    assert path_exists(path + ".aux.xml")
+    assert "ListObjectsV2" not in s3.s3_request_counts()
+    assert s3.s3_request_counts()["HeadObject"] == 1
+
+
+def test_path_exists_cache(mocked_s3):
+    """Cache existence of remote paths."""
+    clear_path_exists_cache()
+    s3.reset_s3_request_counts()
+    path = mocked_s3 + "/metadata.json"
+    assert not path_exists(path)
+    assert not path_exists(path)
+    assert s3.s3_request_counts()["HeadObject"] == 1
+    # writers update the cache
+    write_json(path, {})
+    assert path_exists(path)
+    assert s3.s3_request_counts()["HeadObject"] == 1
+    set_path_exists(path, False)
+    assert not path_exists(path)
+    clear_path_exists_cache()
+    assert path_exists(path)
+    assert s3.s3_request_counts()["HeadObject"] == 2
+
+
+def test_http_path_exists(http_testdata):
+    """Check existence of HTTP files using HEAD or ranged GET requests."""
+    clear_path_exists_cache()
+    assert path_exists(http_testdata.url + "/cleantopo_br.tif")
+    assert not path_exists(http_testdata.url + "/invalid.tif")
+    assert http_testdata.requests == [
+        ("HEAD", "/cleantopo_br.tif"), ("HEAD", "/invalid.tif")
+    ]
+    # fall back to GET if HEAD is not allowed
+    clear_path_exists_cache()
+    http_testdata.head_allowed = False
+    assert path_exists(http_testdata.url + "/cleantopo_br.tif")
+    assert not path_exists(http_testdata.url + "/invalid.tif")
+    assert ("GET", "/cleantopo_br.tif") in http_testdata.requests
+    # cached
+    num_requests = len(http_testdata.requests)
+    assert path_exists(http_testdata.url + "/cleantopo_br.tif")
+    assert len(http_testdata.requests) == num_requests
+    clear_path_exists_cache()
+
+
+def test_remote_cache(http_testdata, mp_tmpdir):
+    """Read remote files through local cache."""
+    cache_dir = os.path.join(mp_tmpdir, "remote_cache")
+    url = http_testdata.url + "/cleantopo_br.tif"
+    local_path = RemoteFileCache(path=cache_dir).local_path(url)
+    assert local_path.startswith(cache_dir)
+    assert local_path.endswith(".tif")
+    with rasterio.open(local_path) as src:
+        assert src.read().any()
+    assert ("GET", "/cleantopo_br.tif") in http_testdata.requests
+    # another process finds cached file after checking remote file version
+    del http_testdata.requests[:]
+    cache = RemoteFileCache(path=cache_dir)
+    assert cache.local_path(url) == local_path
+    assert cache.local_path(url) == local_path
+    assert http_testdata.requests == [("HEAD", "/cleantopo_br.tif")]
+    # local paths and VRTs are not cached
+    assert cache.local_path("/some/local.tif") == "/some/local.tif"
+    vrt = http_testdata.url + "/some.vrt"
+    assert cache.local_path(vrt) == vrt
+    with pytest.raises(ValueError):
+        RemoteFileCache(mode="invalid")
+
+
+def test_remote_cache_eviction(http_testdata, mp_tmpdir):
+    """Evict least recently used files."""
+    cache_dir = os.path.join(mp_tmpdir, "remote_cache")
+    # space for one of both files
+    cache = RemoteFileCache(path=cache_dir, max_size=0.3)
+    br = cache.local_path(http_testdata.url + "/cleantopo_br.tif")
+    tl = cache.local_path(http_testdata.url + "/cleantopo_tl.tif")
+    assert not os.path.isfile(br)
+    assert os.path.isfile(tl)
+    # evicted files are downloaded again
+    assert os.path.isfile(cache.local_path(http_testdata.url + "/cleantopo_br.tif"))
+    # files larger than cache are read remotely
+    cache = RemoteFileCache(path=cache_dir, max_size=0.1)
+    url = http_testdata.url + "/cleantopo_br.tif"
+    assert cache.local_path(url) == url
+
+
+def test_remote_cache_stage(http_testdata):
+    """Stage small remote files once per run."""
+    cache = RemoteFileCache(mode="stage", max_file_size=0.2)
+    small = cache.local_path(http_testdata.url + "/cleantopo_br.tif")
+    assert small.startswith(cache.path)
+    assert os.path.isfile(small)
+    large = http_testdata.url + "/cleantopo_tl.tif"
+    assert cache.local_path(large) == large
+    cache.cleanup()
+    assert not os.path.exists(cache.path)
+
+
+def test_read_raster_window_remote_cache(http_testdata, mp_tmpdir, cleantopo_br_tif):
+    """Read raster window through remote cache."""
+    cache = RemoteFileCache(path=os.path.join(mp_tmpdir, "remote_cache"))
+    tile = BufferedTilePyramid("geodetic").tile(5, 5, 5)
+    assert np.array_equal(
+        read_raster_window(
+            http_testdata.url + "/cleantopo_br.tif", tile, remote_cache=cache
+        ),
+        read_raster_window(cleantopo_br_tif, tile)
+    )
+    assert ("GET", "/cleantopo_br.tif") in http_testdata.requests
+
+
+def test_gdal_env():
+    """Only enter new GDAL environment if options differ."""
+    assert not isinstance(gdal_env(), rasterio.Env)
+    assert not isinstance(gdal_env(dict()), rasterio.Env)
+    assert isinstance(gdal_env(dict(GDAL_CACHEMAX=64)), rasterio.Env)
+    with rasterio.Env(GDAL_CACHEMAX=64, GDAL_NUM_THREADS=2):
+        assert not isinstance(gdal_env(), rasterio.Env)
+        assert not isinstance(gdal_env(dict(GDAL_CACHEMAX=64)), rasterio.Env)
+        # defaults don't override active options
+        assert not isinstance(gdal_env(defaults=dict(GDAL_CACHEMAX=32)), rasterio.Env)
+        with gdal_env(dict(GDAL_CACHEMAX=32), defaults=dict(VSI_CACHE=True)):
+            assert rasterio.env.getenv()["GDAL_CACHEMAX"] == 32
+            assert rasterio.env.getenv()["VSI_CACHE"]
+            assert rasterio.env.getenv()["GDAL_NUM_THREADS"] == 2
+        assert rasterio.env.getenv()["GDAL_CACHEMAX"] == 64
+
+
+def test_worker_gdal_env():
+    """Keep GDAL environment active in worker processes."""
+    from mapchete._core import _worker_init
+    pool = Pool(1, _worker_init, (dict(GDAL_CACHEMAX=64), ))
+    try:
+        assert pool.apply(rasterio.env.getenv)["GDAL_CACHEMAX"] == 64
+    finally:
+        pool.close()
+        pool.join()
+
+
+def test_split_s3_path():
+    assert split_s3_path("s3://bucket/some/key.tif") == ("bucket", "some/key.tif")
+    with pytest.raises(ValueError):
+        split_s3_path("/some/local/path.tif")
+
+
+def test_write_vector_windows(mp_tmpdir, landpoly):
+    """Write features into multiple output tiles at once."""
+    with fiona.open(landpoly) as src:
+        features = [
+            dict(geometry=f["geometry"], properties=f["properties"]) for f in src
+        ]
+        schema = dict(src.schema)
+    process_tile = BufferedTilePyramid("geodetic", metatiling=4).tile(3, 0, 0)
+    out_pyramid = BufferedTilePyramid("geodetic")
+    out_windows = [
+        (
+            out_pyramid.tile(*tile.id),
+            os.path.join(mp_tmpdir, "%s_%s_%s.geojson" % tile.id)
+        )
+        for tile in out_pyramid.intersecting(process_tile)
+    ]
+    os.makedirs(mp_tmpdir, exist_ok=True)
+    write_vector_windows(in_data=features, out_schema=schema, out_windows=out_windows)
+    written = 0
+    for out_tile, out_path in out_windows:
+        single_path = out_path.replace(".geojson", "_single.geojson")
+        write_vector_window(
+            in_data=features, out_schema=schema, out_tile=out_tile,
+            out_path=single_path
+        )
+        assert os.path.isfile(out_path) == os.path.isfile(single_path)
+        if not os.path.isfile(out_path):
+            continue
+        with fiona.open(out_path) as batch, fiona.open(single_path) as single:
+            batch_features, single_features = list(batch), list(single)
+        assert len(batch_features) == len(single_features)
+        for a, b in zip(batch_features, single_features):
+            written += 1
+            assert a["properties"] == b["properties"]
+            assert shape(a["geometry"]).equals(shape(b["geometry"]))
+            assert shape(a["geometry"]).within(out_tile.bbox.buffer(1e-9))
+    assert written
+
 # TODO write_vector_window()
 # TODO extract_from_tile()
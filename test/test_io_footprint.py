@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""Test valid-data footprints of inputs."""
+
+import fiona
+import numpy as np
+import os
+import pickle
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_bounds
+import shutil
+from shapely.geometry import box, Polygon, shape
+
+import mapchete
+from mapchete.io.footprint import (
+    cached_footprint, raster_footprint, vector_footprint
+)
+
+
+SCRIPTDIR = os.path.dirname(os.path.realpath(__file__))
+TESTDATA_DIR = os.path.join(SCRIPTDIR, "testdata")
+
+
+def _triangle_raster(path):
+    """Write raster with valid data only in the lower left triangle."""
+    data = np.tril(np.ones((400, 400), dtype="uint8"))
+    with rasterio.open(
+        path, "w", driver="GTiff", width=400, height=400, count=1,
+        dtype="uint8", nodata=0, crs=CRS.from_epsg(4326),
+        transform=from_bounds(0, 0, 20, 20, 400, 400)
+    ) as dst:
+        dst.write(data, 1)
+    return Polygon([(0, 20), (0, 0), (20, 0)])
+
+
+def test_raster_footprint(mp_tmpdir):
+    """Derive raster footprint from dataset mask."""
+    path = os.path.join(mp_tmpdir, "triangle.tif")
+    valid = _triangle_raster(path)
+    footprint, crs = raster_footprint(path, size=100)
+    assert crs == CRS.from_epsg(4326)
+    assert footprint.buffer(1e-9).contains(valid)
+    assert footprint.area < box(0, 0, 20, 20).area * 0.7
+    # rasters without nodata are covered completely
+    footprint, _ = raster_footprint(
+        os.path.join(TESTDATA_DIR, "cleantopo_br.tif")
+    )
+    with rasterio.open(os.path.join(TESTDATA_DIR, "cleantopo_br.tif")) as src:
+        assert footprint.equals(box(*src.bounds))
+
+
+def test_vector_footprint(mp_tmpdir):
+    """Derive coarse footprint from features."""
+    path = os.path.join(TESTDATA_DIR, "landpoly.geojson")
+    footprint, crs = vector_footprint(path, size=256)
+    assert crs == CRS.from_epsg(4326)
+    with fiona.open(path) as src:
+        features = [shape(f["geometry"]) for f in src]
+        bbox = box(*src.bounds)
+    for feature in features:
+        assert footprint.buffer(1e-9).contains(feature)
+    assert footprint.area < bbox.area
+
+
+def test_cached_footprint(mp_tmpdir):
+    """Cache footprints next to file until it changes."""
+    path = os.path.join(mp_tmpdir, "triangle.tif")
+    _triangle_raster(path)
+    calls = []
+
+    def _footprint(p):
+        calls.append(p)
+        return raster_footprint(p, size=100)
+
+    footprint, crs = cached_footprint(path, _footprint)
+    assert os.path.isfile(path + ".footprint.geojson")
+    cached, cached_crs = cached_footprint(path, _footprint)
+    assert len(calls) == 1
+    assert cached.equals(footprint)
+    assert cached_crs == crs
+    # changed files get a new footprint
+    _triangle_raster(path)
+    os.utime(path, (0, 0))
+    cached_footprint(path, _footprint)
+    assert len(calls) == 2
+    # files in read-only directories are cached in cache_dir
+    readonly_dir = os.path.join(mp_tmpdir, "readonly")
+    os.makedirs(readonly_dir)
+    readonly_path = os.path.join(readonly_dir, "triangle.tif")
+    shutil.copy(path, readonly_path)
+    os.chmod(readonly_dir, 0o555)
+    try:
+        if not os.access(readonly_dir, os.W_OK):
+            cache_dir = os.path.join(mp_tmpdir, "footprints")
+            cached_footprint(readonly_path, _footprint, cache_dir=cache_dir)
+            assert len(os.listdir(cache_dir)) == 2
+    finally:
+        os.chmod(readonly_dir, 0o755)
+
+
+def test_process_area(mp_tmpdir, cleantopo_br):
+    """Limit process tiles to raster footprint."""
+    path = os.path.join(mp_tmpdir, "triangle.tif")
+    _triangle_raster(path)
+    config = cleantopo_br.dict
+    config.update(
+        zoom_levels=7,
+        input=dict(file1=dict(format="raster_file", path=path))
+    )
+    config["pyramid"].update(pixelbuffer=0, metatiling=1)
+    config["output"].update(pixelbuffer=0, metatiling=1)
+    with mapchete.open(config) as mp:
+        bbox_tiles = set(t.id for t in mp.get_process_tiles(7))
+        assert mp.count_tiles(7, 7) == len(bbox_tiles)
+    config["input"]["file1"].update(footprint=True)
+    with mapchete.open(config) as mp:
+        raster_file = mp.config.params_at_zoom(7)["input"]["file1"]
+        assert mp.config.area_at_zoom(7).equals(raster_file.footprint())
+        footprint_tiles = set(t.id for t in mp.get_process_tiles(7))
+        assert mp.count_tiles(7, 7) == len(footprint_tiles)
+        assert footprint_tiles < bbox_tiles
+        # skipped tiles do not contain any data
+        for tile_id in bbox_tiles - footprint_tiles:
+            tile = mp.config.process_pyramid.tile(*tile_id)
+            with raster_file.open(tile) as input_tile:
+                assert input_tile.is_empty()
+                assert input_tile.read().mask.all()
+        for tile_id in footprint_tiles:
+            with raster_file.open(
+                mp.config.process_pyramid.tile(*tile_id)
+            ) as input_tile:
+                assert not input_tile.is_empty()
+        # footprints are pickled along with input
+        unpickled = pickle.loads(pickle.dumps(raster_file))
+        assert unpickled.footprint().equals(raster_file.footprint())
+
+
+def test_vector_process_area(mp_tmpdir, geojson):
+    """Limit process tiles to vector footprint."""
+    path = os.path.join(mp_tmpdir, "landpoly.geojson")
+    shutil.copy(os.path.join(TESTDATA_DIR, "landpoly.geojson"), path)
+    config = geojson.dict
+    config.update(input=dict(file1=dict(format="vector_file", path=path)))
+    with mapchete.open(config) as mp:
+        bbox_tiles = set(t.id for t in mp.get_process_tiles(4))
+    config["input"]["file1"].update(footprint=True)
+    with mapchete.open(config) as mp:
+        vector_file = mp.config.params_at_zoom(4)["input"]["file1"]
+        footprint_tiles = set(t.id for t in mp.get_process_tiles(4))
+        assert footprint_tiles < bbox_tiles
+        for tile_id in bbox_tiles - footprint_tiles:
+            tile = mp.config.process_pyramid.tile(*tile_id)
+            with vector_file.open(tile) as input_tile:
+                assert input_tile.is_empty()
+    assert os.path.isfile(path + ".footprint.geojson")
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Test per-worker cache of decoded input arrays."""
+
+import numpy as np
+import os
+import pickle
+import pytest
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_bounds
+
+import mapchete
+from mapchete.errors import MapcheteConfigError
+from mapchete.io.input_cache import InputCache, input_cache
+
+
+@pytest.fixture
+def bands(mp_tmpdir):
+    """Raster with three bands of different values."""
+    path = os.path.join(mp_tmpdir, "bands", "bands.tif")
+    os.makedirs(os.path.dirname(path))
+    with rasterio.open(
+        path, "w", driver="GTiff", width=200, height=200, count=3,
+        dtype="uint8", nodata=0, crs=CRS.from_epsg(4326),
+        transform=from_bounds(1, 1, 11, 11, width=200, height=200)
+    ) as dst:
+        for band in range(1, 4):
+            dst.write(np.full((200, 200), band, dtype="uint8"), band)
+    return path
+
+
+def _config(cleantopo_tl, inputs, **params):
+    config = cleantopo_tl.dict
+    config.update(input=inputs, zoom_levels=5, **params)
+    config["pyramid"].update(metatiling=1)
+    config["output"].update(metatiling=1)
+    return config
+
+
+def test_input_cache():
+    """Evict least recently used arrays if cache exceeds its size."""
+    cache = InputCache(max_size=2.5 / 1024)
+    arrays = {key: np.zeros(1024, dtype="uint8") for key in "abc"}
+    for key in "aba":
+        assert cache.get(key, lambda: arrays[key]) is arrays[key]
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache.nbytes == 2048
+    # "b" is least recently used and evicted
+    cache.get("c", lambda: arrays["c"])
+    assert len(cache) == 2
+    cache.get("a", lambda: arrays["a"])
+    assert (cache.hits, cache.misses) == (2, 3)
+    cache.get("b", lambda: arrays["b"])
+    assert (cache.hits, cache.misses) == (2, 4)
+    # arrays exceeding the cache size are not cached
+    cache.get("e", lambda: np.zeros(4096, dtype="uint8"))
+    assert cache.nbytes == 2048
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_worker_cache():
+    """Unpickle as cache of current process."""
+    cache = input_cache(1)
+    assert input_cache(1) is cache
+    assert pickle.loads(pickle.dumps(cache)) is cache
+    assert input_cache(2) is not cache
+    other = input_cache(1, cache_id="other")
+    assert other is not cache
+    assert pickle.loads(pickle.dumps(other)) is other
+    other.close()
+    assert input_cache(1, cache_id="other") is not other
+
+
+def test_process_caches(cleantopo_tl, bands):
+    """Do not share caches between processes."""
+    config = _config(cleantopo_tl, dict(file1=bands), input_cache=True)
+    with mapchete.open(config) as mp:
+        cache = mp.config.input_cache
+        tile = mp.config.process_pyramid.tile(5, 14, 32)
+        with mp.config.params_at_zoom(5)["input"]["file1"].open(tile) as input_tile:
+            input_tile.read()
+        assert len(cache) == 1
+        with mapchete.open(config) as other:
+            assert other.config.input_cache is not cache
+            assert len(cache) == 1
+        assert len(cache) == 1
+    assert len(cache) == 0
+
+
+def test_read(cleantopo_tl, bands):
+    """Read all bands once and return copies of requested bands."""
+    with mapchete.open(
+        _config(cleantopo_tl, dict(file1=bands), input_cache=True)
+    ) as mp:
+        raster_file = mp.config.params_at_zoom(5)["input"]["file1"]
+        cache = raster_file.input_cache
+        assert cache is mp.config.input_cache
+        tile = mp.config.process_pyramid.tile(5, 14, 32)
+        with raster_file.open(tile) as input_tile:
+            data = input_tile.read()
+            assert data.shape == (3, ) + tile.shape
+            assert not data.mask.all()
+            assert (cache.hits, cache.misses) == (0, 1)
+            band = input_tile.read(2)
+            assert band.shape == tile.shape
+            assert np.array_equal(band, data[1])
+            assert np.array_equal(input_tile.read([3, 1]), data[[2, 0]])
+            assert cache.hits == 2
+            # returned arrays can be modified
+            band[:] = 0
+            assert input_tile.read(2).max() == 2
+        raster_file.input_cache = None
+        with raster_file.open(tile) as input_tile:
+            assert np.array_equal(input_tile.read(), data)
+            assert np.array_equal(input_tile.read(2), data[1])
+    assert len(cache) == 0
+
+
+def test_read_mosaic(cleantopo_tl, bands):
+    """Merge all bands of a mosaic once."""
+    with mapchete.open(_config(
+        cleantopo_tl, dict(file1=dict(format="raster_mosaic", paths=[bands])),
+        input_cache=1
+    )) as mp:
+        mosaic = mp.config.params_at_zoom(5)["input"]["file1"]
+        tile = mp.config.process_pyramid.tile(5, 14, 32)
+        with mosaic.open(tile) as input_tile:
+            data = input_tile.read()
+            assert np.array_equal(input_tile.read(3), data[2])
+            assert np.array_equal(input_tile.read([2]), data[[1]])
+        assert (mosaic.input_cache.hits, mosaic.input_cache.misses) == (2, 1)
+
+
+def test_process_info(mp_tmpdir, cleantopo_tl):
+    """Report cache hits per process tile."""
+    with mapchete.open(
+        _config(cleantopo_tl, cleantopo_tl.dict["input"], input_cache=16),
+        mode="overwrite"
+    ) as mp:
+        process_infos = list(mp.batch_processor(zoom=5))
+        assert process_infos
+        for process_info in process_infos:
+            assert "input cache hits: 0/1" in process_info.process_msg
+
+
+def test_invalid_config(cleantopo_tl):
+    """Reject invalid input_cache parameters."""
+    for max_size in ["256", -1, dict(max_size=1)]:
+        config = cleantopo_tl.dict
+        config.update(input_cache=max_size)
+        with pytest.raises(MapcheteConfigError):
+            mapchete.open(config)
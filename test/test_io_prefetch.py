@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Test prefetching inputs of upcoming process tiles."""
+
+import numpy as np
+import pytest
+
+import mapchete
+from mapchete.errors import MapcheteConfigError
+from mapchete.io.prefetch import InputPrefetcher
+
+
+def _data_tiles(mp, zoom=5):
+    return [
+        tile for tile in mp.get_process_tiles(zoom)
+        if not mp.execute(tile).mask.all()
+    ]
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_prefetch(cleantopo_tl, threads):
+    """Serve reads of upcoming tiles from prefetched data."""
+    config = cleantopo_tl.dict
+    config["pyramid"].update(metatiling=1)
+    with mapchete.open(config) as mp:
+        tiles = _data_tiles(mp)
+        assert len(tiles) > 2
+        expected = [mp.execute(tile) for tile in tiles]
+        # with one thread, reads are still queued when their tile is processed
+        with InputPrefetcher(
+            mp.config, depth=2, threads=threads
+        ) as prefetcher:
+            mp._prefetcher = prefetcher
+            processed = []
+            for tile in prefetcher.tiles(iter(tiles)):
+                processed.append(tile)
+                data = mp.execute(tile)
+                assert np.array_equal(data, expected[len(processed) - 1])
+            mp._prefetcher = None
+        assert processed == tiles
+        # first read is used to learn which inputs are read
+        assert prefetcher.misses == 1
+        assert prefetcher.hits == len(tiles) - 1
+        assert prefetcher._bytes == 0
+
+
+def test_prefetch_max_size(cleantopo_tl):
+    """Do not prefetch more data than allowed."""
+    config = cleantopo_tl.dict
+    config["pyramid"].update(metatiling=1)
+    with mapchete.open(config) as mp:
+        tiles = _data_tiles(mp)
+        with InputPrefetcher(mp.config, max_size=0) as prefetcher:
+            mp._prefetcher = prefetcher
+            for tile in prefetcher.tiles(tiles):
+                mp.execute(tile)
+            mp._prefetcher = None
+        # only tiles scheduled before the data size was known are prefetched
+        assert prefetcher.hits == 1
+        assert prefetcher.misses == len(tiles) - 1
+        assert prefetcher._bytes == 0
+
+
+@pytest.mark.parametrize("multi", [1, 2])
+def test_batch_process(mp_tmpdir, cleantopo_tl, multi):
+    """Process with prefetching using one or more workers."""
+    with mapchete.open(cleantopo_tl.dict, mode="overwrite") as mp:
+        mp.batch_process(zoom=5, multi=multi)
+        tiles = list(mp.get_process_tiles(5))
+        expected = [mp.config.output.read(tile) for tile in tiles]
+    config = cleantopo_tl.dict
+    config.update(prefetch=dict(depth=2, batch_size=2))
+    with mapchete.open(config, mode="overwrite") as mp:
+        mp.batch_process(zoom=5, multi=multi)
+        for tile, data in zip(tiles, expected):
+            assert np.array_equal(mp.config.output.read(tile), data)
+
+
+def test_invalid_config(cleantopo_tl):
+    """Reject invalid prefetch parameters."""
+    for params in [
+        "yes", dict(depth=0), dict(max_size=-1), dict(threads=1.5),
+        dict(invalid=1)
+    ]:
+        config = cleantopo_tl.dict
+        config.update(prefetch=params)
+        with pytest.raises(MapcheteConfigError):
+            mapchete.open(config)
+    config = cleantopo_tl.dict
+    config.update(prefetch=True)
+    with mapchete.open(config) as mp:
+        assert mp.config.prefetch["depth"] == 1
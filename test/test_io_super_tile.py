@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""Test reading inputs once for groups of neighbouring process tiles."""
+
+import numpy as np
+import os
+import pytest
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_bounds
+
+import mapchete
+from mapchete.errors import MapcheteConfigError
+from mapchete.io.super_tile import SuperTileReader, super_tiles
+from mapchete.tile import BufferedTilePyramid, SuperTile
+
+
+@pytest.fixture
+def gradient(mp_tmpdir):
+    """Raster in the middle of the pyramid with distinct pixel values."""
+    path = os.path.join(mp_tmpdir, "gradient", "gradient.tif")
+    os.makedirs(os.path.dirname(path))
+    data = (np.arange(400 * 300).reshape(300, 400) % 60000 + 1).astype("uint16")
+    with rasterio.open(
+        path, "w", driver="GTiff", width=400, height=300, count=1,
+        dtype="uint16", nodata=0, crs=CRS.from_epsg(4326),
+        transform=from_bounds(1, 1, 21, 16, width=400, height=300)
+    ) as dst:
+        dst.write(data, 1)
+    return path
+
+
+def _config(cleantopo_tl, path, **params):
+    config = cleantopo_tl.dict
+    config.update(input=dict(file1=path), zoom_levels=5, **params)
+    config["pyramid"].update(metatiling=1)
+    config["output"].update(metatiling=1)
+    return config
+
+
+def test_super_tile():
+    """Cover buffered bounds of all tiles."""
+    pyramid = BufferedTilePyramid("geodetic", pixelbuffer=10)
+    tiles = [pyramid.tile(5, row, col) for row, col in [(5, 6), (5, 7), (6, 6)]]
+    super_tile = SuperTile(tiles)
+    assert super_tile.bounds == (
+        tiles[0].bounds.left, tiles[2].bounds.bottom,
+        tiles[1].bounds.right, tiles[0].bounds.top
+    )
+    assert super_tile.shape == (512 + 20, 512 + 20)
+    assert super_tile.affine.c == super_tile.bounds.left
+    assert not super_tile.is_on_edge()
+    assert SuperTile([pyramid.tile(5, 0, 6)]).is_on_edge()
+    with pytest.raises(ValueError):
+        SuperTile([])
+    with pytest.raises(ValueError):
+        SuperTile([tiles[0], pyramid.tile(4, 5, 6)])
+
+
+def test_super_tiles():
+    """Group neighbouring tiles."""
+    pyramid = BufferedTilePyramid("geodetic")
+    tiles = [
+        pyramid.tile(5, row, col) for row in range(3, 6) for col in range(2, 5)
+    ]
+    groups = [
+        [(t.row, t.col) for t in group] for group in super_tiles(tiles, 2)
+    ]
+    assert groups == [
+        [(3, 2), (3, 3)],
+        [(3, 4)],
+        [(4, 2), (4, 3), (5, 2), (5, 3)],
+        [(4, 4), (5, 4)]
+    ]
+    assert len(list(super_tiles(tiles, 3))) == 2
+
+
+def test_read(cleantopo_tl, gradient):
+    """Serve reads of tiles as views on one read."""
+    with mapchete.open(_config(cleantopo_tl, gradient)) as mp:
+        tiles = [mp.config.process_pyramid.tile(5, row, col) for row, col in [
+            (13, 32), (13, 33), (14, 32), (14, 33)
+        ]]
+        raster_file = mp.config.params_at_zoom(5)["input"]["file1"]
+        with SuperTileReader(mp.config, tiles) as reader:
+            for tile in tiles:
+                input_tile = raster_file.open(tile)
+                super_input_tile = reader.open("file1", input_tile)
+                assert super_input_tile.is_empty() == input_tile.is_empty()
+                data = super_input_tile.read()
+                assert not data.mask.all()
+                assert np.array_equal(data, input_tile.read())
+                assert np.array_equal(data.mask, input_tile.read().mask)
+                # data is not shared with other tiles
+                data[:] = 1
+            assert reader.misses == 1
+            assert reader.hits == 3
+        # super-tiles touching the pyramid edge are read per tile
+        edge_tiles = [mp.config.process_pyramid.tile(5, 0, col) for col in (0, 1)]
+        with SuperTileReader(mp.config, edge_tiles) as reader:
+            input_tile = raster_file.open(edge_tiles[0])
+            assert reader.open("file1", input_tile) is input_tile
+
+
+@pytest.mark.parametrize("multi", [1, 2])
+def test_batch_process(mp_tmpdir, cleantopo_tl, gradient, multi):
+    """Write the same output as processing tiles individually."""
+    with mapchete.open(
+        _config(cleantopo_tl, gradient), mode="overwrite"
+    ) as mp:
+        mp.batch_process(zoom=5, multi=multi)
+        tiles = list(mp.get_process_tiles(5))
+        expected = [mp.config.output.read(tile) for tile in tiles]
+    assert len(tiles) > 4
+    assert not any(data.mask.all() for data in expected)
+    for size in [2, 3]:
+        with mapchete.open(
+            _config(cleantopo_tl, gradient, super_tile=size), mode="overwrite"
+        ) as mp:
+            mp.batch_process(zoom=5, multi=multi)
+            for tile, data in zip(tiles, expected):
+                assert np.array_equal(mp.config.output.read(tile), data)
+
+
+def test_invalid_config(cleantopo_tl):
+    """Reject invalid super_tile parameters."""
+    for super_tile in [0, 1.5, "2", True]:
+        config = cleantopo_tl.dict
+        config.update(super_tile=super_tile)
+        with pytest.raises(MapcheteConfigError):
+            mapchete.open(config)
+    config = cleantopo_tl.dict
+    config.update(super_tile=2, prefetch=True)
+    with pytest.raises(MapcheteConfigError):
+        mapchete.open(config)
+    config = cleantopo_tl.dict
+    config.update(super_tile=1)
+    with mapchete.open(config) as mp:
+        assert mp.config.super_tile is None